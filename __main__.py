@@ -1,7 +1,7 @@
 import argparse
 import sys
 
-from .main.drivers.driver import run
+from .main.drivers.driver import run, replay
 
 
 def cli_run(args):
@@ -21,14 +21,34 @@ def cli_run(args):
 
     """
     run(args.obs_tickets, data=args.data, config=args.config, _filter=args.filter, logger=args.logger,
-        shutdown=args.shutdown, calibration=args.calibration, focus=args.focus)
+        shutdown=args.shutdown, calibration=args.calibration, focus=args.focus, backlash=args.backlash)
+
+
+def cli_replay(args):
+    """
+    Description
+    -----------
+    Passes the CLI arguments into the replay function in driver.
+
+    Parameters
+    ----------
+    args : ANY TYPE
+        Arguments passed in from the command line.
+
+    Returns
+    -------
+    None.
+
+    """
+    replay(args.trace, args.settings, config=args.config, logger=args.logger, processes=args.processes,
+           output=args.output)
 
 
 def main():
     """
     Description
     -----------
-    Defines the 'run' CLI command and arguments.
+    Defines the 'run' and 'replay' CLI commands and arguments.
 
     Returns
     -------
@@ -57,7 +77,24 @@ def main():
     run_driver.add_argument('--nofocus', '-nf', action='store_false', dest='focus',
                             help='Use this option if you do not want to perform the automatic focus procedure at the'
                                  'beginning of the night.  Continuous focusing will still be enabled.')
+    run_driver.add_argument('--backlash', '-b', action='store_true', dest='backlash',
+                            help='Use this option to measure the focuser backlash after the first automatic focus, '
+                                 'and save it to the general config file.')
     run_driver.set_defaults(func=cli_run)
+    replay_driver = subparsers.add_parser('replay', help='Replay recorded weather conditions with different settings')
+    replay_driver.add_argument('trace', help='Path to a weather history SQLite file, or a CSV or JSON trace.')
+    replay_driver.add_argument('--set', '-s', metavar='NAME=VALUES', dest='settings', action='append',
+                               help='Config parameter and comma separated values to try, i.e. humidity_limit=80,85,90.'
+                                    '  May be given more than once; every combination is replayed.')
+    replay_driver.add_argument('--config', '-c', metavar='PATH', dest='config',
+                               help='Manual file path to the general config json file.')
+    replay_driver.add_argument('--logger', '-l', metavar='PATH', dest='logger',
+                               help='Manual file path to the logging config json file.')
+    replay_driver.add_argument('--processes', '-p', type=int, dest='processes',
+                               help='Number of worker processes.  Defaults to one per core.')
+    replay_driver.add_argument('--output', '-o', metavar='PATH', dest='output',
+                               help='CSV file to save the results to.')
+    replay_driver.set_defaults(func=cli_replay)
     
     args = parser.parse_args()
     args.func(args)
@@ -22,7 +22,16 @@ class Config:
                  guiding_threshold: Optional[float] = None, guider_ra_dampening: Optional[float] = None,
                  guider_dec_dampening: Optional[float] = None, guider_max_move: Optional[float] = None,
                  guider_angle: Optional[float] = None, data_directory: Optional[str] = None,
-                 calibration_time: Optional[str] = None, calibration_num: Optional[int] = None):
+                 calibration_time: Optional[str] = None, calibration_num: Optional[int] = None,
+                 cloud_cover_radius: Optional[Union[int, float]] = None, radar_zoom: Optional[int] = None,
+                 radar_radius: Optional[Union[int, float]] = None, radar_lead_time: Optional[Union[int, float]] = None,
+                 weather_freq_min: Optional[Union[int, float]] = None,
+                 weather_freq_max: Optional[Union[int, float]] = None, weather_trend_lead: Optional[int] = None,
+                 weather_url: Optional[str] = None, backup_weather_url: Optional[str] = None,
+                 rain_url: Optional[str] = None, radar_tile_url: Optional[str] = None,
+                 cloud_image_url: Optional[str] = None, internet_check_url: Optional[str] = None,
+                 focus_tolerance: Optional[Union[int, float]] = None, focus_backlash: Optional[int] = None,
+                 focus_backlash_direction: Optional[str] = None, guider_method: Optional[str] = None):
         """
 
         Parameters
@@ -44,7 +53,8 @@ class Config:
         wind_limit : INT, optional
             Limit for wind speed in mph while observing.  Our default is 20 mph.
         weather_freq : INT, optional
-            Frequency of weather checks in minutes.  Our default is 10 minutes.
+            Normal frequency of weather checks in minutes.  The checks are made more or less often than this depending on
+            how close conditions are to the limits.  Our default is 15 minutes.
         cloud_cover_limit : FLOAT, optional
             Limit for percentage of sky around Fairfax to be covered by clouds before closing up.  Our default is 75%.
         user_agent : STR, optional
@@ -67,7 +77,8 @@ class Config:
         focus_temperature_constant : FLOAT, optional
             Relationship between focuser steps and degrees Fahrenheit, in steps/degF.  Our default is 2 steps/degF.
         focus_iterations : INT, optional
-            The total number of exposures to take at the beginning of the night while focusing.  Our default is 11.
+            The most exposures to take at the beginning of the night while focusing.  The search stops sooner once the
+            best focus is known to within focus_tolerance.  Our default is 11.
         focus_adjust_frequency : FLOAT or INT, optional
             How often the focus will adjust over the course of the night, in minutes.  Our default is 15 minutes.
         focus_max_distance : INT, optional
@@ -96,6 +107,52 @@ class Config:
             The number of darks and flats that should be taken per target.  Note that there will be one set of flats
             with this number of exposures, but two sets of darks, each with this number of exposures: one to match
             the flat exposure time and the other to match the science exposure time.  Our default is 10.
+        cloud_cover_radius : INT or FLOAT, optional
+            Radius in km around the site over which cloud cover is measured from the GOES satellite images.  Our default
+            is 50 km.
+        radar_zoom : INT, optional
+            Zoom level of the weather.com radar tiles that are downloaded around the site.  Our default is 10.
+        radar_radius : INT or FLOAT, optional
+            Radius in km around the site that is checked for rain on the radar.  Rain closer to the site counts for
+            more.  Our default is 30 km.
+        radar_lead_time : INT or FLOAT, optional
+            How many minutes ahead of the predicted arrival of rain at the site to close up.  Our default is 20 minutes.
+        weather_freq_min : INT or FLOAT, optional
+            Shortest time in minutes between weather checks, used when conditions are close to or trending toward the
+            limits, or while waiting to reopen.  Our default is 3 minutes.
+        weather_freq_max : INT or FLOAT, optional
+            Longest time in minutes between weather checks, used when conditions are far from the limits.  Our default
+            is 30 minutes.
+        weather_trend_lead : INT, optional
+            If humidity or wind is trending toward its limit fast enough to reach it within this many minutes, closes
+            ahead of time.  Our default is 15 minutes.
+        weather_url : STR, optional
+            Url of the primary weather station page (GMU COS weather station).  May point at a local stand-in server for
+            testing.
+        backup_weather_url : STR, optional
+            Url of the weather.com hourly forecast page, used when the weather station is down or outdated.
+        rain_url : STR, optional
+            Url of the weather.com radar page that the radar API key is scraped from.
+        radar_tile_url : STR, optional
+            Template for the url of a radar tile, with {timestamp}, {x}, {y}, {zoom} and {api_key} fields.
+        cloud_image_url : STR, optional
+            Template for the url of a satellite image, with {satellite} and {timestamp} fields.  The timestamp is a UTC
+            datetime, so it takes strftime formats, i.e. {timestamp:%Y%j_%H%M}.
+        internet_check_url : STR, optional
+            Url that is requested to verify the internet connection before starting the condition checker.
+        focus_tolerance : INT or FLOAT, optional
+            Uncertainty of the best focus position, in focuser steps, at which the focus search stops early.  Our
+            default is 3 steps.
+        focus_backlash : INT, optional
+            Steps of focuser backlash.  Every move that would end moving against focus_backlash_direction overshoots the
+            target by this much first, so the target is always approached from the same side.  Measured by
+            FocusProcedures.backlash_procedure.  0 turns compensation off.  Our default is 0.
+        focus_backlash_direction : STR, optional
+            'in' or 'out', the direction that every move ends with when focus_backlash is set.  Our default is 'out'.
+        guider_method : STR, optional
+            How the guider measures drift.  'star' tracks a single guide star in a subframe around it.  'correlation'
+            registers each image against a reference image of the field with FFT phase correlation, using every star,
+            see Guider.correlation_procedure.  Our default is 'star'.
 
         Returns
         -------
@@ -132,6 +189,23 @@ class Config:
         self.data_directory = data_directory                     
         self.calibration_time = calibration_time
         self.calibration_num: int = calibration_num
+        self.cloud_cover_radius = cloud_cover_radius
+        self.radar_zoom = radar_zoom
+        self.radar_radius = radar_radius
+        self.radar_lead_time = radar_lead_time
+        self.weather_freq_min = weather_freq_min
+        self.weather_freq_max = weather_freq_max
+        self.weather_trend_lead = weather_trend_lead
+        self.weather_url = weather_url
+        self.backup_weather_url = backup_weather_url
+        self.rain_url = rain_url
+        self.radar_tile_url = radar_tile_url
+        self.cloud_image_url = cloud_image_url
+        self.internet_check_url = internet_check_url
+        self.focus_tolerance = focus_tolerance
+        self.focus_backlash = focus_backlash
+        self.focus_backlash_direction = focus_backlash_direction
+        self.guider_method = guider_method
         
     @staticmethod
     def deserialized(text: str):
@@ -196,7 +270,15 @@ def _dict_to_config_object(dic: Dict) -> Config:
                      guider_ra_dampening=dic['guider_ra_dampening'], guider_dec_dampening=dic['guider_dec_dampening'],
                      guider_max_move=dic['guider_max_move'], guider_angle=dic['guider_angle'],
                      data_directory=dic['data_directory'], calibration_time=dic['calibration_time'],
-                     calibration_num=dic['calibration_num'])
+                     calibration_num=dic['calibration_num'], cloud_cover_radius=dic['cloud_cover_radius'],
+                     radar_zoom=dic['radar_zoom'], radar_radius=dic['radar_radius'],
+                     radar_lead_time=dic['radar_lead_time'], weather_freq_min=dic['weather_freq_min'],
+                     weather_freq_max=dic['weather_freq_max'], weather_trend_lead=dic['weather_trend_lead'],
+                     weather_url=dic['weather_url'], backup_weather_url=dic['backup_weather_url'],
+                     rain_url=dic['rain_url'], radar_tile_url=dic['radar_tile_url'],
+                     cloud_image_url=dic['cloud_image_url'], internet_check_url=dic['internet_check_url'],
+                     focus_tolerance=dic['focus_tolerance'], focus_backlash=dic['focus_backlash'],
+                     focus_backlash_direction=dic['focus_backlash_direction'], guider_method=dic['guider_method'])
     logging.info('Global config object has been created')
     return _config
 
@@ -0,0 +1,166 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class FocusStore:
+
+    minimum_model_runs = 3          # Fewest focus runs that a model is fit to
+    minimum_temperature_span = 5    # Degrees F that the runs must cover before the temperature coefficient is fit
+
+    def __init__(self, path: str):
+        """
+        Description
+        -----------
+        History of every successful focus run, kept in a single SQLite file, and the linear model of best focus
+        against temperature that is fit to it.  Rows are keyed by epoch seconds in a WITHOUT ROWID table, like the
+        WeatherStore.  Safe to share between threads.
+
+        Parameters
+        ----------
+        path : STR
+            Path to the SQLite file.  It is created along with its directory if it does not exist.
+
+        Returns
+        -------
+        None.
+
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs (time REAL PRIMARY KEY, temperature REAL, '
+                                    'filter TEXT, position REAL, error REAL, fwhm REAL) WITHOUT ROWID')
+
+    def append(self, temperature: float, _filter, position: float, error: Optional[float], fwhm: Optional[float],
+               timestamp: Optional[float] = None):
+        """
+        Parameters
+        ----------
+        temperature : FLOAT
+            Temperature in degrees F during the focus run.
+        _filter : STR or INT
+            Filter that the focus run was taken in.
+        position : FLOAT
+            Best focus position that was found.
+        error : FLOAT
+            Standard error of position in steps, or None if unknown.
+        fwhm : FLOAT
+            HFD (or fwhm) at best focus, in pixels, or None if unknown.
+        timestamp : FLOAT, optional
+            Epoch seconds of the focus run.  The default is None, which uses the current time.
+
+        Returns
+        -------
+        None.
+
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                                    (timestamp, temperature, str(_filter), position, error, fwhm))
+
+    def model(self, _filter=None, default_coefficient: Optional[float] = None) -> Optional[Tuple[float, float,
+                                                                                                 float]]:
+        """
+        Description
+        -----------
+        Fits position = offset + coefficient * temperature to every recorded run, weighted by the error of each run.
+        All filters share the coefficient, but each has its own offset.  If the runs do not cover at least
+        minimum_temperature_span degrees, the coefficient cannot be fit, so default_coefficient is used instead and
+        only the offsets are fit.
+
+        Parameters
+        ----------
+        _filter : STR or INT, optional
+            Filter to give the offset of.  The default is None, or a filter without any runs, which gives the mean
+            offset of all filters.
+        default_coefficient : FLOAT, optional
+            Steps per degree F to fall back on, i.e. focus_temperature_constant.  The default is None, which returns
+            None when the coefficient cannot be fit.
+
+        Returns
+        -------
+        coefficient : FLOAT
+            Focus steps per degree F.
+        offset : FLOAT
+            Best focus position at 0 degrees F.
+        scatter : FLOAT
+            Rms difference in steps between the recorded runs and the model.
+        None if there are fewer than minimum_model_runs runs.
+
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT temperature, filter, position, error FROM runs '
+                                           'WHERE temperature IS NOT NULL ORDER BY time').fetchall()
+        if len(rows) < self.minimum_model_runs:
+            return None
+        temperatures = np.array([row[0] for row in rows], dtype=float)
+        filters = sorted(set(row[1] for row in rows))
+        positions = np.array([row[2] for row in rows], dtype=float)
+        errors = np.array([row[3] if row[3] else np.nan for row in rows], dtype=float)
+        errors = np.where(np.isnan(errors), np.nanmax(errors) if np.any(~np.isnan(errors)) else 1.0, errors)
+        weights = 1 / np.maximum(errors, 0.5)
+        indicators = np.array([[row[1] == f for f in filters] for row in rows], dtype=float)
+        fit_coefficient = np.ptp(temperatures) >= self.minimum_temperature_span
+        if fit_coefficient:
+            design = np.column_stack([temperatures, indicators])
+            target = positions
+        elif default_coefficient is None:
+            return None
+        else:
+            design = indicators
+            target = positions - default_coefficient * temperatures
+        solution = np.linalg.lstsq(design * weights[:, np.newaxis], target * weights, rcond=None)[0]
+        (coefficient, offsets) = (solution[0], solution[1:]) if fit_coefficient else (default_coefficient, solution)
+        scatter = float(np.sqrt(np.mean((positions - coefficient * temperatures - indicators @ offsets)**2)))
+        offset = offsets[filters.index(str(_filter))] if str(_filter) in filters else np.mean(offsets)
+        return float(coefficient), float(offset), scatter
+
+    def predict(self, temperature: Optional[float], _filter=None,
+                default_coefficient: Optional[float] = None) -> Optional[Tuple[float, float]]:
+        """
+        Parameters
+        ----------
+        temperature : FLOAT
+            Current temperature in degrees F, or None if unknown.
+        _filter : STR or INT, optional
+            Filter to predict the best focus in.  The default is None.
+        default_coefficient : FLOAT, optional
+            Passed to model.  The default is None.
+
+        Returns
+        -------
+        position : FLOAT
+            Predicted best focus position.
+        scatter : FLOAT
+            Rms error of the model in steps.
+        None if the temperature is unknown or there is no model yet.
+
+        """
+        model = self.model(_filter, default_coefficient)
+        if temperature is None or model is None:
+            return None
+        (coefficient, offset, scatter) = model
+        return offset + coefficient * temperature, scatter
+
+    def close(self):
+        """
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self.connection.close()
+        logging.debug('Closed focus history {}'.format(self.path))
@@ -0,0 +1,297 @@
+import os
+import logging
+import threading
+import concurrent.futures
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+class FrameSlot(NamedTuple):
+    """
+    Where a frame is in the shared memory of a FrameBuffer.  Small enough to be sent to worker processes in place of
+    the path of the frame.
+    """
+    memory: str                 # Name of the shared memory block
+    index: int                  # Slot of the frame in the ring
+    offset: int                 # Bytes from the start of the block to the frame
+    shape: Tuple[int, int]
+    dtype: str
+    path: str                   # The fits file the frame was read from
+    key: Tuple[str, int, int]   # Absolute path, modification time and size of that file, as frame_stats keys them
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Parameters
+    ----------
+    name : STR
+        Name of a shared memory block.
+
+    Returns
+    -------
+    CLASS INSTANCE OBJECT of multiprocessing.shared_memory.SharedMemory
+        The block, attached once per process and kept for its lifetime.
+
+    """
+    with _attached_lock:
+        if name not in _attached:
+            # On POSIX this registers the block with the resource tracker again.  AnalysisService.start makes the
+            # workers share the tracker of the process that creates the block, so this adds nothing to the creator's
+            # registration, which the creator removes on close
+            _attached[name] = shared_memory.SharedMemory(name=name)
+        return _attached[name]
+
+
+class SharedFrame:
+
+    def __init__(self, slot: FrameSlot):
+        """
+        Description
+        -----------
+        A frame in a FrameBuffer, seen as a read-only numpy array straight on top of the shared memory, with the same
+        interface as filereader_utils.MappedFrame.  Indexing returns views, not copies, so it must only be used while
+        the slot is acquired.
+
+        Parameters
+        ----------
+        slot : FrameSlot
+            From FrameBuffer.acquire.
+
+        Returns
+        -------
+        None.
+
+        """
+        memory = _attach(slot.memory)
+        self.array = np.ndarray(slot.shape, dtype=np.dtype(slot.dtype), buffer=memory.buf, offset=slot.offset)
+        self.array.flags.writeable = False
+        self.shape = self.array.shape
+        self.size = self.array.size
+        self.dtype = self.array.dtype
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.array[key]
+
+    def close(self):
+        """
+        Returns
+        -------
+        None.
+
+        """
+        self.array = None
+
+
+class FrameBuffer:
+
+    put_timeout = 5             # Most seconds that acquire waits for a frame that is still being put in the buffer
+
+    def __init__(self, slots: int = 4):
+        """
+        Description
+        -----------
+        Ring of frames in a single block of shared memory.  Each frame is read from disk once, as soon as the camera
+        saves it, and every analysis worker then maps it as a numpy array instead of reading its own copy.  The block
+        is sized for slots frames of the first frame's size and never grows, so its memory footprint stays fixed all
+        night.  Slots are reference counted: a slot that any consumer has acquired is never written over, and a new
+        frame that finds no free slot is simply not buffered, so its consumers read it from disk.  Frames are put in
+        the buffer by a thread of its own (see put_later), so the camera never waits for the copy.
+
+        Parameters
+        ----------
+        slots : INT, optional
+            Number of frames in the ring.  The default is 4.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.slots = slots
+        self.memory = None
+        self.slot_bytes = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.references = [0] * slots
+        self.frames = {}
+        # Latest FrameSlot of each file by absolute path
+        self.pending = set()
+        # Absolute paths of the frames that are waiting to be put in the buffer
+        self.next = 0
+        self.closed = False
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='FrameBuffer-Th')
+
+    def put_later(self, path: str):
+        """
+        Description
+        -----------
+        Puts a frame in the buffer on the buffer's own thread, and returns right away.  Until it is in, acquire waits
+        for it rather than missing it.  Any error while putting it is logged, and its consumers read it from disk.
+
+        Parameters
+        ----------
+        path : STR
+            Path to a fits frame that was just saved.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.pending.add(os.path.abspath(path))
+            self.writer.submit(self._put_pending, path)
+
+    def _put_pending(self, path: str):
+        """
+        Parameters
+        ----------
+        path : STR
+            Path to a frame queued by put_later.
+
+        Returns
+        -------
+        None.
+
+        """
+        try:
+            self.put(path)
+        except (OSError, ValueError, TypeError, BufferError) as exception:
+            logging.warning('Could not put {} in the frame buffer, so it is read from disk: {}'.format(path,
+                                                                                                    exception))
+        finally:
+            with self.lock:
+                self.pending.discard(os.path.abspath(path))
+                self.changed.notify_all()
+
+    def put(self, path: str) -> Optional[FrameSlot]:
+        """
+        Parameters
+        ----------
+        path : STR
+            Path to a fits frame that was just saved.
+
+        Returns
+        -------
+        FrameSlot
+            Where the frame was put, or None if it could not be buffered.
+
+        """
+        from ..util.filereader_utils import MappedFrame
+
+        with MappedFrame(path) as frame:
+            nbytes = frame.size * frame.dtype.itemsize
+            with self.lock:
+                if self.closed:
+                    return None
+                if self.memory is None:
+                    self.memory = shared_memory.SharedMemory(create=True, size=nbytes * self.slots)
+                    self.slot_bytes = nbytes
+                    logging.info('Allocated {:.0f} MB of shared memory for {} frames'.format(
+                        nbytes * self.slots / 2**20, self.slots))
+                if nbytes > self.slot_bytes:
+                    logging.warning('{} is larger than the frame buffer slots, so it is read from disk'.format(path))
+                    return None
+                free = [i % self.slots for i in range(self.next, self.next + self.slots)
+                        if not self.references[i % self.slots]]
+                if not free:
+                    logging.warning('Every frame buffer slot is in use, so {} is read from disk'.format(path))
+                    return None
+                index = free[0]
+                self.frames = {name: slot for (name, slot) in self.frames.items() if slot.index != index}
+                self.references[index] = 1
+                # Held while the frame is written, so no other put takes the slot
+            target = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.memory.buf, offset=index * self.slot_bytes)
+            for row in range(0, frame.shape[0], 256):
+                target[row:row + 256] = frame[row:row + 256]
+        status = os.stat(path)
+        slot = FrameSlot(self.memory.name, index, index * self.slot_bytes, tuple(frame.shape), frame.dtype.str, path,
+                         (os.path.abspath(path), status.st_mtime_ns, status.st_size))
+        with self.lock:
+            self.frames[slot.key[0]] = slot
+            self.references[index] = 0
+            self.next = (index + 1) % self.slots
+        return slot
+
+    def acquire(self, path: str) -> Optional[FrameSlot]:
+        """
+        Parameters
+        ----------
+        path : STR
+            Path to a fits frame.
+
+        Returns
+        -------
+        FrameSlot
+            The buffered frame, which is kept until it is released, or None if the frame is not in the buffer or the
+            file has changed since it was buffered.  A frame that put_later is still putting in is waited for, up to
+            put_timeout seconds.
+
+        """
+        name = os.path.abspath(path)
+        with self.lock:
+            self.changed.wait_for(lambda: name not in self.pending, timeout=self.put_timeout)
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            slot = self.frames.get(name)
+            if slot is None or slot.key[1:] != (status.st_mtime_ns, status.st_size):
+                return None
+            self.references[slot.index] += 1
+            return slot
+
+    def release(self, slot: FrameSlot):
+        """
+        Parameters
+        ----------
+        slot : FrameSlot
+            From acquire.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self.references[slot.index] -= 1
+
+    def close(self):
+        """
+        Description
+        -----------
+        Frees the shared memory, once any frame that is being put in has been.  Workers that still have it mapped keep
+        their mapping until they exit.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self.closed = True
+        self.writer.shutdown(wait=True)
+        with self.lock:
+            if self.memory is not None:
+                try:
+                    self.memory.close()
+                except BufferError:
+                    logging.warning('The frame buffer is still in use in this process, so it is only unlinked')
+                self.memory.unlink()
+                self.memory = None
+            self.frames = {}
+        logging.debug('Freed the frame buffer')
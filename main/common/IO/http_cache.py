@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import time
+from typing import Dict, Optional, Tuple, Any
+
+import requests
+
+
+class CacheEntry:
+
+    def __init__(self, url: str, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 encoding: Optional[str] = None):
+        """
+
+        Parameters
+        ----------
+        url : STR
+            The url that this entry was downloaded from.
+        content : BYTES
+            The raw body of the last full (200) response.
+        etag : STR, optional
+            ETag header of the last full response, if the server sent one.
+        last_modified : STR, optional
+            Last-Modified header of the last full response, if the server sent one.
+        encoding : STR, optional
+            Text encoding of the response, as guessed by requests.  The default is None, which assumes utf-8.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.url: str = url
+        self.content: bytes = content
+        self.etag: Optional[str] = etag
+        self.last_modified: Optional[str] = last_modified
+        self.encoding: str = encoding or 'utf-8'
+        self.digest: str = hashlib.sha1(content).hexdigest()
+        self.fetched: float = time.time()
+
+    @property
+    def text(self) -> str:
+        """
+
+        Returns
+        -------
+        STR
+            The cached body decoded as text, in the same way requests would decode it.
+
+        """
+        return self.content.decode(self.encoding, errors='replace')
+
+
+class CachedSession:
+
+    def __init__(self, user_agent: Optional[str] = None):
+        """
+        Description
+        -----------
+        Wraps a persistent requests.Session with a small HTTP cache.  Pages are revalidated with
+        If-None-Match/If-Modified-Since, so an unchanged page costs a 304 instead of a full download, and the
+        content digest of every page is tracked so that callers can skip re-parsing pages that have not changed.
+        Also keeps a simple TTL cache for values scraped out of pages (i.e. API keys) and counts the bytes
+        transferred.
+
+        Parameters
+        ----------
+        user_agent : STR, optional
+            User agent sent with every request.  The default is None, which uses the requests default.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.session = requests.Session()
+        if user_agent:
+            self.session.headers.update({'User-Agent': user_agent})
+        self.entries: Dict[str, CacheEntry] = {}
+        self.ttl_values: Dict[str, Tuple[Any, float]] = {}
+        self.bytes_transferred = 0
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, cache: bool = True,
+            timeout: Optional[float] = 30) -> Tuple[CacheEntry, bool]:
+        """
+        Parameters
+        ----------
+        url : STR
+            Url to retrieve.
+        headers : DICT, optional
+            Any extra request headers.
+        cache : BOOL, optional
+            If True, sends the cached validators so that the server may answer 304 Not Modified, and keeps the
+            response for the next request.  If False, always performs a full download and does not keep it (used for
+            one-off urls, like timestamped image tiles).  The default is True.
+        timeout : FLOAT, optional
+            Request timeout in seconds.  The default is 30.
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            Any connection error or HTTP error status is passed on to the caller, exactly as with requests.get.
+
+        Returns
+        -------
+        entry : CacheEntry
+            The cache entry for this url, holding the newest known content.
+        changed : BOOL
+            True if the content differs from the previously cached content, otherwise False.
+
+        """
+        request_headers = dict(headers) if headers else {}
+        cached = self.entries.get(url) if cache else None
+        if cached:
+            if cached.etag:
+                request_headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                request_headers['If-Modified-Since'] = cached.last_modified
+        response = self.session.get(url, headers=request_headers, timeout=timeout)
+        self.bytes_transferred += len(response.content) + sum(len(key) + len(value) + 4
+                                                              for key, value in response.headers.items())
+        if response.status_code == 304 and cached:
+            logging.debug('{} has not been modified since the last request'.format(url))
+            cached.fetched = time.time()
+            if 'Last-Modified' in response.headers:
+                cached.last_modified = response.headers['Last-Modified']
+            return cached, False
+        response.raise_for_status()
+        entry = CacheEntry(url, response.content, etag=response.headers.get('ETag'),
+                           last_modified=response.headers.get('Last-Modified'), encoding=response.encoding)
+        changed = (cached is None) or (cached.digest != entry.digest)
+        if cache:
+            self.entries[url] = entry
+        return entry, changed
+
+    def ttl_get(self, key: str) -> Optional[Any]:
+        """
+        Parameters
+        ----------
+        key : STR
+            Name of the cached value.
+
+        Returns
+        -------
+        ANY
+            The cached value, or None if it was never stored or has expired.
+
+        """
+        if key not in self.ttl_values:
+            return None
+        (value, expiry) = self.ttl_values[key]
+        if time.time() >= expiry:
+            del self.ttl_values[key]
+            return None
+        return value
+
+    def ttl_set(self, key: str, value: Any, ttl: float):
+        """
+        Parameters
+        ----------
+        key : STR
+            Name of the value to cache.
+        value : ANY
+            Value to cache.
+        ttl : FLOAT
+            Time to live for the value, in seconds.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ttl_values[key] = (value, time.time() + ttl)
+
+    def ttl_clear(self, key: str):
+        """
+        Parameters
+        ----------
+        key : STR
+            Name of the cached value to throw out, i.e. if it was found to be invalid.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ttl_values.pop(key, None)
+
+    def reset_byte_count(self) -> int:
+        """
+
+        Returns
+        -------
+        INT
+            Number of bytes transferred (bodies + headers) since the last reset.  Resets the count to 0.
+
+        """
+        count = self.bytes_transferred
+        self.bytes_transferred = 0
+        return count
@@ -0,0 +1,230 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import collections
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class WeatherStore:
+
+    columns = ('humidity', 'wind', 'temperature', 'rain', 'radar', 'clouds', 'sun_elevation')
+    minimum_trend_readings = 3      # Fewest readings that a trend is fit to
+    recent_readings = 32            # Newest readings of each column kept in memory, so trends never read the file
+
+    def __init__(self, path: str):
+        """
+        Description
+        -----------
+        Append-only time series of every condition reading, kept in a single SQLite file.  Rows are keyed by epoch
+        seconds in a WITHOUT ROWID table, so the file stays compact and range queries by time are a single index
+        scan.  Missing readings are stored as NULL and come back as NaN.  The newest readings of each column are
+        also kept in memory, loaded from the file when it is opened, so the trends that the condition checker needs
+        every cycle do not touch the disk.  Safe to share between threads.
+
+        Parameters
+        ----------
+        path : STR
+            Path to the SQLite file.  It is created along with its directory if it does not exist.
+
+        Returns
+        -------
+        None.
+
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS readings (time REAL PRIMARY KEY, {}) '
+                                    'WITHOUT ROWID'.format(', '.join('{} REAL'.format(c) for c in self.columns)))
+        self.recent = {}
+        # Newest (epoch seconds, value) readings of each column, oldest first
+        self._load_recent()
+
+    def _load_recent(self):
+        """
+        Description
+        -----------
+        Fills the in-memory history of each column with its newest readings in the file.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            for column in self.columns:
+                rows = self.connection.execute('SELECT time, {0} FROM readings WHERE {0} IS NOT NULL ORDER BY time '
+                                               'DESC LIMIT ?'.format(column), (self.recent_readings,)).fetchall()
+                self.recent[column] = collections.deque(reversed(rows), maxlen=self.recent_readings)
+
+    def append(self, timestamp: Optional[float] = None, **values: Optional[float]):
+        """
+        Parameters
+        ----------
+        timestamp : FLOAT, optional
+            Epoch seconds of the readings.  The default is None, which uses the current time.
+        **values : FLOAT
+            Reading for any of self.columns.  Columns that are left out or None are stored as missing.
+
+        Returns
+        -------
+        None.
+
+        """
+        unknown = set(values) - set(self.columns)
+        if unknown:
+            raise ValueError('Unknown weather columns: {}'.format(', '.join(sorted(unknown))))
+        timestamp = time.time() if timestamp is None else timestamp
+        row = [timestamp] + [values.get(c) for c in self.columns]
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO readings VALUES ({})'.format(', '.join('?' * len(row))),
+                                    row)
+            in_order = all(not self.recent[c] or self.recent[c][-1][0] < timestamp for c in self.columns)
+            if in_order:
+                for column in self.columns:
+                    if values.get(column) is not None:
+                        self.recent[column].append((timestamp, values[column]))
+        if not in_order:
+            # Readings from the past can land anywhere in the history, so it is simply reloaded
+            self._load_recent()
+
+    def query(self, start: float, end: Optional[float] = None,
+              columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Parameters
+        ----------
+        start : FLOAT
+            Epoch seconds of the start of the range, inclusive.
+        end : FLOAT, optional
+            Epoch seconds of the end of the range, inclusive.  The default is None, which means up to now.
+        columns : LIST, optional
+            Columns to return.  The default is None, which returns all of them.
+
+        Returns
+        -------
+        DICT
+            'time' and each requested column as float NumPy arrays, in time order.  Missing readings are NaN.
+
+        """
+        columns = list(columns) if columns else list(self.columns)
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError('Unknown weather columns: {}'.format(', '.join(sorted(unknown))))
+        end = float('inf') if end is None else end
+        with self.lock:
+            rows = self.connection.execute('SELECT time, {} FROM readings WHERE time BETWEEN ? AND ? '
+                                           'ORDER BY time'.format(', '.join(columns)), (start, end)).fetchall()
+        data = np.array(rows, dtype=float).reshape(len(rows), len(columns) + 1)
+        return {name: data[:, i] for (i, name) in enumerate(['time'] + columns)}
+
+    def latest(self, column: str) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Parameters
+        ----------
+        column : STR
+            One of self.columns.
+
+        Returns
+        -------
+        timestamp : FLOAT
+            Epoch seconds of the newest reading of the column, or None if there is none.
+        value : FLOAT
+            The newest reading of the column, or None if there is none.
+
+        """
+        if column not in self.columns:
+            raise ValueError('Unknown weather column: {}'.format(column))
+        with self.lock:
+            row = self.connection.execute('SELECT time, {0} FROM readings WHERE {0} IS NOT NULL '
+                                          'ORDER BY time DESC LIMIT 1'.format(column)).fetchone()
+        return row if row else (None, None)
+
+    def trend(self, column: str, minutes: float, now: Optional[float] = None) -> Tuple[Optional[float],
+                                                                                        Optional[float]]:
+        """
+        Parameters
+        ----------
+        column : STR
+            One of self.columns.
+        minutes : FLOAT
+            Only readings this recent are used.
+        now : FLOAT, optional
+            Epoch seconds to measure the trend at.  The default is None, which uses the current time.
+
+        Returns
+        -------
+        value : FLOAT
+            The newest reading in the window, or None if there are no readings.
+        slope : FLOAT
+            Least-squares rate of change of the column per minute, or None if there are fewer than
+            minimum_trend_readings readings, or they all have the same time.
+
+        """
+        now = time.time() if now is None else now
+        start = now - minutes * 60
+        with self.lock:
+            recent = list(self.recent[column])
+        if len(recent) < self.recent_readings or recent[0][0] <= start:
+            # The in-memory history reaches back far enough (or holds every reading there is)
+            readings = np.array([reading for reading in recent if start <= reading[0] <= now], dtype=float)
+            (times, values) = (readings[:, 0], readings[:, 1]) if len(readings) else (readings, readings)
+        else:
+            data = self.query(start, now, columns=[column])
+            good = ~np.isnan(data[column])
+            (times, values) = (data['time'][good], data[column][good])
+        if len(values) == 0:
+            return None, None
+        if len(values) < self.minimum_trend_readings or np.ptp(times) == 0:
+            return float(values[-1]), None
+        slope = np.polyfit((times - now) / 60, values, 1)[0]
+        return float(values[-1]), float(slope)
+
+    def time_to_limit(self, column: str, limit: float, minutes: float,
+                      now: Optional[float] = None) -> Optional[float]:
+        """
+        Parameters
+        ----------
+        column : STR
+            One of self.columns.
+        limit : FLOAT
+            Value of the column that must not be reached.
+        minutes : FLOAT
+            Only readings this recent are used to find the trend.
+        now : FLOAT, optional
+            Epoch seconds to project from.  The default is None, which uses the current time.
+
+        Returns
+        -------
+        FLOAT
+            Minutes until the column is projected to reach the limit at its current trend, 0 if it already has, or
+            None if it is not trending toward the limit.
+
+        """
+        (value, slope) = self.trend(column, minutes, now=now)
+        if value is None:
+            return None
+        if value >= limit:
+            return 0.0
+        if slope is None or slope <= 0:
+            return None
+        return (limit - value) / slope
+
+    def close(self):
+        """
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self.connection.close()
+        logging.debug('Closed weather history {}'.format(self.path))
@@ -9,8 +9,11 @@ _filter = None
 
 class FilterWheel:
 
+    positions = ('position_1', 'position_2', 'position_3', 'position_4', 'position_5', 'position_6', 'position_7',
+                 'position_8')
+
     def __init__(self, position_1: str, position_2: str, position_3: str, position_4: str, position_5: str,
-                 position_6: str, position_7: str, position_8: str):
+                 position_6: str, position_7: str, position_8: str, focus_offsets: Optional[Dict[str, int]] = None):
         """
 
         Parameters
@@ -18,6 +21,10 @@ class FilterWheel:
         position_1 - position_8 : STR
             Each position will be the name/label of the filter in said position (i.e. "r" for red filter).
             For readability, each position is labeled by a STR "position_X" rather than just an INT X.
+        focus_offsets : DICT, optional
+            Focuser steps to move when changing to each filter, relative to a filter with an offset of 0, by filter
+            name.  Measured by FocusProcedures.filter_offsets_procedure.  The default is None, which means none have
+            been measured yet.
 
         Returns
         -------
@@ -32,6 +39,7 @@ class FilterWheel:
         self.position_6: str = position_6
         self.position_7: str = position_7
         self.position_8: str = position_8
+        self.focus_offsets: Dict[str, int] = dict(focus_offsets) if focus_offsets else {}
 
     def filter_position_dict(self) -> Dict:
         """
@@ -46,7 +54,43 @@ class FilterWheel:
 
         """
         i = itertools.count(0)
-        return {filter_: next(i) for filter_ in self.__dict__.values()}
+        return {getattr(self, position): next(i) for position in self.positions}
+
+    def focus_offset(self, filter_: str) -> Optional[int]:
+        """
+
+        Parameters
+        ----------
+        filter_ : STR
+            Name of the filter.
+
+        Returns
+        -------
+        INT
+            Focus offset of the filter in steps, or None if it has not been measured.
+
+        """
+        return self.focus_offsets.get(filter_)
+
+    def save(self, path: str):
+        """
+        Description
+        -----------
+        Writes the filter wheel, including the focus offsets, back to its .json config file.
+
+        Parameters
+        ----------
+        path : STR
+            Path to the filter wheel config file.
+
+        Returns
+        -------
+        None.
+
+        """
+        with open(path, 'w') as file:
+            json.dump({'type': 'filter_wheel', 'details': self.serialized()}, file, indent=4)
+        logging.info('Saved the filter wheel config to {}'.format(path))
     
     def serialized(self) -> Dict:
         """
@@ -87,7 +131,8 @@ def _dict_to_filter_object(dic: Dict) -> FilterWheel:
     Parameters
     ----------
     dic : DICT
-        A dictionary of our filter wheel config file, generated using json.loads from deserialized.
+        A dictionary of our filter wheel config file, generated using json.loads from deserialized.  The object hook
+        is also called on every nested dictionary first (i.e. focus_offsets), which are returned unchanged.
 
     Returns
     -------
@@ -96,8 +141,11 @@ def _dict_to_filter_object(dic: Dict) -> FilterWheel:
 
     """
     global _filter
+    if 'position_1' not in dic:
+        return dic
     _filter = FilterWheel(dic['position_1'], dic['position_2'], dic['position_3'], dic['position_4'],
-                          dic['position_5'], dic['position_6'], dic['position_7'], dic['position_8'])
+                          dic['position_5'], dic['position_6'], dic['position_7'], dic['position_8'],
+                          dic.get('focus_offsets'))
     logging.info('Global filter object has been created')
     return _filter
 
@@ -188,3 +188,65 @@ def get_sunset(day: Union[str, datetime.datetime], latitude: float, longitude: f
         alt = get_sun_elevation(time, latitude, longitude)
         if alt <= 0:
             return time.replace(tzinfo=datetime.timezone.utc) - time.utcoffset()
+
+
+def get_goes_scan_angles(latitude: float, longitude: float,
+                         satellite_longitude: float = -75.0) -> Tuple[float, float]:
+    """
+    Parameters
+    ----------
+    latitude : FLOAT
+        Geodetic latitude of the point on the ground, in degrees.
+    longitude : FLOAT
+        Longitude of the point on the ground, in degrees.
+    satellite_longitude : FLOAT, optional
+        Sub-satellite longitude in degrees.  The default is -75.0, for GOES-16 (GOES-East).
+
+    Returns
+    -------
+    x : FLOAT
+        E/W scan angle in radians, as seen from the satellite.
+    y : FLOAT
+        N/S elevation angle in radians, as seen from the satellite.
+
+    """
+    # GOES-R fixed grid projection, from the GOES-R Product User Guide, section 4.2.8
+    r_eq = 6378137.0
+    r_pol = 6356752.31414
+    h = 35786023.0 + r_eq
+    e = 0.0818191910435
+    (latitude_r, longitude_r, satellite_longitude_r) = np.radians([latitude, longitude, satellite_longitude])
+    latitude_c = np.arctan((r_pol**2 / r_eq**2) * np.tan(latitude_r))
+    r_c = r_pol / np.sqrt(1 - e**2 * np.cos(latitude_c)**2)
+    s_x = h - r_c * np.cos(latitude_c) * np.cos(longitude_r - satellite_longitude_r)
+    s_y = -r_c * np.cos(latitude_c) * np.sin(longitude_r - satellite_longitude_r)
+    s_z = r_c * np.sin(latitude_c)
+    x = np.arcsin(-s_y / np.sqrt(s_x**2 + s_y**2 + s_z**2))
+    y = np.arctan(s_z / s_x)
+    return float(x), float(y)
+
+
+def get_tile_coordinates(latitude: float, longitude: float, zoom: int) -> Tuple[float, float]:
+    """
+    Parameters
+    ----------
+    latitude : FLOAT
+        Latitude of the point, in degrees.
+    longitude : FLOAT
+        Longitude of the point, in degrees.
+    zoom : INT
+        Zoom level of the web mercator (slippy map) tile grid.
+
+    Returns
+    -------
+    x : FLOAT
+        Fractional tile column of the point.  The integer part is the tile x index, and the fractional part is the
+        position within that tile.
+    y : FLOAT
+        Fractional tile row of the point, in the same way as x.
+
+    """
+    n = 2**zoom
+    x = (longitude + 180) / 360 * n
+    y = (1 - np.arcsinh(np.tan(np.radians(latitude))) / np.pi) / 2 * n
+    return float(x), float(y)
@@ -1,25 +1,300 @@
 # Filereader Utils for Focuser & Guider
+import os
 import logging
+import threading
+import collections
 import numpy as np
 # import matplotlib.pyplot as plt
-from typing import Union, Optional, Tuple
+from typing import Dict, Optional, Sequence, Tuple, Union
 
 import photutils
 from astropy.io import fits
-from astropy.stats import sigma_clipped_stats
+from astropy.stats import sigma_clipped_stats, sigma_clip
 from scipy.optimize import curve_fit
 
 from ..IO import config_reader
+from ..IO.frame_buffer import FrameSlot, SharedFrame
+from . import registration_utils
 
 np.warnings.filterwarnings('ignore')
 
+histogram_max_bins = 2**20          # Widest range of integer counts that background_stats histograms
+background_tolerance = 0.1          # Largest standard error of the background median, in counts, from a subsample
+background_min_sample = 100000      # Fewest pixels that a background subsample may have
+stats_cache_size = 32               # Frames whose background statistics are kept by frame_stats
+_stats_cache = collections.OrderedDict()
+_stats_cache_lock = threading.Lock()
+registration_cutoff = 0.1          # Gaussian low-pass of frame_offset, in cycles per binned pixel, above star sizes
+_registration_cache = {}
 
-def mediancounts(image_path: str) -> float:
+
+class MappedFrame:
+
+    def __init__(self, path: str):
+        """
+        Description
+        -----------
+        Memory maps the primary image of a fits file without reading it.  Indexing returns a copy of just that
+        section, scaled by BZERO and BSCALE the way fits.getdata would, so subframes, star stamps and strided
+        background samples only read the pages of the file that they touch.  Use it in a with statement, so the
+        file is closed again before the camera writes over it.
+
+        Parameters
+        ----------
+        path : STR
+            Path to the fits image file.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.hdul = fits.open(path, memmap=True, do_not_scale_image_data=True)
+        header = self.hdul[0].header
+        self.raw = self.hdul[0].data
+        self.bscale = header.get('BSCALE', 1)
+        self.bzero = header.get('BZERO', 0)
+        self.shape = self.raw.shape
+        self.size = self.raw.size
+        if self.bscale == 1 and self.bzero == 0:
+            self.dtype = self.raw.dtype.newbyteorder('=')
+        elif self.bscale == 1 and self.raw.dtype.kind == 'i' and self.bzero == 2**(8 * self.raw.dtype.itemsize - 1):
+            self.dtype = np.dtype('u{}'.format(self.raw.dtype.itemsize))
+        else:
+            self.dtype = np.dtype(np.float32 if self.raw.dtype.itemsize <= 2 else np.float64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, key) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        key : SLICE, TUPLE or NUMPY.NDARRAY
+            Any numpy index into the image.
+
+        Returns
+        -------
+        NUMPY.NDARRAY
+            Scaled copy of that section of the image, in native byte order.
+
+        """
+        section = np.array(self.raw[key], dtype=self.raw.dtype.newbyteorder('='))
+        if section.dtype == self.dtype:
+            return section
+        if self.dtype.kind == 'u':
+            # Adding BZERO = 2^(bits - 1) to a signed integer just flips its sign bit
+            return section.view(self.dtype) ^ self.dtype.type(self.bzero)
+        return section * self.dtype.type(self.bscale) + self.dtype.type(self.bzero)
+
+    def close(self):
+        """
+        Returns
+        -------
+        None.
+
+        """
+        self.raw = None
+        self.hdul.close()
+
+
+def frame_key(path: Union[str, FrameSlot]) -> Tuple[str, int, int]:
+    """
+    Returns
+    -------
+    TUPLE
+        Absolute path, modification time and size of the file of a frame, which change whenever it is written over.
+
+    """
+    if isinstance(path, FrameSlot):
+        return path.key
+    status = os.stat(path)
+    return os.path.abspath(path), status.st_mtime_ns, status.st_size
+
+
+def open_frame(path: Union[str, FrameSlot]) -> Union[MappedFrame, SharedFrame]:
+    """
+    Parameters
+    ----------
+    path : STR or FrameSlot
+        Path to a fits image file, or where the frame is in a FrameBuffer.
+
+    Returns
+    -------
+    MappedFrame or SharedFrame
+        The frame, to be used in a with statement.
+
+    """
+    return SharedFrame(path) if isinstance(path, FrameSlot) else MappedFrame(path)
+
+
+def _histogram_stats(counts: np.ndarray, low: int) -> Tuple[float, float, float]:
+    """
+    Parameters
+    ----------
+    counts : NUMPY.NDARRAY
+        Number of pixels with each integer value, starting at low.
+    low : INT
+        Pixel value of the first bin.
+
+    Returns
+    -------
+    TUPLE
+        Mean, median and standard deviation of the pixels, as np.mean, np.median and np.std would give them.
+
+    """
+    n = counts.sum()
+    values = np.arange(len(counts), dtype=float) + low
+    cumulative = np.cumsum(counts)
+    ranks = (n // 2, n // 2) if n % 2 else (n // 2 - 1, n // 2)
+    median = float(np.mean(values[np.searchsorted(cumulative, np.array(ranks) + 1)]))
+    mean = float(counts @ values / n)
+    stdev = float(np.sqrt(counts @ (values - mean)**2 / n))
+    return mean, median, stdev
+
+
+def background_stats(image: Union[np.ndarray, MappedFrame], sigma: float = 3, maxiters: int = 5,
+                     tolerance: Optional[float] = None) -> Tuple[float, float, float]:
     """
+    Description
+    -----------
+    Sigma clipped mean, median and standard deviation of an image, clipped the same way as
+    astropy.stats.sigma_clipped_stats.  Integer CCD data is reduced to a histogram of its counts with a single
+    bincount, and every clipping iteration then only works on the histogram, instead of sorting the frame again.
+    Float data, or integer data with too wide a range of counts, falls back to sigma_clipped_stats.
+
     Parameters
     ----------
-    image_path : STR
-        Path to image file to calculate median counts for.
+    image : NUMPY.NDARRAY or MappedFrame
+        Image data.  Only the pixels that are used are read from a MappedFrame.
+    sigma : FLOAT, optional
+        Number of standard deviations to clip at.  The default is 3.
+    maxiters : INT, optional
+        Most clipping iterations.  The default is 5.
+    tolerance : FLOAT, optional
+        If given, only every n-th row and column are used, with n as large as it can be while the standard error of
+        the median (1.25 standard deviations / sqrt(pixels)) stays below tolerance counts, and at least
+        background_min_sample pixels are used.  The median of integer data is still a whole or half count, so it
+        can land on the count next to the full frame median.  The default is None, which uses every pixel.
+
+    Returns
+    -------
+    TUPLE
+        Mean, median and standard deviation of the clipped data.
+
+    """
+    step = 1
+    if tolerance is not None and image.size > background_min_sample:
+        coarse = int(np.sqrt(image.size / background_min_sample))
+        (_, _, stdev) = background_stats(image[::coarse, ::coarse], sigma, maxiters)
+        pixels = max(background_min_sample, (1.2533 * stdev / tolerance)**2)
+        step = max(int(np.sqrt(image.size / pixels)), 1)
+    image = image[::step, ::step]
+    if image.dtype.kind not in 'ui' or not image.size:
+        return tuple(float(value) for value in sigma_clipped_stats(image, sigma=sigma, maxiters=maxiters))
+    low = int(image.min())
+    if int(image.max()) - low >= histogram_max_bins:
+        return tuple(float(value) for value in sigma_clipped_stats(image, sigma=sigma, maxiters=maxiters))
+    shifted = image - image.dtype.type(low) if image.dtype.kind == 'u' else image.astype(np.int64) - low
+    counts = np.bincount(shifted.ravel())
+    (first, last) = (0, len(counts) - 1)
+    for _ in range(maxiters):
+        (mean, median, stdev) = _histogram_stats(counts[first:last + 1], low + first)
+        bounds = (max(first, int(np.ceil(median - sigma * stdev)) - low),
+                  min(last, int(np.floor(median + sigma * stdev)) - low))
+        if bounds == (first, last) or bounds[0] > bounds[1]:
+            break
+        (first, last) = bounds
+    return _histogram_stats(counts[first:last + 1], low + first)
+
+
+def frame_stats(path: Union[str, FrameSlot],
+                image: Optional[Union[np.ndarray, MappedFrame, SharedFrame]] = None) -> Tuple[float, float, float]:
+    """
+    Description
+    -----------
+    Background statistics of a frame, from background_stats.  The result is cached by the path, modification time
+    and size of the file, so a frame that is analyzed more than once (i.e. by both the focuser and the guider) is
+    only measured once, while a file that is written over is measured again.
+
+    Parameters
+    ----------
+    path : STR or FrameSlot
+        Path to the fits image file, or where it is in a FrameBuffer.
+    image : NUMPY.NDARRAY, MappedFrame or SharedFrame, optional
+        Data of the image, if it is already open.  The default is None, which opens it with open_frame.
+
+    Returns
+    -------
+    TUPLE
+        Sigma clipped mean, median and standard deviation of the image.
+
+    """
+    key = frame_key(path)
+    with _stats_cache_lock:
+        if key in _stats_cache:
+            _stats_cache.move_to_end(key)
+            return _stats_cache[key]
+    if image is None:
+        with open_frame(path) as frame:
+            stats = background_stats(frame, sigma=3, tolerance=background_tolerance)
+    else:
+        stats = background_stats(image, sigma=3, tolerance=background_tolerance)
+    cache_stats({key: stats})
+    return stats
+
+
+def cached_stats(keys: Sequence[Tuple[str, int, int]]) -> Dict[Tuple[str, int, int], Tuple[float, float, float]]:
+    """
+    Parameters
+    ----------
+    keys : LIST
+        Frame keys, from frame_key.
+
+    Returns
+    -------
+    DICT
+        The background statistics that frame_stats has already cached in this process for any of the frames, by key.
+
+    """
+    with _stats_cache_lock:
+        return {key: _stats_cache[key] for key in keys if key in _stats_cache}
+
+
+def cache_stats(stats: Dict[Tuple[str, int, int], Tuple[float, float, float]]):
+    """
+    Description
+    -----------
+    Adds background statistics to the frame_stats cache of this process, i.e. ones that were measured by another
+    process, so they are not measured again here.
+
+    Parameters
+    ----------
+    stats : DICT
+        Background statistics by frame key, from cached_stats.
+
+    Returns
+    -------
+    None.
+
+    """
+    with _stats_cache_lock:
+        for (key, value) in stats.items():
+            _stats_cache[key] = value
+            _stats_cache.move_to_end(key)
+        while len(_stats_cache) > stats_cache_size:
+            _stats_cache.popitem(last=False)
+
+
+def mediancounts(image_path: Union[str, FrameSlot]) -> float:
+    """
+    Parameters
+    ----------
+    image_path : STR or FrameSlot
+        Path to image file to calculate median counts for, or where it is in a FrameBuffer.
 
     Returns
     -------
@@ -27,22 +302,23 @@ def mediancounts(image_path: str) -> float:
         Median counts of the specified image file.
 
     """
-    image = fits.getdata(image_path)
-    mean, median, stdev = sigma_clipped_stats(image, sigma=3)
+    mean, median, stdev = frame_stats(image_path)
     return median
     
     
-def findstars(path: str, saturation: Union[int, float], subframe: Optional[Tuple[int]] = None,
+def findstars(path: Union[str, FrameSlot], saturation: Union[int, float], subframe: Optional[Tuple[int]] = None,
               return_data: bool = False):
     """
     Description
     -----------
-    Finds the star centroids in an image
+    Finds the star centroids in an image.  The detection image is a single float32 array that is squared in place,
+    the threshold is a scalar from the cached background statistics, and the saturation and bad pixel tests are
+    done for every peak at once.
 
     Parameters
     ----------
-    path : STR
-        Path to fits image file with stars in it.
+    path : STR or FrameSlot
+        Path to fits image file with stars in it, or where it is in a FrameBuffer.
     saturation : INT
         Number of counts for a star to be considered saturated for a specific CCD Camera.
     subframe : TUPLE
@@ -58,44 +334,39 @@ def findstars(path: str, saturation: Union[int, float], subframe: Optional[Tuple
         (x position, y position).  The second element is a list of peak count values.
 
     """
-    image = fits.getdata(path)
-    mean, median, stdev = sigma_clipped_stats(image, sigma=3)
-    data = (image - median) ** 2
-    threshold = photutils.detect_threshold(image, nsigma=5)
-    if not subframe:
-        starfound = photutils.find_peaks(data, threshold=threshold, box_size=50, border_width=500,
-                                         centroid_func=photutils.centroids.centroid_com)
+    with open_frame(path) as frame:
+        mean, median, stdev = frame_stats(path, frame)
+        if not subframe:
+            image = frame[:, :]
+        else:
+            # Only the subframe around the guide star is read from the file
+            config_dict = config_reader.get_config()
+            r = config_dict.guider_max_move / config_dict.plate_scale * 1.5
+            x_cent = subframe[0]
+            y_cent = subframe[1]
+            image = frame[int(y_cent - r):int(y_cent + r), int(x_cent - r):int(x_cent + r)]
+    data = image.astype(np.float32)
+    data -= np.float32(median)
+    np.square(data, out=data)
+    # What photutils.detect_threshold(image, nsigma=5) gives, without sigma clipping the frame again
+    threshold = median + 5 * stdev
+    # Only the peak pixels are used, so photutils does not need to centroid them
+    starfound = photutils.find_peaks(data, threshold=threshold, box_size=50, border_width=500 if not subframe else 10)
+    del data
+
+    if starfound is None or not len(starfound):
+        (stars, peaks) = ([], [])
     else:
-        config_dict = config_reader.get_config()
-        r = config_dict.guider_max_move / config_dict.plate_scale * 1.5
-        x_cent = subframe[0]
-        y_cent = subframe[1]
-        data_subframe = data[int(y_cent - r):int(y_cent + r), int(x_cent - r):int(x_cent + r)]
-        image = image[int(y_cent - r):int(y_cent + r), int(x_cent - r):int(x_cent + r)]
-        threshold = threshold[int(y_cent - r):int(y_cent + r), int(x_cent - r):int(x_cent + r)]
-        starfound = photutils.find_peaks(data_subframe, threshold=threshold, box_size=50, border_width=10,
-                                         centroid_func=photutils.centroids.centroid_com)
-
-    n = 0
-    stars = []
-    peaks = []
-    for _ in starfound:
-        bad_pixel = False
-        x_cent = starfound['x_peak'][n]
-        y_cent = starfound['y_peak'][n]
-        peak = image[y_cent, x_cent]
-        n += 1
-        if peak >= (saturation * 2) ** 2:
-            bad_pixel = True
-        pixels = [(y_cent, x_cent + 1), (y_cent, x_cent - 1), (y_cent + 1, x_cent), (y_cent - 1, x_cent)]
-        for value in pixels:
-            if image[value[0], value[1]] < 1.2 * median:
-                bad_pixel = True
-        if bad_pixel:
-            continue
-        star = (x_cent, y_cent)
-        stars.append(star)
-        peaks.append(peak)
+        x = np.asarray(starfound['x_peak'])
+        y = np.asarray(starfound['y_peak'])
+        (height, width) = image.shape
+        peak = image[y, x]
+        # Hot pixels stand alone, so a star needs all four neighbours of its peak above the background
+        neighbours = image[np.stack([y, y, np.minimum(y + 1, height - 1), np.maximum(y - 1, 0)]),
+                           np.stack([np.minimum(x + 1, width - 1), np.maximum(x - 1, 0), x, x])]
+        good = (peak < (saturation * 2) ** 2) & np.all(neighbours >= 1.2 * median, axis=0)
+        stars = list(zip(x[good], y[good]))
+        peaks = list(peak[good])
 
     if not return_data:
         return stars, peaks
@@ -127,94 +398,354 @@ def gaussianfit(x, a, x0, sigma):
     return a*np.exp(-(x-x0)**2/(2*sigma**2))
 
 
-def radial_average(path: str, saturation: Union[int, float]) -> Tuple[Optional[Union[float, int]],
+def star_stamps(data: Union[np.ndarray, MappedFrame], stars: list, radius: int = 30,
+                background: float = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Description
+    -----------
+    Cuts a square stamp around every star into a single 3-D array with one fancy-indexing operation.
+
+    Parameters
+    ----------
+    data : NUMPY.NDARRAY or MappedFrame
+        Image data.  Only the stamps are read from a MappedFrame.
+    stars : LIST
+        (x position, y position) of each star, i.e. from findstars.
+    radius : INT, optional
+        Half the width of each stamp in pixels.  The default is 30.
+    background : FLOAT, optional
+        Background level to subtract from the stamps.  The default is 0, for data that is already background
+        subtracted.
+
+    Returns
+    -------
+    stamps : NUMPY.NDARRAY
+        (number of stars, 2 * radius, 2 * radius) float array of pixel values around each star.  Pixels that fall
+        off the edge of the image are 0.
+    valid : NUMPY.NDARRAY
+        Boolean array of the same shape, False for pixels that fall off the edge of the image.
+
+    """
+    centers = np.asarray(stars, dtype=int).reshape(-1, 2)
+    offsets = np.arange(-radius, radius)
+    rows = centers[:, 1, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+    columns = centers[:, 0, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+    valid = (rows >= 0) & (rows < data.shape[0]) & (columns >= 0) & (columns < data.shape[1])
+    stamps = data[np.clip(rows, 0, data.shape[0] - 1), np.clip(columns, 0, data.shape[1] - 1)] - float(background)
+    stamps[~valid] = 0
+    return stamps, valid
+
+
+def radial_profiles(stamps: np.ndarray, valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parameters
+    ----------
+    stamps : NUMPY.NDARRAY
+        Star stamps from star_stamps.
+    valid : NUMPY.NDARRAY
+        Valid pixel mask from star_stamps.
+
+    Returns
+    -------
+    radii : NUMPY.NDARRAY
+        Mean radius of the pixels in each whole-pixel radius bin around the center of the stamps.
+    profiles : NUMPY.NDARRAY
+        (number of stars, number of radii) mean pixel value in each radius bin of each stamp, from a single bincount
+        over every star.  Bins with no valid pixels are NaN.
+
+    """
+    (n, height, width) = stamps.shape
+    (y, x) = np.indices((height, width))
+    r = np.hypot(y - height // 2, x - width // 2).astype(int)
+    nbins = r.max() + 1
+    index = (np.arange(n)[:, np.newaxis, np.newaxis] * nbins + r[np.newaxis, :, :]).ravel()
+    totals = np.bincount(index, weights=stamps.ravel(), minlength=n * nbins)
+    counts = np.bincount(index, weights=valid.ravel().astype(float), minlength=n * nbins)
+    radii = np.bincount(r.ravel(), weights=np.hypot(y - height // 2, x - width // 2).ravel()) / np.bincount(r.ravel())
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return radii, (totals / counts).reshape(n, nbins)
+
+
+def profile_fwhm(radii: np.ndarray, profiles: np.ndarray) -> np.ndarray:
+    """
+    Description
+    -----------
+    Measures the fwhm of every radial profile at once, from the first radius at which the profile drops to half of
+    its maximum, interpolated linearly between the bins on either side.  Profiles without a clean half maximum
+    crossing fall back to a Gaussian fit with curve_fit.
+
+    Parameters
+    ----------
+    radii : NUMPY.NDARRAY
+        Radius of each profile bin, from radial_profiles.
+    profiles : NUMPY.NDARRAY
+        Radial profiles from radial_profiles.
+
+    Returns
+    -------
+    NUMPY.NDARRAY
+        The fwhm of each profile in pixels, or NaN where none could be found.
+
+    """
+    profiles = np.nan_to_num(profiles)
+    maximum = profiles.max(axis=1)
+    fwhm = np.full(len(profiles), np.nan)
+    good = maximum > 0
+    normalized = np.zeros_like(profiles)
+    normalized[good] = profiles[good] / maximum[good, np.newaxis]
+    below = normalized <= 0.5
+    crossing = np.argmax(below, axis=1)
+    clean = good & below.any(axis=1) & (crossing > 0)
+    rows = np.flatnonzero(clean)
+    (inside, outside) = (normalized[rows, crossing[rows] - 1], normalized[rows, crossing[rows]])
+    (r_inside, r_outside) = (radii[crossing[rows] - 1], radii[crossing[rows]])
+    fwhm[rows] = 2 * (r_inside + (inside - 0.5) / (inside - outside) * (r_outside - r_inside))
+    f = radii
+    for row in np.flatnonzero(good & ~clean):
+        try:
+            popt, pcov = curve_fit(gaussianfit, f, normalized[row],
+                                   p0=[1 / (np.sqrt(2 * np.pi)), np.mean(normalized[row]), np.std(normalized[row])])
+        except RuntimeError:
+            logging.debug("Could not find a Gaussian Fit for a star...skipping it")
+            continue
+        g = np.linspace(0, f[-1], 10 * len(f))
+        half = np.flatnonzero(gaussianfit(g, *popt) <= 1 / 2)
+        if len(half):
+            fwhm[row] = 2 * g[half[0]]
+    return fwhm
+
+
+def half_flux_diameters(stamps: np.ndarray, valid: np.ndarray, annulus: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Description
+    -----------
+    Measures the half flux diameter (HFD) of every star stamp at once.  The local background of each stamp is the
+    median of an annulus at its edge, and the HFD is twice the flux-weighted mean radius of the pixels inside it.
+    Unlike the fwhm, this uses the whole star rather than just the core, so it stays well behaved far from focus.
+
+    Parameters
+    ----------
+    stamps : NUMPY.NDARRAY
+        Star stamps from star_stamps.
+    valid : NUMPY.NDARRAY
+        Valid pixel mask from star_stamps.
+    annulus : INT, optional
+        Width in pixels of the background annulus at the edge of each stamp.  The default is 5.
+
+    Returns
+    -------
+    hfd : NUMPY.NDARRAY
+        HFD of each star in pixels, or NaN if the star has no positive flux.
+    flux : NUMPY.NDARRAY
+        Background subtracted flux of each star.
+
+    """
+    (n, height, width) = stamps.shape
+    (y, x) = np.indices((height, width))
+    r = np.hypot(y - height // 2, x - width // 2)
+    outer = min(height, width) // 2
+    ring = (r >= outer - annulus) & (r < outer)
+    inside = r < outer - annulus
+    background = np.nanmedian(np.where(valid & ring, stamps, np.nan)[:, ring], axis=1)
+    background = np.nan_to_num(background)
+    flux_pixels = np.where(valid[:, inside], stamps[:, inside] - background[:, np.newaxis], 0)
+    flux = flux_pixels.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hfd = 2 * (flux_pixels * r[inside]).sum(axis=1) / flux
+    hfd[~(flux > 0)] = np.nan
+    return hfd, flux
+
+
+def focus_metric(path: Union[str, FrameSlot], saturation: Union[int, float], metric: str = 'hfd',
+                 max_stars: Optional[int] = None) -> Tuple[Optional[float], Optional[float], int]:
+    """
+    Description
+    -----------
+    Combines the HFD or fwhm of every unsaturated star in an image into a single focus metric.  Outliers (blends,
+    hot pixels, edge stars) are sigma clipped, and the remaining stars are weighted by their signal to noise.
+
+    Parameters
+    ----------
+    path : STR or FrameSlot
+        File path to fits image to measure, or where it is in a FrameBuffer.
+    saturation : INT
+        Number of counts for a star to be considered saturated for a specific CCD Camera.
+    metric : STR, optional
+        'hfd' for the half flux diameter or 'fwhm' for the radial profile fwhm.  The default is 'hfd'.
+    max_stars : INT, optional
+        Only the brightest max_stars unsaturated stars are measured, for a quick look at science frames.  The default
+        is None, which measures all of them.
+
+    Returns
+    -------
+    value : FLOAT
+        Weighted mean HFD or fwhm of the stars in pixels, or None if no star could be measured.
+    uncertainty : FLOAT
+        Standard error of value, or None if fewer than 2 stars could be measured.
+    n_stars : INT
+        Number of stars that were combined.
+
+    """
+    stars, peaks = findstars(path, saturation)
+    peaks = np.asarray(peaks, dtype=float)
+    unsaturated = np.flatnonzero(peaks <= saturation * 2)
+    if max_stars is not None:
+        unsaturated = unsaturated[np.argsort(-peaks[unsaturated], kind='stable')[:max_stars]]
+    stars = [stars[i] for i in unsaturated]
+    if not stars:
+        return None, None, 0
+    with open_frame(path) as frame:
+        (mean, median, stdev) = frame_stats(path, frame)
+        (stamps, valid) = star_stamps(frame, stars, radius=30, background=median)
+    (hfd, flux) = half_flux_diameters(stamps, valid)
+    values = hfd if metric == 'hfd' else profile_fwhm(*radial_profiles(stamps, valid))
+    snr = flux / np.sqrt(np.abs(flux) + valid.sum(axis=(1, 2)) * stdev**2)
+    good = ~np.isnan(values) & (values >= 1) & (snr > 0)
+    (values, weights) = (values[good], snr[good]**2)
+    if len(values) == 0:
+        return None, None, 0
+    if len(values) >= 3:
+        kept = ~sigma_clip(values, sigma=3, maxiters=5).mask
+        (values, weights) = (values[kept], weights[kept])
+    value = float(np.average(values, weights=weights))
+    if len(values) < 2:
+        return value, None, len(values)
+    n_effective = weights.sum()**2 / (weights**2).sum()
+    scatter = np.sqrt(np.average((values - value)**2, weights=weights) * len(values) / (len(values) - 1))
+    return value, float(scatter / np.sqrt(n_effective)), len(values)
+
+
+def radial_average(path: Union[str, FrameSlot], saturation: Union[int, float]) -> Tuple[Optional[Union[float, int]],
                                                                       Union[float, int], bool]:
     """
     Description
     -----------
-    Finds the median fwhm of an image.
+    Finds the fwhm of an image.  The radial profiles and fwhm of every star are measured together, see
+    star_stamps, radial_profiles and profile_fwhm.
 
     Parameters
     ----------
-    path : STR
-        File path to fits image to get fwhm from.
+    path : STR or FrameSlot
+        File path to fits image to get fwhm from, or where it is in a FrameBuffer.
     saturation : INT
         Number of counts for a star to be considered saturated for a specific CCD Camera.
 
     Returns
     -------
-    fwhm_final : LIST
+    fwhm_final : FLOAT
         The fwhm of the brightest unsaturated star in the image, or the median fwhm if all stars are saturated.
         If no fwhm was found, returns None.
+    fwhm_peak : FLOAT
+        Peak counts of the star that fwhm_final came from, or -1 if it is a median or no fwhm was found.
+    saturated : BOOL
+        True if the brightest star with a fwhm is saturated.
 
     """
-    stars, peaks, data, stdev = findstars(path, saturation, return_data=True)
-    r_ = 30
-    fwhm_list = []
-    # a = 0
-    for star in stars:
-        x_cent = star[0]
-        y_cent = star[1]
-        star = data[int(y_cent-r_):int(y_cent+r_), int(x_cent-r_):int(x_cent+r_)]
-        starx, stary = np.indices(star.shape)
-        r = np.sqrt((stary - r_)**2 + (starx - r_)**2)
-        r = r.astype(np.int)
-
-        tbin = np.bincount(r.ravel(), star.ravel())
-        nr = np.bincount(r.ravel())
-        radialprofile = tbin / nr
-       
-        if len(radialprofile) != 0:
-            maximum = max(radialprofile)
-            if maximum == 0:
-                continue
-            else:
-                radialprofile = radialprofile / maximum
-            f = np.linspace(0, len(radialprofile)-1, len(radialprofile))
-            mean = np.mean(radialprofile)
-            sigma = np.std(radialprofile)
-            try:
-                popt, pcov = curve_fit(gaussianfit, f, radialprofile, p0=[1 / (np.sqrt(2 * np.pi)), mean, sigma])
-                g = np.linspace(0, len(radialprofile)-1, 10*len(radialprofile))
-                function = gaussianfit(g, *popt)
-                for x in range(len(function)):
-                    if function[x] <= (1/2):
-                        fwhm = 2*g[x]
-                        fwhm_list.append(fwhm)
-                        break
-            except RuntimeError:
-                logging.debug("Could not find a Gaussian Fit...using whole pixel values to estimate fwhm")
-                for x in range(len(radialprofile)):
-                    if radialprofile[x] <= (1/2):
-                        fwhm = 2*f[x]
-                        fwhm_list.append(fwhm)
-                        break
-
-        else:
-            logging.error('Radial profile has length of 0...')
-            continue
-
-    fwhm_peaks = np.array((fwhm_list, peaks))
-    fwhm_peaks = np.delete(fwhm_peaks, np.where(fwhm_peaks[0, :] < 3), 1)
-    if not np.any(fwhm_peaks):
+    stars, peaks = findstars(path, saturation)
+    if not stars:
+        return None, -1, False
+    with open_frame(path) as frame:
+        (mean, median, stdev) = frame_stats(path, frame)
+        (stamps, valid) = star_stamps(frame, stars, radius=30, background=median)
+    fwhm = profile_fwhm(*radial_profiles(stamps, valid))
+    peaks = np.asarray(peaks, dtype=float)
+    keep = ~np.isnan(fwhm) & (fwhm >= 3)
+    (fwhm, peaks) = (fwhm[keep], peaks[keep])
+    if not len(fwhm):
         return None, -1, False
 
-    saturated_peak = max(fwhm_peaks[1, :])
-    saturated = (saturated_peak >= saturation * 2)
-    highest_peak = 0
-    for i in range(len(fwhm_peaks[0, :])):
-        if fwhm_peaks[1, highest_peak] < fwhm_peaks[1, i] <= saturation * 2:
-            highest_peak = i
-    if highest_peak != -1:
-        fwhm_final = fwhm_peaks[0, highest_peak]
-        fwhm_peak = fwhm_peaks[1, highest_peak]
+    saturated = (peaks.max() >= saturation * 2)
+    unsaturated = np.flatnonzero(peaks <= saturation * 2)
+    if len(unsaturated):
+        brightest = unsaturated[np.argmax(peaks[unsaturated])]
+        fwhm_final = float(fwhm[brightest])
+        fwhm_peak = peaks[brightest]
     else:
-        fwhm_final = float(np.median(fwhm_peaks[0, :]))
+        fwhm_final = float(np.median(fwhm))
         fwhm_peak = -1
 
     return fwhm_final, fwhm_peak, saturated
 
 
+def _registration_region(path: Union[str, FrameSlot], size: int, binning: int) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    path : STR or FrameSlot
+        Path to the fits image file, or where it is in a FrameBuffer.
+    size : INT
+        Side in pixels of the central square of the image to use.
+    binning : INT
+        Number of pixels on a side that are summed into each pixel of the result.
+
+    Returns
+    -------
+    NUMPY.NDARRAY
+        The central square of the image, binned, with the sky and its noise removed so that the stars are all that
+        is left.  The stars are compressed with an arcsinh stretch, which keeps their profiles symmetric (unlike
+        clipping them) while no single bright or saturated star can dominate.
+
+    """
+    with open_frame(path) as frame:
+        (mean, median, stdev) = frame_stats(path, frame)
+        (height, width) = frame.shape
+        size = min(size, height, width) // binning * binning
+        (top, left) = ((height - size) // 2, (width - size) // 2)
+        region = frame[top:top + size, left:left + size].astype(np.float32)
+    region = region.reshape(size // binning, binning, size // binning, binning).sum(axis=(1, 3))
+    # Summing binning**2 pixels multiplies the sky by binning**2 but its noise only by binning
+    region -= np.float32(binning**2 * median + 3 * binning * stdev)
+    np.maximum(region, 0, out=region)
+    region /= np.float32(10 * binning * stdev)
+    return np.arcsinh(region, out=region)
+
+
+def frame_offset(path: Union[str, FrameSlot], reference: Union[str, FrameSlot], size: int = 1024, binning: int = 2,
+                 upsample: int = 20) -> Tuple[float, float, float]:
+    """
+    Description
+    -----------
+    Measures how far the field has moved since a reference image, by registering the central square of both with
+    FFT phase correlation.  Every star in the square contributes, so the offset holds up when any one star
+    saturates or fades behind a cloud, and no stars have to be detected.  The reference is only prepared once.
+
+    Parameters
+    ----------
+    path : STR or FrameSlot
+        Path to the new fits image file, or where it is in a FrameBuffer.
+    reference : STR or FrameSlot
+        Path to the reference fits image file, or where it is in a FrameBuffer.
+    size : INT, optional
+        Side in pixels of the central square to register.  The default is 1024.
+    binning : INT, optional
+        Binning of the square before it is registered, which makes the FFTs faster.  The default is 2.
+    upsample : INT, optional
+        Subdivisions of a binned pixel that the offset is refined to.  The default is 20.
+
+    Returns
+    -------
+    dx : FLOAT
+        Shift of the stars along x since the reference, in unbinned pixels.
+    dy : FLOAT
+        Shift of the stars along y since the reference, in unbinned pixels.
+    peak : FLOAT
+        Height of the correlation peak, between 0 and 1.  Low values mean the images do not match well, i.e. because
+        of clouds.
+
+    """
+    key = (frame_key(reference), size, binning)
+    if key not in _registration_cache:
+        _registration_cache.clear()
+        _registration_cache[key] = _registration_region(reference, size, binning)
+    previous = _registration_cache[key]
+    current = _registration_region(path, size, binning)
+    if current.shape != previous.shape:
+        raise ValueError('Image and reference are not the same size')
+    (dy, dx, peak) = registration_utils.phase_correlation(previous, current, upsample=upsample,
+                                                          cutoff=registration_cutoff)
+    return dx * binning, dy * binning, peak
+
+
 """
 Gaussian plot for future reference:
 
@@ -230,4 +761,4 @@ Gaussian plot for future reference:
                  plt.savefig(r'C:/Users/GMU Observtory1/-omegalambda/test/GaussianPlot.png')
                  a += 1
 
-"""
\ No newline at end of file
+"""
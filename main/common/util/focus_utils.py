@@ -0,0 +1,244 @@
+# Focus curve utils for the focuser procedures
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+
+def curve_inputs(positions: Sequence[float], values: Sequence[float],
+                 uncertainties: Sequence[Optional[float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Description
+    -----------
+    The measurements of a focus run as the arrays that fit_v_curve fits, so they can be plotted or saved the same
+    way.
+
+    Parameters
+    ----------
+    positions : LIST
+        Focuser position of each measurement.
+    values : LIST
+        HFD (or fwhm) of each measurement, in pixels.
+    uncertainties : LIST
+        Uncertainty of each value.  None values are given the largest known relative uncertainty, or 5% if none are
+        known.
+
+    Returns
+    -------
+    x : NUMPY.NDARRAY
+        Positions.
+    y : NUMPY.NDARRAY
+        Values.
+    sigma : NUMPY.NDARRAY
+        Uncertainties, all positive.
+
+    """
+    x = np.asarray(positions, dtype=float)
+    y = np.asarray(values, dtype=float)
+    relative = [u / v for (u, v) in zip(uncertainties, values) if u and v]
+    fallback = max(relative) if relative else 0.05
+    sigma = np.array([u if u else fallback * v for (u, v) in zip(uncertainties, values)], dtype=float)
+    return x, y, np.maximum(sigma, 1e-3 * np.abs(y) + 1e-6)
+
+
+def _design(x: np.ndarray, center: float) -> np.ndarray:
+    """
+    Returns
+    -------
+    NUMPY.NDARRAY
+        Design matrix of a parabola in (x - center), centered for numerical stability.
+
+    """
+    u = x - center
+    return np.stack([np.ones_like(u), u, u**2], axis=1)
+
+
+def fit_v_curve(positions: Sequence[float], values: Sequence[float],
+                uncertainties: Sequence[Optional[float]]) -> Optional[Tuple[float, float, np.ndarray]]:
+    """
+    Description
+    -----------
+    Fits the hyperbolic V-curve HFD(x) = sqrt(a + b(x - c)^2) of a focus run, by fitting a parabola to HFD^2 with
+    weighted linear least squares.  Unlike a parabola fit to HFD itself, this follows both the bottom of the curve
+    and its straight arms, so points far from focus are still useful.
+
+    Parameters
+    ----------
+    positions : LIST
+        Focuser position of each measurement.
+    values : LIST
+        HFD (or fwhm) of each measurement, in pixels.
+    uncertainties : LIST
+        Uncertainty of each value, from focus_metric.  May contain None.
+
+    Returns
+    -------
+    TUPLE
+        Best focus position, its standard error in steps, and the fit coefficients (for HFD^2 as a parabola in
+        position - mean position).  None if there are fewer than 3 distinct positions, or the fitted curve does not
+        open upward.
+
+    """
+    (x, y, sigma) = curve_inputs(positions, values, uncertainties)
+    if len(np.unique(x)) < 3:
+        return None
+    center = float(np.mean(x))
+    design = _design(x, center)
+    weights = 1 / (2 * y * sigma)**2
+    normal = design.T @ (design * weights[:, np.newaxis])
+    try:
+        covariance = np.linalg.inv(normal)
+    except np.linalg.LinAlgError:
+        return None
+    coefficients = covariance @ (design.T @ (weights * y**2))
+    if coefficients[2] <= 0:
+        return None
+    dof = len(x) - 3
+    if dof > 0:
+        chi2 = np.sum(weights * (y**2 - design @ coefficients)**2) / dof
+        covariance = covariance * max(chi2, 1.0)
+    best = center - coefficients[1] / (2 * coefficients[2])
+    gradient = np.array([0, -1 / (2 * coefficients[2]), coefficients[1] / (2 * coefficients[2]**2)])
+    error = float(np.sqrt(gradient @ covariance @ gradient))
+    return float(best), error, np.append(coefficients, center)
+
+
+def v_curve_values(coefficients: np.ndarray, positions: Sequence[float]) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    coefficients : NUMPY.NDARRAY
+        Fit coefficients from fit_v_curve.
+    positions : LIST
+        Focuser positions to evaluate the curve at.
+
+    Returns
+    -------
+    NUMPY.NDARRAY
+        The fitted HFD at each position.
+
+    """
+    design = _design(np.asarray(positions, dtype=float), coefficients[3])
+    return np.sqrt(np.maximum(design @ coefficients[:3], 0))
+
+
+def v_curve_position(coefficients: np.ndarray, value: float, near: float) -> Optional[float]:
+    """
+    Parameters
+    ----------
+    coefficients : NUMPY.NDARRAY
+        Fit coefficients from fit_v_curve.
+    value : FLOAT
+        A measured HFD.
+    near : FLOAT
+        Roughly where it was measured, to pick the side of the V.
+
+    Returns
+    -------
+    FLOAT
+        The position on the fitted curve with that HFD, on the same side of best focus as near, or None if the HFD
+        is below the bottom of the curve.
+
+    """
+    (a, b, c, center) = coefficients
+    discriminant = b**2 - 4 * c * (a - value**2)
+    if discriminant < 0:
+        return None
+    roots = (-b + np.array([-1, 1]) * np.sqrt(discriminant)) / (2 * c) + center
+    return float(roots[np.argmin(np.abs(roots - near))])
+
+
+def expected_value(positions: Sequence[float], values: Sequence[float], uncertainties: Sequence[Optional[float]],
+                   position: float) -> float:
+    """
+    Parameters
+    ----------
+    positions : LIST
+        Focuser position of each measurement so far.
+    values : LIST
+        HFD (or fwhm) of each measurement.
+    uncertainties : LIST
+        Uncertainty of each value, may contain None.
+    position : FLOAT
+        Position of a measurement that has not been analyzed yet.
+
+    Returns
+    -------
+    FLOAT
+        Best guess of the value at position: the V-curve fit if there is one, otherwise a little below the lowest
+        value so far, since until the minimum is bracketed each new position is expected to be better.
+
+    """
+    if not len(values):
+        return 1.0
+    fit = fit_v_curve(positions, values, uncertainties)
+    if fit is None:
+        return 0.95 * float(np.min(values))
+    return float(v_curve_values(fit[2], [position])[0])
+
+
+def next_focus_position(positions: Sequence[float], values: Sequence[float],
+                        uncertainties: Sequence[Optional[float]], low: float, high: float,
+                        step: float) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Description
+    -----------
+    Decides where to take the next focus exposure.  Until the minimum is bracketed by higher values on both sides,
+    the bracket is extended by step past whichever edge has the lowest value.  After that, every candidate position
+    in the bracket is tried against the current V-curve fit, and the one that would shrink the uncertainty of the
+    best focus position the most is chosen.
+
+    Parameters
+    ----------
+    positions : LIST
+        Focuser position of each measurement so far.
+    values : LIST
+        HFD (or fwhm) of each measurement.
+    uncertainties : LIST
+        Uncertainty of each value, may contain None.
+    low : FLOAT
+        Lowest position that the focuser may go to.
+    high : FLOAT
+        Highest position that the focuser may go to.
+    step : FLOAT
+        Size of each bracketing step, and the spacing of the candidate positions is a fifth of it.
+
+    Returns
+    -------
+    position : FLOAT
+        Next position to measure, or None if the minimum lies past low or high.
+    best : FLOAT
+        Current estimate of the best focus position, or None if the minimum is not bracketed yet.
+
+    """
+    (x, y, sigma) = curve_inputs(positions, values, uncertainties)
+    order = np.argsort(x)
+    (x, y, sigma) = (x[order], y[order], sigma[order])
+    lowest = int(np.argmin(y))
+    if lowest == 0 or lowest == len(x) - 1:
+        edge = x[lowest] - step if lowest == 0 else x[lowest] + step
+        if len(x) == 1:
+            edge = x[0] - step
+        return (float(edge) if low <= edge <= high else None), None
+    fit = fit_v_curve(x, y, sigma)
+    if fit is None:
+        # Not enough of a V yet, so fill in the widest gap next to the lowest point
+        gaps = [(x[lowest] - x[lowest - 1], (x[lowest] + x[lowest - 1]) / 2),
+                (x[lowest + 1] - x[lowest], (x[lowest] + x[lowest + 1]) / 2)]
+        return float(max(gaps)[1]), None
+    (best, error, coefficients) = fit
+    candidates = np.arange(x[0], x[-1] + step / 10, step / 5)
+    candidates = candidates[np.min(np.abs(candidates[:, np.newaxis] - x[np.newaxis, :]), axis=1) >= step / 10]
+    if not len(candidates):
+        return float(best), best
+    predicted = v_curve_values(coefficients, candidates)
+    relative = np.median(sigma / y)
+    weights = 1 / (2 * y * sigma)**2
+    design = _design(x, coefficients[3])
+    normal = design.T @ (design * weights[:, np.newaxis])
+    candidate_design = _design(candidates, coefficients[3])
+    candidate_weights = 1 / (2 * predicted**2 * relative + 1e-9)**2
+    gradient = np.array([0, -1 / (2 * coefficients[2]), coefficients[1] / (2 * coefficients[2]**2)])
+    # Predicted variance of the best focus position after adding each candidate, all at once
+    updated = normal[np.newaxis, :, :] + candidate_weights[:, np.newaxis, np.newaxis] * \
+        candidate_design[:, :, np.newaxis] * candidate_design[:, np.newaxis, :]
+    variances = np.einsum('i,nij,j->n', gradient, np.linalg.inv(updated), gradient)
+    return float(candidates[np.argmin(variances)]), best
@@ -0,0 +1,150 @@
+# Image registration utils for weather nowcasting & guiding
+import numpy as np
+from typing import Optional, Tuple
+
+
+def _parabolic_offset(left: float, center: float, right: float) -> float:
+    """
+    Parameters
+    ----------
+    left : FLOAT
+        Value one sample before the peak.
+    center : FLOAT
+        Value at the peak.
+    right : FLOAT
+        Value one sample after the peak.
+
+    Returns
+    -------
+    FLOAT
+        Sub-sample offset of the vertex of the parabola through the three points, between -0.5 and 0.5.
+
+    """
+    denominator = left - 2*center + right
+    if denominator == 0:
+        return 0.0
+    return float(np.clip(0.5 * (left - right) / denominator, -0.5, 0.5))
+
+
+def _refine_peak(cross_power: np.ndarray, dy: float, dx: float, upsample: int) -> Tuple[float, float, float]:
+    """
+    Description
+    -----------
+    Evaluates the inverse DFT of the normalized cross power spectrum on a grid upsample times finer than the pixels,
+    over 1.5 pixels around a coarse peak, with two small matrix products instead of an upsampled FFT.
+
+    Parameters
+    ----------
+    cross_power : NUMPY.NDARRAY
+        Full (not real FFT) normalized, and possibly weighted, cross power spectrum.
+    dy : FLOAT
+        Coarse row shift.
+    dx : FLOAT
+        Coarse column shift.
+    upsample : INT
+        Subdivisions of a pixel.
+
+    Returns
+    -------
+    TUPLE
+        Refined row shift, column shift and peak height.
+
+    """
+    (height, width) = cross_power.shape
+    steps = (np.arange(int(np.ceil(1.5 * upsample)) + 1) - np.ceil(0.75 * upsample)) / upsample
+    (rows, columns) = (np.round(dy) + steps, np.round(dx) + steps)
+    row_kernel = np.exp(2j * np.pi * np.outer(rows, np.fft.fftfreq(height)))
+    column_kernel = np.exp(2j * np.pi * np.outer(np.fft.fftfreq(width), columns))
+    correlation = (row_kernel @ cross_power @ column_kernel).real / (height * width)
+    (y_peak, x_peak) = np.unravel_index(np.argmax(correlation), correlation.shape)
+    return float(rows[y_peak]), float(columns[x_peak]), float(correlation[y_peak, x_peak])
+
+
+def _spectral_weights(shape: Tuple[int, int], cutoff: float) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    shape : TUPLE
+        Rows and columns of the images.
+    cutoff : FLOAT
+        Width of the Gaussian, in cycles per pixel.
+
+    Returns
+    -------
+    NUMPY.NDARRAY
+        Gaussian low-pass weight of every frequency of the full spectrum, scaled so that they average to 1, which
+        keeps the peak of identical images at 1.  The first shape[1] // 2 + 1 columns are the weights of a real FFT
+        (rfft2) spectrum.
+
+    """
+    rows = np.fft.fftfreq(shape[0])[:, np.newaxis] ** 2
+    columns = np.fft.fftfreq(shape[1])[np.newaxis, :] ** 2
+    weights = np.exp(-(rows + columns) / (2 * cutoff**2))
+    return (weights / weights.mean()).astype(np.float32)
+
+
+def phase_correlation(reference: np.ndarray, image: np.ndarray, window: bool = True, upsample: int = 1,
+                      cutoff: Optional[float] = None) -> Tuple[float, float, float]:
+    """
+    Description
+    -----------
+    Finds the translation between two images of the same shape using FFT phase correlation.  Every feature in the
+    images contributes to the result, so no single source has to be detected.
+
+    Parameters
+    ----------
+    reference : NUMPY.NDARRAY
+        2-D reference image.
+    image : NUMPY.NDARRAY
+        2-D image to register against the reference, same shape as the reference.
+    window : BOOL, optional
+        Whether or not to apply a Hann window before the FFT to suppress edge effects.  The default is True.
+    upsample : INT, optional
+        If more than 1, the peak is refined to 1 / upsample pixels with a local upsampled DFT, which is far more
+        accurate than the parabolic fit when the peak is only a pixel wide, i.e. for star fields.  The default is 1.
+    cutoff : FLOAT, optional
+        If given, the normalized cross power spectrum is weighted by a Gaussian this wide in cycles per pixel.  Pure
+        phase correlation weighs every frequency the same, so in faint images the frequencies above those of the
+        sources, where only noise is left, can pull the peak away.  The default is None, for no weighting.
+
+    Returns
+    -------
+    dy : FLOAT
+        Sub-pixel shift along the first axis (rows) of image relative to reference.
+    dx : FLOAT
+        Sub-pixel shift along the second axis (columns) of image relative to reference.
+    peak : FLOAT
+        Height of the correlation peak, between 0 and 1.  Low values mean the images do not match well.
+
+    """
+    reference = np.asarray(reference, dtype=np.float32)
+    image = np.asarray(image, dtype=np.float32)
+    if reference.shape != image.shape:
+        raise ValueError('Images must be the same shape to be registered')
+    reference = reference - reference.mean()
+    image = image - image.mean()
+    if window:
+        hann = np.outer(np.hanning(reference.shape[0]), np.hanning(reference.shape[1])).astype(np.float32)
+        reference *= hann
+        image *= hann
+    # The upsampled refinement needs the full spectra, whose first half of the columns is the real FFT spectrum
+    transform = np.fft.fft2 if upsample > 1 else np.fft.rfft2
+    full_cross_power = transform(image) * np.conj(transform(reference))
+    full_cross_power /= np.abs(full_cross_power) + 1e-12
+    if cutoff:
+        full_cross_power *= _spectral_weights(reference.shape, cutoff)[:, :full_cross_power.shape[1]]
+    correlation = np.fft.irfft2(full_cross_power[:, :reference.shape[1] // 2 + 1], s=reference.shape)
+    (y_peak, x_peak) = np.unravel_index(np.argmax(correlation), correlation.shape)
+    (height, width) = correlation.shape
+    dy = y_peak + _parabolic_offset(correlation[(y_peak - 1) % height, x_peak], correlation[y_peak, x_peak],
+                                    correlation[(y_peak + 1) % height, x_peak])
+    dx = x_peak + _parabolic_offset(correlation[y_peak, (x_peak - 1) % width], correlation[y_peak, x_peak],
+                                    correlation[y_peak, (x_peak + 1) % width])
+    # Shifts past the halfway point wrap around to negative shifts
+    if dy > height / 2:
+        dy -= height
+    if dx > width / 2:
+        dx -= width
+    if upsample > 1:
+        return _refine_peak(full_cross_power, dy, dx, upsample)
+    return float(dy), float(dx), float(correlation[y_peak, x_peak])
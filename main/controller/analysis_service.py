@@ -0,0 +1,323 @@
+# Image analysis worker processes
+import os
+import time
+import ctypes
+import logging
+import threading
+import collections
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+
+from ..common.IO import config_reader
+from ..common.IO.frame_buffer import FrameSlot
+from ..common.util import filereader_utils     # Loaded by every worker process as it starts
+
+
+def _initialize_worker(config, niceness):
+    """
+    Description
+    -----------
+    Runs once in every worker process.  Workers do not share the global config of the main process, so it is handed
+    to them here, and their scheduling priority is lowered so that analysis never starves the control threads.
+
+    Parameters
+    ----------
+    config : CLASS INSTANCE OBJECT of Config
+        The global config of the main process.
+    niceness : INT
+        Amount to lower the priority of the worker by on POSIX.  On Windows, workers run below normal priority.
+
+    Returns
+    -------
+    None.
+
+    """
+    config_reader._config = config
+    if hasattr(os, 'nice'):
+        os.nice(niceness)
+    else:
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x4000)     # BELOW_NORMAL_PRIORITY_CLASS
+
+
+def _timed(function, args, kwargs, stats, keys):
+    """
+    Parameters
+    ----------
+    function : FUNCTION
+        Analysis function to run.
+    args : TUPLE
+        Arguments of the function.
+    kwargs : DICT
+        Keyword arguments of the function.
+    stats : DICT
+        Background statistics of the frames of the request that the main process already knows, by frame key.
+    keys : LIST
+        Frame keys of the frames of the request.
+
+    Returns
+    -------
+    TUPLE
+        The result of the function, how many seconds it took in the worker, and the background statistics of the
+        frames of the request, so the main process can hand them to whichever worker analyzes the frames next.
+
+    """
+    filereader_utils.cache_stats(stats)
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start, filereader_utils.cached_stats(keys)
+
+
+def _frame_keys(args):
+    """
+    Returns
+    -------
+    LIST
+        Frame keys of every argument that is a FrameSlot or the path of a file.
+
+    """
+    keys = []
+    for arg in args:
+        if isinstance(arg, FrameSlot):
+            keys.append(arg.key)
+        elif isinstance(arg, str) and os.path.isfile(arg):
+            keys.append(filereader_utils.frame_key(arg))
+    return keys
+
+
+class AnalysisService:
+
+    guiding = 0                 # Priority of guide frames, which are analyzed before anything else
+    focus = 1                   # Priority of focus run frames
+    quality = 2                 # Priority of science frame quality checks and calibration frames
+    queue_limits = {guiding: 2, focus: 4, quality: 8}   # Most requests waiting at each priority
+    niceness = 5                # Priority decrease of the worker processes on POSIX
+    dropped = (concurrent.futures.CancelledError, Exception)     # Errors of a request whose frame is just skipped
+
+    def __init__(self, processes=None, frame_buffer=None):
+        """
+        Description
+        -----------
+        Runs star finding, focus metrics and frame statistics in a pool of worker processes, so the heavy numpy,
+        scipy and photutils work of the guider, focuser and calibration never competes with the COM and serial
+        control threads for the interpreter.  Requests are queued by priority and handed to the pool only when a
+        worker is free, so a guide frame never waits behind a backlog of quality checks.  Each priority has a
+        bounded queue, and when it is full the oldest waiting request is cancelled, since a newer frame makes it
+        stale anyway.  The background statistics that any worker measures are kept here in the main process and
+        sent along with every later request for the same frame, so each frame is only measured once whichever
+        workers analyze it.  If a worker dies, i.e. runs out of memory on a big frame, the pool is replaced and the
+        requests that were running in it are cancelled, so callers skip their frames.
+
+        Parameters
+        ----------
+        processes : INT, optional
+            Number of worker processes, which caps how many cores analysis can use.  The default is None, which uses
+            half of the cores, leaving the rest to the control threads.
+        frame_buffer : CLASS INSTANCE OBJECT of FrameBuffer, optional
+            Shared memory that the camera puts each frame in.  Requests for a buffered frame are sent to the workers
+            with its FrameSlot instead of its path, so they map it instead of reading it.  The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.processes = processes or max(1, (os.cpu_count() or 2) // 2)
+        self.frame_buffer = frame_buffer
+        self.queues = {priority: collections.deque() for priority in self.queue_limits}
+        self.condition = threading.Condition()
+        self.slots = threading.Semaphore(self.processes)
+        self.stopping = False
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.dispatcher = threading.Thread(target=self._dispatch, name='AnalysisDispatcher-Th', daemon=True)
+
+    def start(self):
+        """
+        Description
+        -----------
+        Starts the worker processes, and waits for them to be ready so that the first guide frame does not pay for
+        starting them.
+
+        Returns
+        -------
+        None.
+
+        """
+        if os.name == 'posix':
+            # Workers must share this process's resource tracker, or each one that maps the frame buffer starts a
+            # tracker of its own, which then reports the buffer as leaked and tries to unlink it again at exit
+            resource_tracker.ensure_running()
+        self.pool = self._new_pool()
+        concurrent.futures.wait([self.pool.submit(os.getpid) for _ in range(self.processes)])
+        self.dispatcher.start()
+        logging.info('Started {} image analysis processes'.format(self.processes))
+
+    def _new_pool(self):
+        """
+        Returns
+        -------
+        CLASS INSTANCE OBJECT of concurrent.futures.ProcessPoolExecutor
+            A new pool of worker processes.
+
+        """
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.processes, initializer=_initialize_worker,
+                                                      initargs=(config_reader.get_config(), self.niceness))
+
+    def _replace_pool(self, broken):
+        """
+        Description
+        -----------
+        Shuts down a pool that a dead worker has broken, and starts a new one in its place, unless another request
+        that was running in the same pool already has.
+
+        Parameters
+        ----------
+        broken : CLASS INSTANCE OBJECT of concurrent.futures.ProcessPoolExecutor
+            The broken pool.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.pool_lock:
+            if self.pool is not broken or self.stopping:
+                return
+            logging.error('An image analysis process died, restarting the pool')
+            broken.shutdown(wait=False)
+            self.pool = self._new_pool()
+
+    def submit(self, priority, function, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        priority : INT
+            AnalysisService.guiding, focus or quality.
+        function : FUNCTION
+            Analysis function to run, i.e. filereader_utils.findstars.  It must be defined at the top level of a
+            module, so that it can be sent to a worker process.
+        *args : ANY
+            Arguments of the function.  If the first is the path of a frame in the frame buffer, it is replaced by
+            the frame's FrameSlot, which stays acquired until the request is done.
+        **kwargs : ANY
+            Keyword arguments of the function.
+
+        Returns
+        -------
+        CLASS INSTANCE OBJECT of concurrent.futures.Future
+            Future of the result of the function.  It is cancelled if a newer request of the same priority pushes it
+            out of its queue, or the service stops before it runs.
+
+        """
+        future = concurrent.futures.Future()
+        if self.frame_buffer is not None and args and isinstance(args[0], str) and \
+                (slot := self.frame_buffer.acquire(args[0])):
+            args = (slot,) + args[1:]
+            future.add_done_callback(lambda done: self.frame_buffer.release(slot))
+        with self.condition:
+            if self.stopping:
+                future.cancel()
+                return future
+            waiting = self.queues[priority]
+            if len(waiting) >= self.queue_limits[priority]:
+                (stale, stale_function) = waiting.popleft()[:2]
+                stale.cancel()
+                logging.warning('Analysis queue {} is full, dropped a {} request'.format(priority,
+                                                                                      stale_function.__name__))
+            waiting.append((future, function, args, kwargs, time.perf_counter(), _frame_keys(args)))
+            self.condition.notify()
+        return future
+
+    def _dispatch(self):
+        """
+        Description
+        -----------
+        Hands the highest priority waiting request to the pool whenever a worker is free.
+
+        Returns
+        -------
+        None.
+
+        """
+        while True:
+            self.slots.acquire()
+            with self.condition:
+                while not self.stopping and not any(self.queues.values()):
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                priority = min(p for p in self.queues if self.queues[p])
+                (future, function, args, kwargs, queued, keys) = self.queues[priority].popleft()
+            if not future.set_running_or_notify_cancel():
+                self.slots.release()
+                continue
+            pool = self.pool
+            work = (_timed, function, args, kwargs, filereader_utils.cached_stats(keys), keys)
+            try:
+                try:
+                    job = pool.submit(*work)
+                except BrokenProcessPool:
+                    # The pool broke between jobs, so the request is tried once more in a new one
+                    self._replace_pool(pool)
+                    pool = self.pool
+                    job = pool.submit(*work)
+            except (BrokenProcessPool, RuntimeError) as exception:
+                future.set_exception(exception)
+                self.slots.release()
+                continue
+            job.add_done_callback(lambda done, future=future, name=function.__name__, queued=queued, pool=pool:
+                                  self._finish(done, future, name, queued, pool))
+
+    def _finish(self, job, future, name, queued, pool):
+        """
+        Description
+        -----------
+        Passes the result of a finished pool job on to the future that was returned by submit, keeps the background
+        statistics that it measured, and frees its worker.  If the job was lost because its pool broke, the pool is
+        replaced and the future is cancelled rather than retried, since its frame may be what killed the worker.
+
+        Returns
+        -------
+        None.
+
+        """
+        exception = job.exception()
+        if isinstance(exception, BrokenProcessPool):
+            self._replace_pool(pool)
+            exception = concurrent.futures.CancelledError()
+        elif exception is not None:
+            logging.error('Analysis {} failed: {!r}'.format(name, exception))
+        self.slots.release()
+        if exception is not None:
+            future.set_exception(exception)
+            return
+        (result, seconds, stats) = job.result()
+        filereader_utils.cache_stats(stats)
+        logging.debug('Analysis {} took {:.2f} s after {:.2f} s in the queue'.format(
+            name, seconds, time.perf_counter() - queued - seconds))
+        future.set_result(result)
+
+    def stop(self):
+        """
+        Description
+        -----------
+        Cancels every waiting request, and stops the dispatcher and the worker processes.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.condition:
+            self.stopping = True
+            for waiting in self.queues.values():
+                while waiting:
+                    waiting.popleft()[0].cancel()
+            self.condition.notify_all()
+        self.slots.release()
+        with self.pool_lock:
+            if self.pool:
+                self.pool.shutdown(wait=False)
+        logging.debug('Stopped the image analysis processes')
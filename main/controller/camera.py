@@ -10,10 +10,15 @@ from .hardware import Hardware
 
 class Camera(Hardware):
     
-    def __init__(self):
+    def __init__(self, frame_buffer=None):
         """
         Initializes the camera as a subclass of Hardware.
 
+        Parameters
+        ----------
+        frame_buffer : CLASS INSTANCE OBJECT of FrameBuffer, optional
+            Shared memory that saved light frames are put in, for the analysis workers.  The default is None.
+
         Returns
         -------
         None.
@@ -23,6 +28,7 @@ class Camera(Hardware):
         self.image_done = threading.Event()
         self.camera_lock = threading.Lock()
         self.fwhm: Optional[Union[float, int]] = None
+        self.frame_buffer = frame_buffer
         super(Camera, self).__init__(name='Camera')
 
     def check_connection(self):
@@ -213,6 +219,26 @@ class Camera(Hardware):
         """
         self.fwhm = self.Camera.fwhm
 
+    def set_filter(self, filter):
+        """
+        Description
+        -----------
+        Moves the filter wheel ahead of the next exposure, so that the wheel can turn while something else (i.e. the
+        focuser) moves too.
+
+        Parameters
+        ----------
+        filter : INT
+            Which filter to move to.
+
+        Returns
+        -------
+        None.
+        """
+        with self.camera_lock:
+            logging.debug('Moving to filter position {}'.format(filter))
+            self.Camera.Filter = filter
+
     def expose(self, exposure_time, filter, save_path=None, type="light"):
         """
         Parameters
@@ -247,6 +273,9 @@ class Camera(Hardware):
                 return
             elif check:
                 self.Camera.SaveImage(save_path)
+                if self.frame_buffer is not None and type == 1:
+                    # Only light frames are analyzed, and they are copied on the buffer's own thread
+                    self.frame_buffer.put_later(save_path)
                 self.image_done.set()
                 self.image_done.clear()
                 
@@ -1,11 +1,11 @@
 # Flatfield Lamp Controller
 import logging
 import serial
-import serial.tools.list_ports
 from serial.serialutil import SerialException
 import threading
 
 from .hardware import Hardware
+from . import port_discovery
 
 
 class FlatLamp(Hardware):
@@ -23,13 +23,6 @@ class FlatLamp(Hardware):
         self.ser = serial.Serial()
         self.ser.baudrate = 9600
         self.status = None
-        ports = list(serial.tools.list_ports.comports())
-        arduino_ports = [port for port in ports if "Arduino" in port.description]
-        if len(arduino_ports) >= 1:
-            self.ser.port = arduino_ports[0].device
-        else:
-            logging.critical('Cannot find flatfield lamp port')
-            return
         self.lamp_done = threading.Event()
 
     def check_connection(self):
@@ -59,8 +52,14 @@ class FlatLamp(Hardware):
         BOOL
             True if successful, otherwise False.
         """
+        device = port_discovery.find_port('flatlamp', lambda port: "Arduino" in port.description)
+        if not device:
+            logging.critical('Cannot find flatfield lamp port')
+            return False
+        self.ser.port = device
         try:
-            self.check_connection()
+            with port_discovery.port_lock(device):
+                self.check_connection()
         except SerialException:
             logging.error('Could not connect to flatlamp')
             return False
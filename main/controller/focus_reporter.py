@@ -0,0 +1,94 @@
+# Focus run diagnostics
+import os
+import logging
+import datetime
+import numpy as np
+
+from .hardware import Hardware
+from ..common.util import focus_utils
+
+
+class FocusReporter(Hardware):
+
+    def __init__(self):
+        """
+        Initializes the focus reporter as a subclass of hardware.  It writes the plot and data of each focus run on
+        its own thread, so the focuser never waits on matplotlib or the disk.
+
+        Returns
+        -------
+        None.
+
+        """
+        super(FocusReporter, self).__init__(name='FocusReporter')
+
+    def _class_connect(self):
+        """
+        Description
+        -----------
+        Overwrites base not implemented method.  However, nothing is necessary for the focus reporter specifically,
+        so the method just passes.
+
+        Returns
+        -------
+        True : BOOL
+        """
+        return True
+
+    @staticmethod
+    def report(fwhm_values, position_values, uncertainties, fit, directory):
+        """
+        Description
+        -----------
+        Saves a plot of a focus run with its V-curve fit, and the data as comma separated text, to the night's data
+        directory.  matplotlib is only imported here, and the figure is built without pyplot so nothing is kept
+        around once it has been saved.
+
+        Parameters
+        ----------
+        fwhm_values : LIST
+            HFD (or fwhm) of each focus image, in pixels.
+        position_values : LIST
+            Focuser position of each focus image.
+        uncertainties : LIST
+            Uncertainty of each HFD value, from focus_metric.  May contain None.
+        fit : TUPLE
+            From focus_utils.fit_v_curve, or None if no curve could be fit.
+        directory : STR
+            Directory to save the files in.
+
+        Returns
+        -------
+        None.
+
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        if not len(position_values):
+            return
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        (x, y, sigma) = focus_utils.curve_inputs(position_values, fwhm_values, uncertainties)
+        np.savetxt(os.path.join(directory, 'FocusData_{}.txt'.format(timestamp)), np.stack([x, y, sigma], axis=1),
+                   delimiter=',', header='Position [steps], HFD [px], HFD Error [px]', fmt=('%d', '%.5f', '%.5f'))
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.errorbar(x, y, yerr=sigma, fmt='bo', label='Raw data')
+        if fit is not None:
+            (best, error, coefficients) = fit
+            xfit = np.linspace(np.min(x), np.max(x), 126)
+            ax.plot(xfit, focus_utils.v_curve_values(coefficients, xfit), 'r-', label='V-curve fit')
+            ax.axvline(best, color='g', linestyle='-.', label='Best focus {:.0f} +/- {:.1f}'.format(best, error))
+        ax.legend()
+        ax.set_xlabel('Focus Positions (units)')
+        ax.set_ylabel('HFD value (pixels)')
+        ax.set_title('Focus Positions Graph')
+        ax.grid()
+        plot_path = os.path.join(directory, 'FocusPlot_{}.png'.format(timestamp))
+        fig.savefig(plot_path)
+        fig.clear()
+        logging.debug('Saved focus diagnostics to {}'.format(plot_path))
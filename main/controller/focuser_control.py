@@ -1,17 +1,18 @@
 import logging
 import threading
-import time
-import re
 import serial
-import serial.tools.list_ports
 from serial.serialutil import SerialException
 
 from .hardware import Hardware
+from .robofocus import RoboFocusProtocol
+from . import port_discovery
 from ..common.IO import config_reader
 
 
 class Focuser(Hardware):
-    
+
+    probe_timeout = 0.5     # Seconds that a port is given to answer like a RoboFocus during discovery
+
     def __init__(self):
         """
         Initializes the focuser as a subclass of hardware.
@@ -24,13 +25,154 @@ class Focuser(Hardware):
         super(Focuser, self).__init__(name='Focuser')      # calls Hardware.__init__ with the name 'focuser'
         self.ser = serial.Serial(timeout=0.5)
         self.ser.baudrate = 9600
+        self.robofocus = RoboFocusProtocol(self.ser)
         self.adjusting = threading.Event()
+        self.adjusting.set()
         self.adjustment_lock = threading.Lock()
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        # adjusting is clear from the moment an operation is queued until every queued operation has finished
+        self.position_callbacks = []
+        # Called with the position after every step of a move, and once more when it finishes
         self.config_dict = config_reader.get_config()
         self.position = None
         self.temperature = None
         self.comport = ''
 
+    def onThread(self, function, *args, **kwargs):
+        """
+        Description
+        -----------
+        Overrides the base class to clear adjusting as soon as a focuser operation is queued, rather than when it
+        starts running, so that waiting on adjusting right after queueing an operation always waits for it.
+
+        Parameters
+        ----------
+        function : BOUND METHOD
+            A focuser method to be put in the thread queue.
+        *args : ANY
+            The arguments to be passed to the method.
+        **kwargs : ANY
+            The keyword arguments to be passed to the method.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.pending_lock:
+            self.pending += 1
+            self.adjusting.clear()
+        super(Focuser, self).onThread(self._run_pending, function, *args, **kwargs)
+
+    def _run_pending(self, function, *args, **kwargs):
+        """
+        Description
+        -----------
+        Runs a queued focuser operation, and sets adjusting once no more are queued.
+
+        Returns
+        -------
+        None.
+
+        """
+        try:
+            function(*args, **kwargs)
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+                if self.pending <= 0:
+                    self.pending = 0
+                    self.adjusting.set()
+
+    def _step(self, direction):
+        """
+        Description
+        -----------
+        Progress callback for moves: keeps self.position current while the motor moves.
+
+        Parameters
+        ----------
+        direction : INT
+            +1 for a step out, -1 for a step in.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.position is not None:
+            self.position += direction
+            for callback in self.position_callbacks:
+                callback(self.position)
+
+    def _approach(self, command, value, compensate=True):
+        """
+        Description
+        -----------
+        Makes a move that always ends in focus_backlash_direction.  A move that would end the other way goes
+        focus_backlash steps past its target first, then comes back to it.  If going past the target would leave
+        the safe movement range that the move was checked against, the move is made without compensation.
+
+        Parameters
+        ----------
+        command : STR
+            'I', 'O' or 'G', the RoboFocus command letter of the move.
+        value : INT
+            Steps to move in or out, or the position to go to.
+        compensate : BOOL, optional
+            Whether or not to compensate for backlash.  The default is True.
+
+        Returns
+        -------
+        BOOL
+            True if the move finished with a valid position response, otherwise False.
+
+        """
+        backlash = self.config_dict.focus_backlash
+        final = 'O' if self.config_dict.focus_backlash_direction == 'out' else 'I'
+        direction = command if command != 'G' else 'O' if value > self.position else 'I'
+        if not compensate or not backlash or direction == final:
+            return self._move(command, value)
+        if command == 'G':
+            overshoot = value + backlash if final == 'I' else max(value - backlash, 1)
+            safe = abs(overshoot - self.position) < self.config_dict.focus_max_distance*2
+        else:
+            safe = value + backlash <= self.config_dict.focus_max_distance
+        if not safe:
+            logging.warning('Overshooting for backlash would leave the safe movement range...moving without '
+                            'backlash compensation')
+            return self._move(command, value)
+        logging.debug('Overshooting by {} steps for backlash'.format(backlash))
+        if command == 'G':
+            return self._move('G', overshoot) and self._move('G', value)
+        return self._move(command, value + backlash) and self._move(final, backlash)
+
+    def _move(self, command, value):
+        """
+        Parameters
+        ----------
+        command : STR
+            'I', 'O' or 'G', the RoboFocus command letter of the move.
+        value : INT
+            Steps to move in or out, or the position to go to.
+
+        Returns
+        -------
+        BOOL
+            True if the move finished with a valid position response, otherwise False.
+
+        """
+        (code, data) = self.robofocus.transact(command, value, progress=self._step)
+        if code != 'D':
+            logging.error('Unexpected RoboFocus response F{}{} to a move'.format(code, data))
+            return False
+        self.position = int(data)
+        for callback in self.position_callbacks:
+            callback(self.position)
+        logging.info('The new focus position is {}'.format(self.position))
+        return True
+
     def check_connection(self):
         """
         Description
@@ -65,29 +207,41 @@ class Focuser(Hardware):
         BOOL
             True if successful, otherwise False.
         """
-        ports = list(serial.tools.list_ports.comports())
-        com = [port for port in ports if "COM" in port.description]
-        if len(com) >= 1:
-            for comport in com:
-                try:
-                    self.ser.port = comport.device
-                    self.ser.open()
-                    self.ser.write("FV000000".encode())
-                    if self.ser.readline() == b'FV003.20\xbf':
-                        logging.info('The focuser connected to {}'.format(comport.description))
-                        self.comport = comport.description
-                        break
-                    else:
-                        self.ser.close()
-                except SerialException:
-                    logging.warning('Cannot connect to {}.  The port may already be in use. '
-                                    'If the focuser connects, you may safely ignore this message.'.format(
-                        comport.description))
-        else:
-            logging.error('No com ports found!')
+        device = port_discovery.find_port('focuser', lambda port: "COM" in port.description and
+                                          "Arduino" not in port.description, self._probe)
+        if device:
+            try:
+                self.ser.port = device
+                self.ser.open()
+                logging.info('The focuser connected to {}'.format(device))
+                self.comport = device
+            except SerialException:
+                if self.ser.is_open:
+                    self.ser.close()
+                logging.error('The focuser was found on {}, but could not be connected to'.format(device))
         check = self.check_connection()
         return check
 
+    @classmethod
+    def _probe(cls, device):
+        """
+        Parameters
+        ----------
+        device : STR
+            Device path of a port that the RoboFocus might be on.
+
+        Returns
+        -------
+        BOOL
+            True if a RoboFocus answers the firmware version command on the port within probe_timeout seconds.
+
+        """
+        with serial.Serial(device, 9600, timeout=0.1) as ser:
+            robofocus = RoboFocusProtocol(ser)
+            robofocus.idle_timeout = cls.probe_timeout
+            (code, version) = robofocus.transact('V')
+            return code == 'V'
+
     def get_temperature(self):
         """
         Description
@@ -99,15 +253,13 @@ class Focuser(Hardware):
         temp : FLOAT
             Temperature detected in degrees Celsius.
         """
+        temp = None
         with self.adjustment_lock:
-            self.adjusting.clear()
             try:
-                self.ser.write("FT000000".encode())
-                response = self.ser.readline()
-                temp = (self._convert_response_to_int(response)/2 - 273)*(9/5) + 32
-            except SerialException:
+                (code, data) = self.robofocus.transact('T')
+                temp = (int(data[2:])/2 - 273)*(9/5) + 32
+            except (SerialException, ValueError):
                 logging.error('Could not read temperature')
-            self.adjusting.set()
         self.temperature = temp
         return temp
 
@@ -122,24 +274,24 @@ class Focuser(Hardware):
         position : INT
             Current position in steps.
         """
+        position = self.position
         with self.adjustment_lock:
-            self.adjusting.clear()
             try:
-                self.ser.write("FI000000".encode())
-                response = self.ser.readline()
-                position = self._convert_response_to_int(response)
-            except SerialException:
+                (code, data) = self.robofocus.transact('G')
+                position = int(data)
+            except (SerialException, ValueError):
                 logging.error('Could not read position')
-            self.adjusting.set()
         self.position = position
         return position
 
-    def move_in(self, amount: int):
+    def move_in(self, amount: int, compensate: bool = True):
         """
         Parameters
         ----------
         amount : INT
             The amount of steps to move the focuser in by.
+        compensate : BOOL, optional
+            Whether or not to compensate for backlash, see _approach.  The default is True.
 
         Returns
         -------
@@ -147,30 +299,24 @@ class Focuser(Hardware):
             True if successful, otherwise False.
         """
         with self.adjustment_lock:
-            self.adjusting.clear()
             if amount < 0 or amount > self.config_dict.focus_max_distance:
                 logging.error('Amount outside of safe movement range for focusing')
                 return False
-            zeros = "0" * (6 - len(str(amount)))
-            command = "FI" + zeros + str(amount)
             try:
-                self.ser.write(command.encode())
                 logging.info('Moving in focuser by {} steps'.format(amount))
-                position = self.ser.readline()
-                self.position = self._convert_response_to_int(position)
-                logging.info('The new focus position is {}'.format(self.position))
+                return self._approach('I', amount, compensate)
             except SerialException:
                 logging.error('Could not move focuser in.')
-            time.sleep(2)
-            self.adjusting.set()
-        return True
+                return False
 
-    def move_out(self, amount: int):
+    def move_out(self, amount: int, compensate: bool = True):
         """
          Parameters
          ----------
          amount : INT
              The amount of steps to move the focuser out by.
+         compensate : BOOL, optional
+             Whether or not to compensate for backlash, see _approach.  The default is True.
 
          Returns
          -------
@@ -178,30 +324,24 @@ class Focuser(Hardware):
              True if successful, otherwise False.
          """
         with self.adjustment_lock:
-            self.adjusting.clear()
             if amount < 0 or amount > self.config_dict.focus_max_distance:
                 logging.error('Amount outside of safe movement range for focusing')
                 return False
-            zeros = "0" * (6 - len(str(amount)))
-            command = "FO" + zeros + str(amount)
             try:
-                self.ser.write(command.encode())
                 logging.info('Moving out focuser by {} steps'.format(amount))
-                position = self.ser.readline()
-                self.position = self._convert_response_to_int(position)
-                logging.info('The new focus position is {}'.format(self.position))
+                return self._approach('O', amount, compensate)
             except SerialException:
                 logging.error('Could not move focuser out.')
-            time.sleep(2)
-            self.adjusting.set()
-        return True
+                return False
 
-    def absolute_move(self, abs_position: int):
+    def absolute_move(self, abs_position: int, compensate: bool = True):
         """
         Parameters
         ----------
         abs_position : INT
             Absolute position in steps to move the focuser to.
+        compensate : BOOL, optional
+            Whether or not to compensate for backlash, see _approach.  The default is True.
 
         Returns
         -------
@@ -209,26 +349,18 @@ class Focuser(Hardware):
             True if successful, otherwise False.
         """
         with self.adjustment_lock:
-            self.adjusting.clear()
             if abs(abs_position - self.position) >= self.config_dict.focus_max_distance*2:
                 logging.error('Absolute move amount outside of safe movement range for focusing')
                 return False
-            zeros = "0" * (6 - len(str(abs_position)))
-            command = "FG" + zeros + str(abs_position)
+            if abs_position == self.position:
+                return True
+            # FG000000 would only report the position instead of moving to 0
             try:
-                self.ser.write(command.encode())
                 logging.info('Moving focuser to absolute position {}'.format(abs_position))
-                while True:
-                    response = self.ser.readline()
-                    if b'FD' in response:
-                        self.position = self._convert_response_to_int(response)
-                        break
-                logging.info('The new focus position is {}'.format(self.position))
+                return self._approach('G', abs_position, compensate)
             except SerialException:
                 logging.error('Could not move to absolute position.')
-            time.sleep(2)
-            self.adjusting.set()
-        return True
+                return False
 
     def abort(self):
         """
@@ -236,42 +368,19 @@ class Focuser(Hardware):
         -----------
         Aborts the focuser command by sending an arbitrary command without waiting.  The command is just to respond
         with the firmware version number, but any commands sent during the processing of a previous command are
-        interpreted as a stop command.
+        interpreted as a stop command.  Must NOT be called with onThread, since the move it stops is still running on
+        the focuser thread, and finishes there with the position that it stopped at.
 
         Returns
         -------
         None
         """
-        command = "FV000000"
         try:
-            self.ser.write(command.encode())
+            self.robofocus.stop()
             logging.info('Aborting focuser movement')
         except SerialException:
             logging.error('Unable to abort focuser move!')
 
-    @staticmethod
-    def _convert_response_to_int(response):
-        """
-        Description
-        -----------
-        Converts the read response from the focuser into an integer, if applicable.
-
-        Parameters
-        ----------
-        response : BYTES
-            The direct serial response from the focuser.
-
-        Returns
-        -------
-        INT
-            The value of the response as an integer.
-        """
-        temp_value = re.search('([0-9]+)', str(response))
-        if temp_value:
-            return int(temp_value.group())
-        else:
-            logging.error('Could not get integer from serial response')
-
     def disconnect(self):
         """
         Description
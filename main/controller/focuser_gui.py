@@ -73,7 +73,7 @@ class Gui(threading.Thread):
         -------
         None
         """
-        self.focuser.onThread(self.focuser.abort)
+        self.focuser.abort()
 
     def update_labels(self):
         """
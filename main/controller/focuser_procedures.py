@@ -1,35 +1,35 @@
 # Focusing procedures
 import os
+import json
 import logging
 import time
+import re
 import threading
+import collections
 import numpy as np
-import datetime
-from scipy.optimize import curve_fit
-import matplotlib.pyplot as plt
 
 from .hardware import Hardware
-from ..common.IO import config_reader
-from ..common.util import filereader_utils
+from .analysis_service import AnalysisService
+from ..common.IO import config_reader, focus_store
+from ..common.datatype import filter_wheel
+from ..common.util import filereader_utils, focus_utils
 
 np.warnings.filterwarnings('ignore')
 
 
-def standard_parabola(x, a, b, c):
-    """
-    A standard parabola function for scipy.optimize to fit.
-
-    Returns
-    -------
-    FLOAT:
-        a + bx + cx^2
-    """
-    return a + b*x + c*x**2
-
-
 class FocusProcedures(Hardware):
 
-    def __init__(self, focus_obj, camera_obj, conditions_obj):
+    bracket_multiple = 3        # Bracketing steps are this many times initial_focus_delta
+    minimum_focus_points = 5    # Fewest exposures before the search may stop early
+    monitor_stars = 25          # Brightest stars measured on each science frame by the focus monitor
+    monitor_window = 5          # Science frames in the running median HFD of the focus monitor
+    monitor_threshold = 0.1     # Fractional rise of the running median HFD over its best that triggers a correction
+    monitor_max_move = 2        # Largest corrective move, in units of initial_focus_delta
+    monitor_max_offset = 6      # Largest total correction since the last startup focus, in units of initial_focus_delta
+    backlash_arm = 4            # Backlash is measured this many initial_focus_delta out from best focus
+    backlash_repeats = 3        # Frames taken after approaching from each side when measuring backlash
+
+    def __init__(self, focus_obj, camera_obj, conditions_obj, analysis_obj, reporter_obj=None):
         """
         Initializes focusprocedures as a subclass of hardware.
 
@@ -41,6 +41,10 @@ class FocusProcedures(Hardware):
             From custom camera class.
         conditions_obj : CLASS INSTANCE OBJECT of Conditions
             From custom conditions class.
+        analysis_obj : CLASS INSTANCE OBJECT of AnalysisService
+            Worker processes that measure the focus frames.
+        reporter_obj : CLASS INSTANCE OBJECT of FocusReporter, optional
+            Writes the diagnostics of each focus run.  The default is None, which skips them.
 
         Returns
         -------
@@ -50,12 +54,37 @@ class FocusProcedures(Hardware):
         self.focuser = focus_obj
         self.camera = camera_obj
         self.conditions = conditions_obj
+        self.reporter = reporter_obj
         self.config_dict = config_reader.get_config()
+        self.focus_store = focus_store.FocusStore(os.path.join(self.config_dict.data_directory, r'focus',
+                                                               r'focus_history.sqlite'))
+        # Best focus, temperature and filter of every successful focus run, kept with the observing data
         self.position_previous = None
         self.temp_previous = None
        
         self.focused = threading.Event()
+        self.offsets_measured = threading.Event()
+        self.backlash_measured = threading.Event()
         self.continuous_focusing = threading.Event()
+        self.v_curve = None
+        # V-curve coefficients of the last startup focus, which turn an HFD rise into a distance from focus
+        self.best_focus = None
+        # Filter and best focus position of the last startup focus, if it succeeded
+        self.correction = 0
+        self.filter_offset = 0
+        self.corrections_applied = 0
+        self.correction_lock = threading.Lock()
+        # Focus corrections and filter offset moves requested during science exposures, which are only made between
+        # exposures, and how many corrections have been made
+        self.hfd_history = {}
+        self.hfd_best = {}
+        self.probe = None
+        self.monitor_offset = 0
+        self.monitor_direction = 1
+        # Focus monitor state: recent science frame HFDs and their best running median by exposure type, the probe
+        # move being tested, the total correction so far and the direction of the last one that helped
+        self.analysis = analysis_obj
+        # Focus frames are analyzed here while the focuser moves to the next position
         super(FocusProcedures, self).__init__(name='FocusProcedures')
 
     def _class_connect(self):
@@ -79,7 +108,6 @@ class FocusProcedures(Hardware):
         """
         self.focuser.onThread(self.focuser.get_temperature)
         self.focuser.adjusting.wait()
-        time.sleep(1)
         return self.focuser.temperature
 
     def startup_focus_procedure(self, exp_time, _filter, image_path):
@@ -87,7 +115,13 @@ class FocusProcedures(Hardware):
         Description
         -----------
         Automated focusing procedure to be used before taking any science images.  Uses the
-        camera to take test exposures and measures the FWHM of the images.
+        camera to take test exposures and measures the half flux diameter (HFD) of all of the stars in the images.
+        The search first brackets the minimum with coarse steps, extending the bracket past whichever edge is lowest,
+        then fits a V-curve and chooses each next position to shrink the uncertainty of the best focus the most.  It
+        stops as soon as the best focus is known to within focus_tolerance steps, or after focus_iterations exposures.
+        Once the focus store has enough runs, the search starts at the position predicted for the current temperature
+        and filter, with bracketing steps scaled to how far past runs have strayed from the model.  Each successful
+        run is added to the store.
 
         Parameters
         ----------
@@ -100,25 +134,42 @@ class FocusProcedures(Hardware):
 
         Returns
         -------
-        None.
+        BOOL
+            True if a best focus was found and the focuser was moved there, otherwise False.
 
         """
         self.focused.clear()
+        self.best_focus = None
         
         if not os.path.exists(os.path.join(image_path, r'focuser_images')):
             os.mkdir(os.path.join(image_path, r'focuser_images'))
         # Creates new sub-directory for focuser images
         self.focuser.onThread(self.focuser.current_position)
         self.focuser.adjusting.wait()
-        time.sleep(2)
         initial_position = self.focuser.position
+        center = initial_position
+        step = self.config_dict.initial_focus_delta * self.bracket_multiple
+        temperature = self.conditions.temperature
+        prediction = self.focus_store.predict(temperature, _filter, self.config_dict.focus_temperature_constant)
+        if prediction:
+            # Start from the focus model instead, with the bracket narrowed to how well the model has done so far
+            (predicted_position, scatter) = prediction
+            center = int(round(predicted_position))
+            step = int(np.clip(2 * scatter, self.config_dict.initial_focus_delta, step))
+            logging.info('The focus model predicts best focus at {} +/- {:.0f} for {} F'.format(center, scatter,
+                                                                                              temperature))
+        low = center - self.config_dict.focus_max_distance
+        high = center + self.config_dict.focus_max_distance
+        target = center
+        pending = None
+        # (analysis future, focuser position) of the frame being analyzed while the focuser moves
         fwhm_values = []
         focus_positions = []
-        peaks = []
+        uncertainties = []
         i = 0
         errors = 0
         crash_loops = 0
-        while i < self.config_dict.focus_iterations:
+        while len(fwhm_values) + (pending is not None) < self.config_dict.focus_iterations:
             if self.camera.crashed.isSet() or self.focuser.crashed.isSet():
                 if crash_loops <= 4:
                     logging.warning('The camera or focuser has crashed...waiting for potential recovery.')
@@ -129,53 +180,110 @@ class FocusProcedures(Hardware):
                     logging.error('The camera or focuser has still not recovered from crashing...focus procedures '
                                   'cannot continue.')
                     break
-            image_name = '{0:s}_{1:.3f}s-{2:04d}.fits'.format('FocuserImage', exp_time, i + 1)
-            path = os.path.join(image_path, r'focuser_images', image_name)
-            self.camera.onThread(self.camera.expose, exp_time, _filter, save_path=path, type="light")
-            self.camera.image_done.wait()
-            time.sleep(2)
-            self.focuser.onThread(self.focuser.current_position)
-            self.camera.onThread(self.camera.get_fwhm)
-            time.sleep(2)
-            current_position = self.focuser.position
-            fwhm_test, peak, saturated = filereader_utils.radial_average(path, self.config_dict.saturation)
-            fwhm = self.camera.fwhm if self.camera.fwhm and not saturated else fwhm_test
-            if abs(current_position - initial_position) >= self.config_dict.focus_max_distance:
-                logging.error('Focuser has stepped too far away from initial position and could not find a focus.')
-                break
-            if not fwhm:
-                logging.warning('No fwhm could be calculated...trying again')
-                errors += 1
-                if errors < 3:
+            step_start = time.time()
+            moving = target != self.focuser.position
+            if moving:
+                self.focuser.onThread(self.focuser.absolute_move, int(round(target)))
+            analysis_time = 0
+            if pending:
+                # The previous frame is analyzed while the focuser moves to the position that was guessed for it
+                (future, pending_position) = pending
+                pending = None
+                try:
+                    (fwhm, uncertainty, n_stars) = future.result()
+                except AnalysisService.dropped:
+                    (fwhm, uncertainty, n_stars) = (None, None, 0)
+                analysis_time = time.time() - step_start
+                if not fwhm:
+                    # The camera's own fwhm is not an HFD, so it cannot stand in for one on the V-curve
+                    logging.warning('No stars could be measured in the last image...skipping it and trying again')
+                    errors += 1
+                    if errors >= 3:
+                        logging.critical('Cannot focus on target')
+                        break
+                    target = pending_position
+                    self.focuser.adjusting.wait(timeout=30)
                     continue
-                else:
-                    logging.critical('Cannot focus on target')
+                errors = 0      # This way it must be 3 in a row
+                logging.debug('Found HFD = {} +/- {} from {} stars at position {}'.format(fwhm, uncertainty,
+                                                                                        n_stars, pending_position))
+                fwhm_values.append(fwhm)
+                focus_positions.append(pending_position)
+                uncertainties.append(uncertainty)
+                (next_target, best) = focus_utils.next_focus_position(focus_positions, fwhm_values, uncertainties,
+                                                                      low, high, step)
+                if next_target is None:
+                    logging.error('The focus minimum seems to lie more than {} steps from the initial '
+                                  'position.'.format(self.config_dict.focus_max_distance))
                     break
-            errors = 0      # This way it must be 3 in a row
-            if i < self.config_dict.focus_iterations // 2:
-                self.focuser.onThread(self.focuser.move_in, self.config_dict.initial_focus_delta)
-                self.focuser.adjusting.wait(timeout=10)
-            elif i == self.config_dict.focus_iterations // 2:
-                self.focuser.onThread(self.focuser.absolute_move,
-                                      int(initial_position + self.config_dict.initial_focus_delta))
-                time.sleep(5)
+                if best is not None and len(fwhm_values) >= self.minimum_focus_points:
+                    fit = focus_utils.fit_v_curve(focus_positions, fwhm_values, uncertainties)
+                    if fit and fit[1] <= self.config_dict.focus_tolerance:
+                        logging.info('Best focus is known to within {:.1f} steps after {} exposures.'.format(
+                            fit[1], len(fwhm_values)))
+                        break
+                if abs(next_target - target) > step / 10:
+                    logging.debug('The guessed focus position {} was off, moving to {} instead'.format(
+                        target, next_target))
+                    target = next_target
+                    self.focuser.adjusting.wait(timeout=30)
+                    continue
+            if moving:
                 self.focuser.adjusting.wait(timeout=30)
-            elif i > self.config_dict.focus_iterations // 2:
-                self.focuser.onThread(self.focuser.move_out, self.config_dict.initial_focus_delta)
-                self.focuser.adjusting.wait(timeout=10)
-            logging.debug('Found fwhm = {} for the last image'.format(fwhm))
-            fwhm_values.append(fwhm)
-            focus_positions.append(current_position)
-            peaks.append(peak)
+            move_time = time.time() - step_start
+            current_position = self.focuser.position
+            if abs(current_position - center) > self.config_dict.focus_max_distance:
+                logging.error('Focuser has stepped too far away from initial position and could not find a focus.')
+                break
+            image_name = '{0:s}_{1:.3f}s-{2:04d}.fits'.format('FocuserImage', exp_time, i + 1)
+            path = os.path.join(image_path, r'focuser_images', image_name)
             i += 1
-        
-        fit_status, minfocus = self.plot_focus_model(fwhm_values, focus_positions, peaks)
+            exposure_start = time.time()
+            self.camera.onThread(self.camera.expose, exp_time, _filter, save_path=path, type="light")
+            self.camera.image_done.wait()
+            readout_time = time.time() - exposure_start
+            pending = (self.analysis.submit(AnalysisService.focus, filereader_utils.focus_metric, path,
+                                            self.config_dict.saturation), current_position)
+            # Guess the next position as if the new frame lands on the current fit, so the focuser can start moving
+            # right away
+            target = focus_utils.next_focus_position(
+                focus_positions + [current_position],
+                fwhm_values + [focus_utils.expected_value(focus_positions, fwhm_values, uncertainties,
+                                                          current_position)],
+                uncertainties + [None], low, high, step)[0]
+            if target is None:
+                target = current_position
+            logging.debug('Focus step {}: move/analysis {:.1f} s, analysis {:.1f} s, exposure and readout {:.1f} s, '
+                          'total {:.1f} s'.format(i, move_time, analysis_time, readout_time,
+                                                  time.time() - step_start))
+        if pending:
+            # The last frame was still being analyzed when the sweep ended
+            (future, pending_position) = pending
+            try:
+                (fwhm, uncertainty, n_stars) = future.result()
+            except AnalysisService.dropped:
+                fwhm = None
+            if fwhm:
+                fwhm_values.append(fwhm)
+                focus_positions.append(pending_position)
+                uncertainties.append(uncertainty)
+        self.focuser.adjusting.wait(timeout=30)
+
+        fit_status, minfocus, fit = self.focus_model(fwhm_values, focus_positions, uncertainties,
+                                                     os.path.join(image_path, r'focuser_images'))
         if minfocus:
-            if abs(initial_position - minfocus) <= self.config_dict.focus_max_distance:
+            if abs(center - minfocus) <= self.config_dict.focus_max_distance:
                 logging.info('The focuser found a minimum focus at {}'.format(int(minfocus)))
                 self.focuser.adjusting.wait(timeout=10)
                 self.focuser.onThread(self.focuser.absolute_move, int(minfocus))
                 self.focuser.adjusting.wait(timeout=30)
+                self.v_curve = fit[2]
+                self.best_focus = (_filter, int(minfocus))
+                self.monitor_offset = 0
+                if temperature is not None:
+                    (best, error, coefficients) = fit
+                    self.focus_store.append(temperature, _filter, best, error,
+                                            float(focus_utils.v_curve_values(coefficients, [best])[0]))
             else:
                 fit_status = False
         if not fit_status:
@@ -186,71 +294,216 @@ class FocusProcedures(Hardware):
 
         self.focused.set()
         self.focuser.onThread(self.focuser.current_position)
-        time.sleep(2)
+        self.focuser.adjusting.wait(timeout=10)
         self.temp_previous = self.conditions.temperature
         self.position_previous = self.focuser.position
-        return
+        return bool(fit_status)
 
-    @staticmethod
-    def plot_focus_model(fwhm_values, position_values, peak_values):
-        data = sorted(zip(position_values, fwhm_values, peak_values))
-        # fwhm_deltas = np.diff(data[1], n=1)
-        # peak_deltas = np.diff(data[2], n=1)
-        # x = []
-        # y = []
-        # for i in range(len(fwhm_deltas)):
-        #     if 0.2*data[2][i] < abs(peak_deltas[i]) < 3*data[2][i] and \
-        #             (peak_deltas[i] < 0 and fwhm_deltas[i] < 0) or (peak_deltas[i] > 0 and fwhm_deltas[i] > 0):
-        #         continue
-        #     else:
-        #         if i == 0:
-        #             x.append(data[0][i])
-        #             y.append(data[1][i])
-        #         x.append(data[0][i+1])
-        #         y.append(data[1][i+1])
-        x = [_[0] for _ in data]
-        y = [_[1] for _ in data]
+    def filter_offsets_procedure(self, exp_time, filters, image_path, config_path):
+        """
+        Description
+        -----------
+        Measures the focus offset of each filter by running the startup focus procedure in each one, and saves them
+        with the filter wheel config so that one focus run serves every filter from then on.  Offsets are relative
+        to the first filter, or kept consistent with the offsets that were already measured if the first filter has
+        one.  If the last startup focus was in the first filter, its best focus and V-curve are reused rather than
+        focusing in it again.  The focuser ends at the best focus of the first filter, with its V-curve.
+
+        Parameters
+        ----------
+        exp_time : FLOAT or INT
+            Length of camera exposures in seconds.
+        filters : DICT
+            Filter wheel position of each filter to measure, by filter name.  The first one is the reference.
+        image_path : STR
+            File path to the CCD images to be used for focusing.
+        config_path : STR
+            Path to the filter wheel config file to save the offsets to.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.offsets_measured.clear()
+        wheel = filter_wheel.get_filter()
+        best = {}
+        reference = next(iter(filters))
+        v_curve = None
+        if self.best_focus and self.best_focus[0] == filters[reference]:
+            best[reference] = self.best_focus[1]
+            v_curve = self.v_curve
+            logging.info('Best focus in filter {} is at {}, from the last focus run'.format(reference,
+                                                                                         best[reference]))
+        for (name, position) in filters.items():
+            if name in best:
+                continue
+            if self.startup_focus_procedure(exp_time, position, image_path):
+                best[name] = self.focuser.position
+                logging.info('Best focus in filter {} is at {}'.format(name, best[name]))
+                if name == reference:
+                    v_curve = self.v_curve
+        if reference in best:
+            base = wheel.focus_offset(reference) or 0
+            wheel.focus_offsets[reference] = base
+            for (name, position) in best.items():
+                wheel.focus_offsets[name] = int(base + position - best[reference])
+            wheel.save(config_path)
+            logging.info('Filter focus offsets are now {}'.format(wheel.focus_offsets))
+            self.focuser.adjusting.wait(timeout=10)
+            self.focuser.onThread(self.focuser.absolute_move, best[reference])
+            self.focuser.adjusting.wait(timeout=30)
+            self.position_previous = best[reference]
+            self.v_curve = v_curve
+            self.best_focus = (filters[reference], best[reference])
+        else:
+            logging.error('Could not focus in filter {}, so no filter offsets were measured'.format(reference))
+        self.offsets_measured.set()
+
+    def backlash_procedure(self, exp_time, _filter, image_path, config_path=None):
+        """
+        Description
+        -----------
+        Measures the focuser backlash, right after a startup focus.  The focuser goes to a position on the steep
+        outer arm of the V-curve, alternately coming from nearer focus and from farther out, and the HFD of a frame
+        taken after each approach is turned back into where the focus really is with the V-curve.  The backlash is
+        the difference between the two sides.  The moves are made without backlash compensation.  If a move does not
+        finish in time, the measurement is abandoned, so no frame is ever taken while the focuser is moving.
+
+        Parameters
+        ----------
+        exp_time : FLOAT or INT
+            Length of camera exposures in seconds.
+        _filter : STR
+            Filter to take camera exposures in.
+        image_path : STR
+            File path to the CCD images to be used for focusing.
+        config_path : STR, optional
+            Path to the general config file to save the backlash to.  The default is None, which only sets it for
+            this run.
+
+        Returns
+        -------
+        INT
+            The measured backlash in steps, or None if it could not be measured.
+
+        """
+        self.backlash_measured.clear()
+        if self.v_curve is None:
+            logging.error('Backlash can only be measured after a successful startup focus')
+            self.backlash_measured.set()
+            return None
+        best = self.focuser.position
+        distance = self.backlash_arm * self.config_dict.initial_focus_delta
+        arm = best + distance
+        positions = {'out': [], 'in': []}
+        for i in range(self.backlash_repeats):
+            for (start, side) in ((best, 'out'), (arm + distance, 'in')):
+                self.focuser.onThread(self.focuser.absolute_move, start, compensate=False)
+                self.focuser.onThread(self.focuser.absolute_move, arm, compensate=False)
+                if not self.focuser.adjusting.wait(timeout=30):
+                    logging.error('The focuser did not finish moving in time, so the backlash cannot be measured')
+                    self.focuser.adjusting.wait(timeout=30)
+                    self.focuser.onThread(self.focuser.absolute_move, best)
+                    self.focuser.adjusting.wait(timeout=30)
+                    self.backlash_measured.set()
+                    return None
+                image_name = '{0:s}_{1:.3f}s-{2:s}{3:04d}.fits'.format('BacklashImage', exp_time, side, i + 1)
+                path = os.path.join(image_path, r'focuser_images', image_name)
+                self.camera.onThread(self.camera.expose, exp_time, _filter, save_path=path, type="light")
+                self.camera.image_done.wait()
+                try:
+                    (hfd, uncertainty, n_stars) = self.analysis.submit(AnalysisService.focus,
+                                                                       filereader_utils.focus_metric, path,
+                                                                       self.config_dict.saturation).result()
+                except AnalysisService.dropped:
+                    continue
+                if hfd and (position := focus_utils.v_curve_position(self.v_curve, hfd, arm)) is not None:
+                    positions[side].append(position)
+        self.focuser.onThread(self.focuser.absolute_move, best)
+        self.focuser.adjusting.wait(timeout=30)
+        if not positions['out'] or not positions['in']:
+            logging.error('Not enough stars could be measured to find the backlash')
+            self.backlash_measured.set()
+            return None
+        backlash = int(round(abs(np.median(positions['in']) - np.median(positions['out']))))
+        logging.info('The focuser backlash is {} steps (approaching from nearer focus: {}, from farther out: '
+                     '{})'.format(backlash, positions['out'], positions['in']))
+        self.config_dict.focus_backlash = backlash
+        if config_path:
+            with open(config_path, 'r') as file:
+                config = json.load(file)
+            if 'focus_backlash' not in config.get('details', {}):
+                logging.error('{} has no focus_backlash setting, so the backlash was not saved'.format(config_path))
+            else:
+                config['details']['focus_backlash'] = backlash
+                with open(config_path, 'w') as file:
+                    json.dump(config, file, indent=4)
+                logging.info('Saved the focus backlash to {}'.format(config_path))
+        self.backlash_measured.set()
+        return backlash
+
+    def focus_model(self, fwhm_values, position_values, uncertainties, report_path):
+        """
+        Description
+        -----------
+        Fits the V-curve of a focus run.  The plot and data are handed to the focus reporter to be written in the
+        background, so the focuser can move to the best focus right away.
+
+        Parameters
+        ----------
+        fwhm_values : LIST
+            HFD (or fwhm) of each focus image, in pixels.
+        position_values : LIST
+            Focuser position of each focus image.
+        uncertainties : LIST
+            Uncertainty of each HFD value, from focus_metric.  May contain None.
+        report_path : STR
+            Directory for the plot and data of this focus run.
+
+        Returns
+        -------
+        fit_status : BOOL
+            True if a V-curve could be fit with its minimum inside the measured range.
+        minfocus : INT
+            Focuser position of the minimum of the fit, or None.
+        fit : TUPLE
+            From focus_utils.fit_v_curve, or None.
+
+        """
+        x = list(position_values)
+        y = list(fwhm_values)
         logging.debug('Position Data: {}'.format(x))
-        logging.debug('FWHM Data: {}'.format(y))
-        logging.debug('Peak Data: {}'.format(peak_values))
+        logging.debug('HFD Data: {}'.format(y))
+        logging.debug('HFD Uncertainty Data: {}'.format(uncertainties))
         minfocus = None
-        if fit_status := (len(x) >= 3 and len(y) >= 3):
-            med = np.median(x)
-            fit, _ = curve_fit(standard_parabola, x, y, p0=[5e-04, -7, 2e+04],
-                               bounds=([-np.inf, -np.inf, 1e-5], [np.inf, np.inf, np.inf]))
-            xfit = np.linspace(med - 75, med + 75, 126)
-            yfit = fit[2] * (xfit ** 2) + fit[1] * xfit + fit[0]
-            fig, ax = plt.subplots()
-            ax.plot(x, y, 'bo', label='Raw data')
-            ax.plot(xfit, yfit, 'r-', label='Parabolic fit')
-            ax.legend()
-            ax.set_xlabel('Focus Positions (units)')
-            ax.set_ylabel('FWHM value (pixels)')
-            ax.set_title('Focus Positions Graph')
-            ax.grid()
-            current_path = os.path.abspath(os.path.dirname(__file__))
-            target_path = os.path.abspath(os.path.join(current_path, r'../../test/FocusPlot_{}.png'.format(
-                datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))))
-            target_path_2 = os.path.abspath(os.path.join(current_path, r'../../test/FocusData_{}.txt'.format(
-                datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))))
-            plt.savefig(target_path)
-            d = np.array([[xi, yi] for xi, yi in zip(x, y)])
-            np.savetxt(target_path_2, d, delimiter=',', header='Position [steps], FWHM [px]', fmt=('%d', '%.5f'))
-
-            minindex = np.where(yfit == min(yfit))[0][0]
-            if np.any(np.isin(minindex, [np.where(yfit == yfit[0]), np.where(yfit == yfit[-1])])):
+        fit = focus_utils.fit_v_curve(x, y, uncertainties) if len(x) >= 3 else None
+        if self.reporter:
+            self.reporter.onThread(self.reporter.report, x, y, list(uncertainties), fit, report_path)
+        if fit_status := (fit is not None):
+            best = fit[0]
+            if not min(x) <= best <= max(x):
                 fit_status = False
             else:
-                minfocus = round(xfit[minindex])
+                minfocus = round(best)
                 logging.info('The theoretical minimum focus was calculated to be at position {}'.format(minfocus))
 
-        return fit_status, minfocus
+        return fit_status, minfocus, fit
     
-    def constant_focus_procedure(self):
+    def constant_focus_procedure(self, image_path=None):
         """
         Description
         -----------
-        Automated focusing procedure to be used while taking science images.
+        Automated focusing procedure to be used while taking science images.  The focus follows the temperature with
+        the coefficient learned by the focus store, and if image_path is given, every science frame is measured as it
+        arrives to correct focus drifts that the temperature does not explain (see monitor_frame).  Moves are only
+        requested here, and made between exposures by apply_correction.
+
+        Parameters
+        ----------
+        image_path : STR, optional
+            File path to the science images of the current ticket.  The default is None, which only follows the
+            temperature.
 
         Returns
         -------
@@ -258,36 +511,180 @@ class FocusProcedures(Hardware):
 
         """
         # Will be constantly running in the background
-        # Current focus position = initial focus position + 2 steps/degF * (Tcurrent - Tinitial)
+        # Current focus position = initial focus position + coefficient * (Tcurrent - Tinitial)
+        # The coefficient is learned by the focus store, or focus_temperature_constant steps/degF until it can be fit
         # Will check & adjust once every 30 minutes (adjustable)
+        model = self.focus_store.model(default_coefficient=self.config_dict.focus_temperature_constant)
+        coefficient = model[0] if model else self.config_dict.focus_temperature_constant
+        logging.debug('Continuous focusing with {:.2f} steps per degree F'.format(coefficient))
+        self.hfd_history = {}
+        self.hfd_best = {}
+        self.probe = None
+        last_adjustment = time.time()
         self.continuous_focusing.set()
         while self.continuous_focusing.isSet() and (self.camera.crashed.isSet() is False
                                                     and self.focuser.crashed.isSet() is False):
-            time.sleep(self.config_dict.focus_adjust_frequency * 60)
+            if image_path:
+                if self.camera.image_done.wait(timeout=60):
+                    applied = self.corrections_applied
+                    self.monitor_frame(self.get_newest_image(image_path), applied)
+            else:
+                time.sleep(60)
+            if time.time() - last_adjustment < self.config_dict.focus_adjust_frequency * 60:
+                continue
+            last_adjustment = time.time()
             logging.debug('Continuous focusing procedure is alive...')
             temp_current = self.conditions.temperature
             if temp_current is None:
                 continue
             if self.position_previous is None:
                 self.focuser.onThread(self.focuser.current_position)
-                time.sleep(2)
+                self.focuser.adjusting.wait(timeout=10)
                 self.position_previous = self.focuser.position
                 continue
             if self.temp_previous is None or (temp_current - self.temp_previous > 10):
                 self.temp_previous = temp_current
                 continue
-            new_position = self.position_previous + \
-                self.config_dict.focus_temperature_constant * (temp_current - self.temp_previous)
+            new_position = self.position_previous + coefficient * (temp_current - self.temp_previous)
             pos_diff = int(new_position - self.position_previous)
-            func = self.focuser.move_in if pos_diff < 0 else self.focuser.move_out if pos_diff > 0 else None
-            if not func:
+            if not pos_diff:
                 self.temp_previous = temp_current
                 continue
-            self.focuser.onThread(func, abs(pos_diff))
-            self.focuser.adjusting.wait(timeout=15)
+            self.request_move(pos_diff)
             self.temp_previous = temp_current
             self.position_previous = new_position
 
+    def monitor_frame(self, path, applied):
+        """
+        Description
+        -----------
+        Closed loop focus correction from science frames.  Each frame gets a quick HFD from its brightest stars, and a
+        running median is kept for each exposure time and filter.  When the median rises more than
+        monitor_threshold over its best, a probe move is requested, sized from the V-curve of the last startup focus.
+        If the next frames are not sharper, the probe is tried on the other side, and if that does not help either,
+        the focuser goes back and the rise is put down to seeing.
+
+        Parameters
+        ----------
+        path : STR
+            Path to the science frame that just finished.
+        applied : INT
+            Value of corrections_applied when the frame finished, to tell frames taken before a probe move from those
+            taken after it.
+
+        Returns
+        -------
+        None.
+
+        """
+        try:
+            (hfd, uncertainty, n_stars) = self.analysis.submit(AnalysisService.quality, filereader_utils.focus_metric,
+                                                               path, self.config_dict.saturation,
+                                                               max_stars=self.monitor_stars).result()
+        except AnalysisService.dropped:
+            return
+        if not hfd:
+            return
+        key = re.sub(r'-\d+\.fits$', '', os.path.basename(path))
+        history = self.hfd_history.setdefault(key, collections.deque(maxlen=self.monitor_window))
+        if self.probe:
+            (probe_key, direction, size, before, after, leg) = self.probe
+            if key != probe_key or applied < after:
+                return
+            history.append(hfd)
+            if len(history) < (self.monitor_window + 1) // 2:
+                return
+            current = float(np.median(history))
+            history.clear()
+            if current < before * (1 - self.monitor_threshold / 2):
+                logging.info('Focus correction of {} steps brought the HFD from {:.2f} to {:.2f}'.format(
+                    direction * size, before, current))
+                self.monitor_offset += direction * size
+                self.monitor_direction = direction
+                self.probe = None
+            elif leg == 1:
+                self.request_move(-2 * direction * size)
+                self.probe = (key, -direction, size, before, self.corrections_applied + 1, 2)
+            else:
+                logging.info('Focus corrections did not bring the HFD back down from {:.2f}, so it is likely '
+                             'seeing'.format(before))
+                self.request_move(-direction * size)
+                self.probe = None
+                self.hfd_best[key] = before
+            return
+        history.append(hfd)
+        if len(history) < self.monitor_window:
+            return
+        current = float(np.median(history))
+        best = self.hfd_best.get(key)
+        if best is None or current < best:
+            self.hfd_best[key] = current
+            return
+        if current <= best * (1 + self.monitor_threshold):
+            return
+        delta = self.config_dict.initial_focus_delta
+        size = delta
+        if self.v_curve is not None:
+            size = np.sqrt((current**2 - best**2) / self.v_curve[2])
+        size = int(np.clip(size, 1, self.monitor_max_move * delta))
+        direction = self.monitor_direction
+        if abs(self.monitor_offset) + size > self.monitor_max_offset * delta:
+            logging.warning('The HFD has risen from {:.2f} to {:.2f}, but focus has already been corrected by {} '
+                            'steps, so a new startup focus is needed'.format(best, current, self.monitor_offset))
+            self.hfd_best[key] = current
+            return
+        logging.debug('The HFD has risen from {:.2f} to {:.2f}, probing focus {} steps away'.format(
+            best, current, direction * size))
+        history.clear()
+        self.request_move(direction * size)
+        self.probe = (key, direction, size, current, self.corrections_applied + 1, 1)
+
+    def request_move(self, steps, correction=True):
+        """
+        Parameters
+        ----------
+        steps : INT
+            Steps to move the focuser out (positive) or in (negative) before the next exposure.
+        correction : BOOL, optional
+            Whether the move corrects the focus, and so counts in corrections_applied, which the focus monitor uses
+            to tell frames before and after its probe moves apart.  Filter offset moves are not corrections.  The
+            default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.correction_lock:
+            if correction:
+                self.correction += steps
+            else:
+                self.filter_offset += steps
+
+    def apply_correction(self):
+        """
+        Description
+        -----------
+        Makes any focus moves that were requested during the last exposure.  Must be called between exposures, NOT
+        with onThread, so that the move is done before the next exposure starts.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.correction_lock:
+            steps = int(round(self.correction))
+            self.correction -= steps
+            offset = int(round(self.filter_offset))
+            self.filter_offset -= offset
+        if steps + offset:
+            func = self.focuser.move_in if steps + offset < 0 else self.focuser.move_out
+            self.focuser.onThread(func, abs(steps + offset))
+            self.focuser.adjusting.wait(timeout=15)
+        if steps:
+            self.corrections_applied += 1
+
     @staticmethod
     def get_newest_image(image_path):
         """
@@ -0,0 +1,175 @@
+# Serial device discovery
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import serial.tools.list_ports
+from serial.serialutil import SerialException
+
+from ..common.IO import config_reader
+
+_cache_lock = threading.Lock()
+_port_locks = {}
+_port_locks_lock = threading.Lock()
+
+
+def _identity(port):
+    """
+    Parameters
+    ----------
+    port : CLASS INSTANCE OBJECT of serial.tools.list_ports_common.ListPortInfo
+        A port from serial.tools.list_ports.comports.
+
+    Returns
+    -------
+    DICT
+        Device path, USB vendor id, product id and serial number of the port.  The USB fields are None for ports
+        that are not USB.
+
+    """
+    return {'device': port.device, 'vid': port.vid, 'pid': port.pid, 'serial_number': port.serial_number}
+
+
+def _cache_path():
+    """
+    Returns
+    -------
+    STR
+        Path to the file that remembers the port of each device, kept with the observing data.
+
+    """
+    return os.path.join(config_reader.get_config().data_directory, r'devices', r'known_ports.json')
+
+
+def _load_cache():
+    """
+    Returns
+    -------
+    DICT
+        Last known port identity of each device, by device name.
+
+    """
+    try:
+        with open(_cache_path(), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_port(name, port):
+    """
+    Parameters
+    ----------
+    name : STR
+        Name of the device.
+    port : CLASS INSTANCE OBJECT of serial.tools.list_ports_common.ListPortInfo
+        The port that the device was found on.
+
+    Returns
+    -------
+    None.
+
+    """
+    with _cache_lock:
+        cache = _load_cache()
+        cache[name] = _identity(port)
+        path = _cache_path()
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as file:
+            json.dump(cache, file, indent=4)
+
+
+def _same_usb_device(port, known):
+    """
+    Returns
+    -------
+    BOOL
+        True if the port is the USB device described by known, wherever it is plugged in now.
+
+    """
+    return port.vid is not None and (port.vid, port.pid, port.serial_number) == \
+        (known.get('vid'), known.get('pid'), known.get('serial_number'))
+
+
+def port_lock(device):
+    """
+    Parameters
+    ----------
+    device : STR
+        Device path of a port, i.e. 'COM3'.
+
+    Returns
+    -------
+    threading.Lock
+        Lock that every probe of the port holds, so that two devices being discovered at the same time never open
+        the same port at once.
+
+    """
+    with _port_locks_lock:
+        return _port_locks.setdefault(device, threading.Lock())
+
+
+def find_port(name, match, probe=None):
+    """
+    Description
+    -----------
+    Finds the port of a serial device.  The port that the device was last found on (by USB vendor id, product id
+    and serial number, or by device path for ports that are not USB) is tried first.  If the device is not there,
+    every other matching port is probed at the same time.  Ports last known to belong to other devices are left
+    alone.  The port that is found is remembered for next time.
+
+    Parameters
+    ----------
+    name : STR
+        Name of the device, i.e. 'focuser'.
+    match : FUNCTION
+        Takes a port from serial.tools.list_ports.comports and returns True if the device could be on it.
+    probe : FUNCTION, optional
+        Takes a device path and returns True if the device answers on it.  It should use a short timeout, and close
+        the port again.  The default is None, which takes the first matching port without probing it.
+
+    Returns
+    -------
+    STR
+        Device path of the port, or None if the device was not found.
+
+    """
+    cache = _load_cache()
+    known = cache.get(name, {})
+    others = [identity for (device_name, identity) in cache.items() if device_name != name]
+    ports = [port for port in serial.tools.list_ports.comports() if match(port)]
+    ports = [port for port in ports if not any(_same_usb_device(port, identity) or
+                                               (port.vid is None and port.device == identity.get('device'))
+                                               for identity in others)]
+    last = [port for port in ports if _same_usb_device(port, known)] or \
+        [port for port in ports if port.vid is None and port.device == known.get('device')]
+    rest = [port for port in ports if port not in last]
+
+    def answers(port):
+        if probe is None:
+            return True
+        with port_lock(port.device):
+            try:
+                return probe(port.device)
+            except (SerialException, OSError, ValueError):
+                return False
+
+    for port in last:
+        if answers(port):
+            logging.debug('Found the {} on its last known port {}'.format(name, port.device))
+            _save_port(name, port)
+            return port.device
+    if rest:
+        with ThreadPoolExecutor(max_workers=len(rest)) as executor:
+            futures = {executor.submit(answers, port): port for port in rest}
+            for future in as_completed(futures):
+                if future.result():
+                    port = futures[future]
+                    logging.info('Found the {} on {}'.format(name, port.device))
+                    _save_port(name, port)
+                    return port.device
+    logging.error('Could not find the {} on any of {} candidate ports'.format(name, len(last) + len(rest)))
+    return None
@@ -0,0 +1,157 @@
+# RoboFocus serial protocol
+import time
+import logging
+from typing import Callable, Optional, Tuple
+
+from serial.serialutil import SerialException
+
+
+class ChecksumError(SerialException):
+    pass
+
+
+def checksum(data: bytes) -> int:
+    """
+    Parameters
+    ----------
+    data : BYTES
+        The eight characters of a RoboFocus command or response.
+
+    Returns
+    -------
+    INT
+        The least significant byte of the sum of the characters, which RoboFocus sends as the ninth character.
+
+    """
+    return sum(data) % 256
+
+
+def encode(command: str, value: int = 0) -> bytes:
+    """
+    Parameters
+    ----------
+    command : STR
+        The command letter after the F, i.e. 'G' for FG (go to position).
+    value : INT, optional
+        The six digit argument of the command.  The default is 0, which queries the current setting for most
+        commands.
+
+    Returns
+    -------
+    BYTES
+        The full nine character command, including its checksum.
+
+    """
+    if not 0 <= value <= 999999:
+        raise ValueError('RoboFocus arguments must be between 0 and 999999')
+    data = 'F{}{:06d}'.format(command, value).encode()
+    return data + bytes([checksum(data)])
+
+
+class RoboFocusProtocol:
+
+    frame_length = 9            # Characters in every command and response
+    progress_characters = b'IO'     # Sent once per step while the motor moves in or out
+    idle_timeout = 2            # Seconds without any character before a command is given up on
+
+    def __init__(self, ser):
+        """
+        Description
+        -----------
+        Sends commands to a RoboFocus and reads its replies character by character.  While the motor moves, RoboFocus
+        sends one progress character per step, and a move is complete exactly when the final position frame arrives.
+
+        Parameters
+        ----------
+        ser : CLASS INSTANCE OBJECT of serial.Serial
+            Open (or later opened) serial port of the RoboFocus.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ser = ser
+
+    def transact(self, command: str, value: int = 0,
+                 progress: Optional[Callable[[int], None]] = None) -> Tuple[str, bytes]:
+        """
+        Parameters
+        ----------
+        command : STR
+            The command letter after the F.
+        value : INT, optional
+            The argument of the command.  The default is 0.
+        progress : FUNCTION, optional
+            Called with +1 for every outward step and -1 for every inward step while the motor moves.  The default is
+            None.
+
+        Raises
+        ------
+        ChecksumError
+            If the response fails its checksum.
+        SerialException
+            If RoboFocus stops responding for idle_timeout seconds.
+
+        Returns
+        -------
+        code : STR
+            The response letter after the F, i.e. 'D' for a position.
+        data : BYTES
+            The six characters of the response argument.
+
+        """
+        self.ser.reset_input_buffer()
+        self.ser.write(encode(command, value))
+        return self.read_response(progress)
+
+    def read_response(self, progress: Optional[Callable[[int], None]] = None) -> Tuple[str, bytes]:
+        """
+        Parameters
+        ----------
+        progress : FUNCTION, optional
+            As in transact.  The default is None.
+
+        Returns
+        -------
+        TUPLE
+            As in transact.
+
+        """
+        frame = b''
+        last_character = time.monotonic()
+        while True:
+            received = self.ser.read(max(1, self.ser.in_waiting))
+            if not received:
+                if time.monotonic() - last_character > self.idle_timeout:
+                    raise SerialException('RoboFocus stopped responding')
+                continue
+            last_character = time.monotonic()
+            for character in received:
+                if frame:
+                    frame += bytes([character])
+                elif character == ord('F'):
+                    frame = b'F'
+                elif character in self.progress_characters:
+                    if progress:
+                        progress(1 if character == ord('O') else -1)
+                else:
+                    logging.debug('Ignoring unexpected character {} from RoboFocus'.format(bytes([character])))
+                if len(frame) == self.frame_length:
+                    if checksum(frame[:-1]) != frame[-1]:
+                        raise ChecksumError('Bad checksum in RoboFocus response {}'.format(frame))
+                    return frame[1:2].decode(), frame[2:8]
+
+    def stop(self):
+        """
+        Description
+        -----------
+        RoboFocus takes any character received during a move as a stop command.  The move then finishes normally, with
+        the position that it stopped at, so whoever is waiting on the move still gets its response.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.ser.write(encode('V'))
@@ -1,4 +1,6 @@
 import os
+import csv
+import json
 import logging
 import re
 import datetime
@@ -6,12 +8,14 @@ from json.decoder import JSONDecodeError
 
 from ...logger.logger import Logger
 from ..observing.observation_run import ObservationRun
+from ..observing import replay as weather_replay
 from ..common.IO.json_reader import Reader
 from ..common.IO import config_reader
 from ..common.datatype.object_reader import ObjectReader
 
 
-def run(obs_tickets, data=None, config=None, _filter=None, logger=None, shutdown=None, calibration=None, focus=None):
+def run(obs_tickets, data=None, config=None, _filter=None, logger=None, shutdown=None, calibration=None, focus=None,
+        backlash=None):
     """
 
     Parameters
@@ -41,6 +45,9 @@ def run(obs_tickets, data=None, config=None, _filter=None, logger=None, shutdown
     focus : BOOL, optional
         Toggle to focus on target or not.  The default is None, in which case True will be passed in via argparse,
         so focusing will be enabled.
+    backlash : BOOL, optional
+        Toggle to measure the focuser backlash after the first startup focus, and save it to the general config file.
+        The default is None, in which case False will be passed in via argparse.
 
     Returns
     -------
@@ -105,12 +112,70 @@ def run(obs_tickets, data=None, config=None, _filter=None, logger=None, shutdown
             logging.debug('Folder already exists: {:s}'.format(fol))
     logging.info('New directories for tonight\'s observing have been made!')
         
-    run_object = ObservationRun(observation_request_list, folder, shutdown, calibration, focus)
+    run_object = ObservationRun(observation_request_list, folder, shutdown, calibration, focus,
+                                filter_path=_filter or os.path.abspath(os.path.join(config_path, r'fw_config.json')),
+                                backlash_path=(config or os.path.abspath(os.path.join(
+                                    config_path, r'parameters_config.json'))) if backlash else None)
     run_object.observe()
 
     log_object.stop()
 
 
+def replay(trace, settings, config=None, logger=None, processes=None, output=None):
+    """
+
+    Parameters
+    ----------
+    trace : STR
+        Path to the recorded conditions to replay: a weather history SQLite file, a CSV file, or a JSON file.
+    settings : LIST
+        Config parameters to try, as 'name=value1,value2,...' strings.  Every combination is replayed.
+    config : STR, optional
+        Manual save path for the general configuration json file.  The default is None, in which case the config path
+        will be the default for this code, under -omegalambda/config.
+    logger : STR, optional
+        Manual save path for the logging configuration file.  The default is None, in which case the logging path will
+        be the default for this code, under -omegalambda/config.
+    processes : INT, optional
+        Number of worker processes.  The default is None, which uses one per core.
+    output : STR, optional
+        Path to a CSV file to save the results to.  The default is None, which only logs them.
+
+    Returns
+    -------
+    results : LIST
+        Settings and results of every replay, from replay_grid.
+
+    """
+    current_path = os.path.abspath(os.path.dirname(__file__))
+    config_path = os.path.join(current_path, r'..', r'..', r'config')
+    log_object = Logger(logger if logger else os.path.abspath(os.path.join(config_path, r'logging.json')))
+    try:
+        ObjectReader(Reader(config if config else os.path.abspath(os.path.join(config_path,
+                                                                               r'parameters_config.json'))))
+    except (JSONDecodeError, FileNotFoundError):
+        logging.critical('Config file either could not be found or could not be parsed')
+        return None
+    config_dict = config_reader.get_config()
+
+    grid = {}
+    for setting in settings or []:
+        (name, values) = setting.split('=', 1)
+        grid[name.strip()] = [json.loads(value) for value in values.split(',')]
+    trace_data = weather_replay.load_trace(trace, config_dict.site_latitude, config_dict.site_longitude)
+    results = weather_replay.replay_grid(trace_data, config_dict, grid, processes=processes)
+    for result in results:
+        logging.info(', '.join('{}={}'.format(key, round(value, 2) if isinstance(value, float) else value)
+                               for (key, value) in result.items()))
+    if output:
+        with open(output, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    log_object.stop()
+    return results
+
+
 def read_ticket(ticket):
     """
 
@@ -7,11 +7,14 @@ from ..common.IO import config_reader
 from ..common.util import filereader_utils
 from ..common.datatype import filter_wheel
 from ..controller.hardware import Hardware
+from ..controller.analysis_service import AnalysisService
 
 
 class Calibration(Hardware):
-    
-    def __init__(self, camera_obj, flatlamp_obj, image_directories):
+
+    analysis_retries = 3        # Most flats in a row whose analysis is dropped before giving up on the filter
+
+    def __init__(self, camera_obj, flatlamp_obj, analysis_obj, image_directories):
         """
         Initializes the calibration module as a subclass of hardware.
 
@@ -21,6 +24,8 @@ class Calibration(Hardware):
             Initialized camera.
         flatlamp_obj : FlatLamp Object
             Initialized flat lamp.
+        analysis_obj : AnalysisService Object
+            Started image analysis service, which measures the flats.
         image_directories : LIST
             Paths to where image files are saved for each ticket.
 
@@ -31,6 +36,7 @@ class Calibration(Hardware):
         """
         self.camera = camera_obj
         self.flatlamp = flatlamp_obj
+        self.analysis = analysis_obj
         self.image_directories = image_directories
         self.filterwheel_dict = filter_wheel.get_filter().filter_position_dict()
         self.filter_exp_times = {'clr': 3.0, 'uv': 120.0, 'b': 120.0, 'v': 16.0, 'r': 8.0, 'ir': 10.0, 'Ha': 120.0}
@@ -92,6 +98,7 @@ class Calibration(Hardware):
         for f in filters:
             j = 0
             scaled = False
+            dropped = 0
             while j < self.config_dict.calibration_num:
                 image_name = 'Flat_{0:.3f}s_{1:s}-{2:04d}.fits'.format(self.filter_exp_times[f], str(f).upper(), j + 1)
                 if scaled:
@@ -101,8 +108,18 @@ class Calibration(Hardware):
                                                             r'Flats_{}'.format(ticket.name),
                                                             image_name), type='light')
                 self.camera.image_done.wait()
-                median = filereader_utils.mediancounts(os.path.join(
-                    self.image_directories[ticket], r'Flats_{}'.format(ticket.name), image_name))
+                try:
+                    median = self.analysis.submit(AnalysisService.quality, filereader_utils.mediancounts, os.path.join(
+                        self.image_directories[ticket], r'Flats_{}'.format(ticket.name), image_name)).result()
+                except AnalysisService.dropped:
+                    dropped += 1
+                    if dropped > self.analysis_retries:
+                        logging.error('The analysis of {} flats in a row was dropped...skipping the {} filter'.format(
+                            dropped, f))
+                        break
+                    logging.warning('The analysis of {} was dropped...taking it again'.format(image_name))
+                    continue
+                dropped = 0
                 if scaled is False and median < self.config_dict.saturation:
                     # Calculate exposure time
                     desired = 15000
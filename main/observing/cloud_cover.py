@@ -0,0 +1,309 @@
+# Cloud cover from GOES satellite images
+import io
+import logging
+import datetime
+import collections
+import numpy as np
+import requests.exceptions
+
+from PIL import Image
+
+from ..common.util import conversion_utils, registration_utils
+from ..common.IO import config_reader
+
+
+class CloudCover:
+
+    image_scale = 7.0e-5                            # Radians of scan angle per pixel on the SSEC CONUS images
+    reference_point = (38.828, -77.305, 315, 1360)  # Latitude, longitude, row and column of a known pixel
+    satellite_longitude = -75.0
+    cloud_threshold = 50                            # Band 13 pixel values above this are counted as cloud
+    frame_minutes = 5
+    frame_candidates = 6
+    max_frames = 12
+    context_scale = 3                               # Size of the cropped region, in multiples of cloud_cover_radius
+    forecast_minutes = 90
+    minimum_correlation = 0.05                      # Weakest phase correlation peak that is trusted as cloud motion
+
+    def __init__(self, http_session):
+        """
+        Description
+        -----------
+        Measures cloud cover around the site from the SSEC GOES-16 CONUS band 13 images.  Each frame is only
+        downloaded and decoded once, and only the region around the site is kept in memory.  The region is a few
+        times larger than cloud_cover_radius so that the motion of the clouds between frames can be used to
+        forecast the cover over the site.
+
+        Parameters
+        ----------
+        http_session : CLASS INSTANCE OBJECT of CachedSession
+            From http_cache, shared with the condition checker.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.http = http_session
+        self.config_dict = config_reader.get_config()
+        self.frames = collections.OrderedDict()
+        # Cropped frames by timestamp, oldest first
+        self.history = collections.deque(maxlen=self.max_frames)
+        # (timestamp, percent cover) for the most recent frames
+        (self.row, self.column) = self.site_pixel(self.config_dict.site_latitude, self.config_dict.site_longitude)
+        (self.radius_rows, self.radius_columns) = self.site_radius(self.config_dict.cloud_cover_radius)
+        context_rows = self.radius_rows * self.context_scale
+        context_columns = self.radius_columns * self.context_scale
+        self.bounds = (int(np.floor(self.column - context_columns)), int(np.floor(self.row - context_rows)),
+                       int(np.ceil(self.column + context_columns)) + 1, int(np.ceil(self.row + context_rows)) + 1)
+        # PIL crop box (left, upper, right, lower) around the site
+        (rows, columns) = np.ogrid[self.bounds[1]:self.bounds[3], self.bounds[0]:self.bounds[2]]
+        self.mask = ((rows - self.row) / self.radius_rows)**2 + \
+                    ((columns - self.column) / self.radius_columns)**2 <= 1
+        self.mask_pixels = np.nonzero(self.mask)
+
+    def site_pixel(self, latitude, longitude):
+        """
+        Parameters
+        ----------
+        latitude : FLOAT
+            Latitude of the point to find, in degrees.
+        longitude : FLOAT
+            Longitude of the point to find, in degrees.
+
+        Returns
+        -------
+        row : FLOAT
+            Row of the point on the CONUS images.
+        column : FLOAT
+            Column of the point on the CONUS images.
+
+        """
+        (ref_latitude, ref_longitude, ref_row, ref_column) = self.reference_point
+        (x_ref, y_ref) = conversion_utils.get_goes_scan_angles(ref_latitude, ref_longitude,
+                                                              self.satellite_longitude)
+        (x, y) = conversion_utils.get_goes_scan_angles(latitude, longitude, self.satellite_longitude)
+        row = ref_row + (y_ref - y) / self.image_scale
+        column = ref_column + (x - x_ref) / self.image_scale
+        return row, column
+
+    def site_radius(self, radius):
+        """
+        Parameters
+        ----------
+        radius : FLOAT
+            Radius around the site in km.
+
+        Returns
+        -------
+        radius_rows : FLOAT
+            The radius in pixels along the columns of the image (N/S).
+        radius_columns : FLOAT
+            The radius in pixels along the rows of the image (E/W).
+
+        """
+        latitude = self.config_dict.site_latitude
+        longitude = self.config_dict.site_longitude
+        (row_north, column_north) = self.site_pixel(latitude + 0.1, longitude)
+        (row_east, column_east) = self.site_pixel(latitude, longitude + 0.1)
+        km_north = 0.1 * 111.13
+        km_east = 0.1 * 111.32 * np.cos(np.radians(latitude))
+        radius_rows = radius * np.hypot(row_north - self.row, column_north - self.column) / km_north
+        radius_columns = radius * np.hypot(row_east - self.row, column_east - self.column) / km_east
+        return max(radius_rows, 1.0), max(radius_columns, 1.0)
+
+    def frame_times(self):
+        """
+
+        Returns
+        -------
+        LIST
+            Timezone-aware UTC datetimes of the candidate frames, newest first.  SSEC publishes CONUS frames at
+            minutes ending in 1 and 6.
+
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        newest = now.replace(minute=0, second=0, microsecond=0) + \
+            datetime.timedelta(minutes=now.minute - (now.minute - 1) % self.frame_minutes)
+        return [newest - datetime.timedelta(minutes=i*self.frame_minutes) for i in range(self.frame_candidates)]
+
+    def frame_url(self, timestamp):
+        """
+        Parameters
+        ----------
+        timestamp : DATETIME.DATETIME
+            UTC time of the frame.
+
+        Returns
+        -------
+        STR
+            Url of the CONUS band 13 image for that time, from the cloud_image_url template.
+
+        """
+        return self.config_dict.cloud_image_url.format(satellite=self.config_dict.cloud_satellite, timestamp=timestamp)
+
+    def newest_frame(self):
+        """
+        Description
+        -----------
+        Finds the newest available frame.  Newer candidates are tried first, and the search stops at the first frame
+        that is either already cached or can be downloaded.
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            Connection errors are passed on to the condition checker.
+
+        Returns
+        -------
+        timestamp : DATETIME.DATETIME
+            Time of the newest frame, or None if no frame could be found.
+        region : NUMPY.NDARRAY
+            The region of the frame around the site, or None if no frame could be found.
+
+        """
+        for timestamp in self.frame_times():
+            if timestamp in self.frames:
+                return timestamp, self.frames[timestamp]
+            try:
+                (entry, changed) = self.http.get(self.frame_url(timestamp), cache=False)
+            except requests.exceptions.HTTPError:
+                continue
+            if len(entry.content) <= 2000:
+                continue
+            region = self._decode_region(entry.content)
+            self.frames[timestamp] = region
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+            return timestamp, region
+        return None, None
+
+    def _decode_region(self, content):
+        """
+        Parameters
+        ----------
+        content : BYTES
+            Raw GIF file.
+
+        Returns
+        -------
+        NUMPY.NDARRAY
+            uint8 pixel values of the region around the site.
+
+        """
+        with Image.open(io.BytesIO(content)) as img:
+            return np.asarray(img.crop(self.bounds))
+
+    def cover(self, region):
+        """
+        Parameters
+        ----------
+        region : NUMPY.NDARRAY
+            Region of a frame around the site, from newest_frame.
+
+        Returns
+        -------
+        FLOAT
+            Percentage of the sky within cloud_cover_radius of the site that is covered by clouds.
+
+        """
+        return float(np.count_nonzero(region[self.mask] > self.cloud_threshold)) / np.count_nonzero(self.mask) * 100
+
+    def update(self):
+        """
+        Description
+        -----------
+        Finds the newest frame and measures the cloud cover in it, adding it to the history if it is a new frame.
+
+        Returns
+        -------
+        percent_cover : FLOAT
+            Percentage of cloud cover around the site, or None if no frame could be found.
+
+        """
+        (timestamp, region) = self.newest_frame()
+        if timestamp is None:
+            return None
+        percent_cover = self.cover(region)
+        if not self.history or self.history[-1][0] != timestamp:
+            self.history.append((timestamp, percent_cover))
+            logging.debug('Cloud cover at {} was {:.1f}%'.format(timestamp.strftime('%H:%M'), percent_cover))
+        return percent_cover
+
+    def velocity(self):
+        """
+        Description
+        -----------
+        Estimates the cloud motion over the site from the two newest cached frames with FFT phase correlation.
+
+        Returns
+        -------
+        TUPLE
+            Cloud velocity as (rows per minute, columns per minute) on the images, and the time of the newest frame.
+            Both are None if there are not enough frames, or the frames do not match well enough to trust.
+
+        """
+        if len(self.frames) < 2:
+            return None, None
+        ((previous_time, previous), (current_time, current)) = list(self.frames.items())[-2:]
+        minutes = (current_time - previous_time).total_seconds() / 60
+        if minutes <= 0:
+            return None, None
+        (dy, dx, peak) = registration_utils.phase_correlation(previous, current)
+        if peak < self.minimum_correlation:
+            return None, None
+        return (dy / minutes, dx / minutes), current_time
+
+    def forecast(self):
+        """
+        Description
+        -----------
+        Forecasts the cloud cover over the site by moving the clouds of the newest frame along their measured
+        velocity, for every frame interval up to forecast_minutes ahead.
+
+        Returns
+        -------
+        LIST
+            (datetime, percent cover) tuples, starting from the time of the newest frame.  Empty if the cloud motion
+            could not be measured.
+
+        """
+        (velocity, current_time) = self.velocity()
+        if velocity is None:
+            return []
+        region = self.frames[current_time]
+        minutes = np.arange(0, self.forecast_minutes + 1, self.frame_minutes)
+        # Cloud over the site at time t is the cloud that is upwind by velocity * t now
+        source_rows = np.rint(self.mask_pixels[0][np.newaxis, :] - velocity[0] * minutes[:, np.newaxis])
+        source_columns = np.rint(self.mask_pixels[1][np.newaxis, :] - velocity[1] * minutes[:, np.newaxis])
+        source_rows = np.clip(source_rows, 0, region.shape[0] - 1).astype(int)
+        source_columns = np.clip(source_columns, 0, region.shape[1] - 1).astype(int)
+        cover = np.mean(region[source_rows, source_columns] > self.cloud_threshold, axis=1) * 100
+        return [(current_time + datetime.timedelta(minutes=int(m)), float(c)) for (m, c) in zip(minutes, cover)]
+
+    def clear_intervals(self, limit):
+        """
+        Parameters
+        ----------
+        limit : FLOAT
+            Percentage of cloud cover at or above which the sky does not count as clear.
+
+        Returns
+        -------
+        LIST
+            (start, end) datetime tuples of the intervals that are forecast to be clear, in order.  An interval
+            that is still clear at the end of the forecast ends at the last forecast time.
+
+        """
+        intervals = []
+        start = None
+        forecast = self.forecast()
+        for (timestamp, cover) in forecast:
+            if cover < limit and start is None:
+                start = timestamp
+            elif cover >= limit and start is not None:
+                intervals.append((start, timestamp))
+                start = None
+        if start is not None:
+            intervals.append((start, forecast[-1][0]))
+        return intervals
@@ -11,16 +11,19 @@ import time
 import threading
 import logging
 import datetime
-import numpy as np
-
-from PIL import Image
 
 from ..common.util import time_utils, conversion_utils
-from ..common.IO import config_reader
+from ..common.IO import config_reader, http_cache, weather_store
+from .cloud_cover import CloudCover
+from .radar import Radar
 
 
 class Conditions(threading.Thread):
 
+    api_key_ttl = 6*60*60       # Seconds to keep the weather.com API key before scraping it again
+    trend_minutes = 60          # Only readings this recent are used to find trends
+    far_margin = 0.2            # Fraction of a limit that counts as far away from it
+
     def __init__(self):
         """
         Subclassed from threading.Thread.  Conditions periodically checks the humidity, wind, sun position, clouds, and
@@ -38,26 +41,40 @@ class Conditions(threading.Thread):
         self.weather_alert = threading.Event()
         self.connection_alert = threading.Event()
         self.stop = threading.Event()
+        self.check_requested = threading.Event()
         # Threading events to set flags and interact between threads
+        self.check_condition = threading.Condition()
+        self.checks_started = 0
+        self.checks_finished = 0
+        # Number of the latest check that has started and that has finished, so request_check waits for a new one
         self.config_dict = config_reader.get_config()  # Global config dictionary
-        self.weather_url = 'http://weather.cos.gmu.edu/Current_Monitor.htm'
-        self.backup_weather_url = 'https://weather.com/weather/hourbyhour/' + \
-                                  'l/e8321c2fb1f8234f40bf92ce494921d94e657d54cc2c01f1882755e04b761dee'
-        # GMU COS Website for humitiy and wind
-        self.rain_url = 'https://weather.com/weather/radar/interactive/' + \
-                        'l/b63f24c17cc4e2d086c987ce32b2927ba388be79872113643d2ef82b2b13e813'
+        self.weather_url = self.config_dict.weather_url
+        self.backup_weather_url = self.config_dict.backup_weather_url
+        # GMU COS Website for humitiy and wind, and weather.com as a backup
+        self.rain_url = self.config_dict.rain_url
         # Weather.com radar for rain
+        self.http = http_cache.CachedSession(user_agent=self.config_dict.user_agent)
+        self.parsed_pages = {}
+        # Conditional GET cache for all weather sources, and the last parsed values of each page by content digest
+        self.clouds = CloudCover(self.http)
+        self.radar_nowcast = Radar(self.http)
         self.sun = False
         self.temperature = None
-        current_directory = os.path.abspath(os.path.dirname(__file__))
-        self.weather_directory = os.path.join(current_directory, r'..', r'..', r'resources', r'weather_status')
+        self.alert_reasons = []
+        self.cloud_percent = None
+        self.radar_percent = None
+        self.rain_arrival = None
+        self.weather_directory = os.path.join(self.config_dict.data_directory, r'weather_status')
+        self.store = weather_store.WeatherStore(os.path.join(self.weather_directory, r'weather_history.sqlite'))
+        # Every reading is kept with the observing data, for trends, focus temperature and post-night analysis
 
     def run(self):
         """
         Description
         -----------
-        Calls self.weather_check and self.rain_check once every 15 minutes.  If conditions are clear, does nothing.
-        If conditions are bad, stops observation_run and shuts down the observatory.
+        Calls self.weather_check, self.rain_check and self.cloud_check on an adaptive cadence around weather_freq
+        minutes.  If conditions are clear, does nothing.  If conditions are bad, stops observation_run and shuts down
+        the observatory.  Closes the weather history once self.stop is set.
 
         Returns
         -------
@@ -68,15 +85,22 @@ class Conditions(threading.Thread):
         connection_failures = 0
         if not self.check_internet():
             logging.error("Your internet connection requires attention.")
+            self.store.close()
+            self.stop.set()
+            with self.check_condition:
+                self.check_condition.notify_all()
             return
         while not self.stop.isSet():
+            with self.check_condition:
+                self.checks_started += 1
+                check = self.checks_started
             (humidity, wind, rain, temperature) = self.weather_check()
             self.temperature = temperature
-            radar = self.rain_check()
+            self.rain_check()
             sun_elevation = conversion_utils.get_sun_elevation(datetime.datetime.now(datetime.timezone.utc),
                                                                self.config_dict.site_latitude,
                                                                self.config_dict.site_longitude)
-            cloud_cover = self.cloud_check()
+            self.cloud_check()
             if self.connection_alert.isSet():
                 connection_failures += 1
                 if connection_failures >= 2:
@@ -88,29 +112,253 @@ class Conditions(threading.Thread):
                     continue
             if humidity is None or wind is None:
                 logging.warning('Could not retrieve humidity or wind values...it may be unsafe to continue observing.')
-            if (humidity is None or humidity >= self.config_dict.humidity_limit) or \
-                    (wind is None or wind >= self.config_dict.wind_limit) or \
-                    (rain not in (None, 0) and last_rain is not None and last_rain != rain) or \
-                    (radar is True) or (sun_elevation >= 0) or (cloud_cover is True):
+            readings = {'humidity': humidity, 'wind': wind, 'temperature': temperature, 'rain': rain,
+                        'radar': self.radar_percent, 'clouds': self.cloud_percent, 'sun_elevation': sun_elevation}
+            self.store.append(**readings)
+            reasons = self.evaluate(self.config_dict, self.store, readings, last_rain, rain_arrival=self.rain_arrival)
+            self.alert_reasons = reasons
+            if reasons:
                 self.weather_alert.set()
                 self.sun = (sun_elevation >= 0)
-                message = ""
-                message += "| Humidity |" if (humidity is None or humidity >= self.config_dict.humidity_limit) else ""
-                message += "| Wind |" if (wind is None or wind >= self.config_dict.wind_limit) else ""
-                message += "| Rain |" if (last_rain != rain and last_rain is not None) else ""
-                message += "| Nearby Rain |" if radar else ""
-                message += "| Sun Elevation |" if self.sun else ""
-                message += "| Clouds |" if cloud_cover else ""
+                message = ''.join('| {} |'.format(reason) for reason in reasons)
                 logging.critical("Weather conditions have become too poor for continued observing. "
                                  "Reason(s) for weather alert: {}".format(message))
             else:
                 logging.debug("Condition checker is alive: Last check false")
                 self.weather_alert.clear()
             last_rain = rain
-            self.stop.wait(timeout=self.config_dict.weather_freq*60)
+            logging.debug('Condition checks transferred {} bytes this cycle'.format(self.http.reset_byte_count()))
+            with self.check_condition:
+                self.checks_finished = check
+                self.check_condition.notify_all()
+            interval = self.next_check_interval()
+            logging.debug('Next condition check in {:.1f} minutes'.format(interval / 60))
+            self._sleep(interval)
+        self.store.close()
+        with self.check_condition:
+            self.check_condition.notify_all()
+
+    @classmethod
+    def evaluate(cls, config_dict, store, readings, last_rain, rain_arrival=None, now=None):
+        """
+        Description
+        -----------
+        The weather alert decision, kept apart from the checks themselves so that recorded conditions can be
+        replayed through exactly the same logic.  Besides the current readings, humidity and wind are closed on
+        ahead of time if their recent trend in the store would take them over their limit within weather_trend_lead
+        minutes.
+
+        Parameters
+        ----------
+        config_dict : CLASS INSTANCE OBJECT of Config
+            Limits to check the readings against.
+        store : CLASS INSTANCE OBJECT of WeatherStore
+            Weather history, already holding these readings.  May be None to skip the trend checks.
+        readings : DICT
+            The latest value of each WeatherStore column.  Missing values are None.
+        last_rain : FLOAT
+            Total rain at the previous check, or None.
+        rain_arrival : FLOAT, optional
+            Minutes until rain is predicted to reach the site, from the radar nowcast.  The default is None.
+        now : FLOAT, optional
+            Epoch seconds of the readings.  The default is None, which uses the current time.
+
+        Returns
+        -------
+        reasons : LIST
+            Reasons for a weather alert, i.e. 'Humidity' or 'Clouds'.  Empty if conditions are good.
+
+        """
+        reasons = []
+        (humidity, wind, rain) = (readings.get('humidity'), readings.get('wind'), readings.get('rain'))
+        (radar, clouds, sun_elevation) = (readings.get('radar'), readings.get('clouds'), readings.get('sun_elevation'))
+        if humidity is None or humidity >= config_dict.humidity_limit:
+            reasons.append('Humidity')
+        if wind is None or wind >= config_dict.wind_limit:
+            reasons.append('Wind')
+        if rain not in (None, 0) and last_rain is not None and last_rain != rain:
+            reasons.append('Rain')
+        if (radar is not None and radar >= Radar.rain_threshold) or \
+                (rain_arrival is not None and rain_arrival <= config_dict.radar_lead_time):
+            reasons.append('Nearby Rain')
+        if sun_elevation is not None and sun_elevation >= 0:
+            reasons.append('Sun Elevation')
+        if clouds is not None and clouds >= config_dict.cloud_cover_limit:
+            reasons.append('Clouds')
+        if store is None:
+            return reasons
+        for (source, reason) in (('humidity', 'Humidity'), ('wind', 'Wind')):
+            if reason in reasons:
+                continue
+            minutes = store.time_to_limit(source, cls._limits(config_dict)[source], cls.trend_minutes, now=now)
+            if minutes is not None and minutes <= config_dict.weather_trend_lead:
+                logging.warning('{} is predicted to reach its limit in {:.0f} minutes.'.format(reason, minutes))
+                reasons.append('Rising {}'.format(reason))
+        return reasons
 
     @staticmethod
-    def check_internet():
+    def _limits(config_dict):
+        """
+        Parameters
+        ----------
+        config_dict : CLASS INSTANCE OBJECT of Config
+            Config to take the limits from.
+
+        Returns
+        -------
+        DICT
+            The limit for each WeatherStore column that the check cadence follows.
+
+        """
+        return {'humidity': config_dict.humidity_limit, 'wind': config_dict.wind_limit,
+                'clouds': config_dict.cloud_cover_limit, 'radar': Radar.rain_threshold}
+
+    def next_check_interval(self):
+        """
+
+        Returns
+        -------
+        FLOAT
+            Time until the next check in seconds, from check_interval.
+
+        """
+        return self.check_interval(self.config_dict, self.store, self.weather_alert.isSet(), self.alert_reasons,
+                                   self.rain_arrival)
+
+    @classmethod
+    def check_interval(cls, config_dict, store, alert, alert_reasons, rain_arrival, now=None):
+        """
+        Description
+        -----------
+        Adapts the time until the next check to the recent history of each source.  Checks are made every
+        weather_freq_min minutes while waiting to reopen, as often as needed to catch a source that is trending
+        toward its limit, and only every weather_freq_max minutes when every source is far from its limit.
+
+        Parameters
+        ----------
+        config_dict : CLASS INSTANCE OBJECT of Config
+            Limits and check frequencies.
+        store : CLASS INSTANCE OBJECT of WeatherStore
+            Weather history to find the trends in.
+        alert : BOOL
+            Whether or not there is a weather alert.
+        alert_reasons : LIST
+            Reasons for the weather alert, from evaluate.
+        rain_arrival : FLOAT
+            Minutes until rain is predicted to reach the site, or None.
+        now : FLOAT, optional
+            Epoch seconds to find the trends at.  The default is None, which uses the current time.
+
+        Returns
+        -------
+        FLOAT
+            Time until the next check in seconds.
+
+        """
+        minimum = config_dict.weather_freq_min * 60
+        maximum = config_dict.weather_freq_max * 60
+        if alert:
+            # While the Sun is up we stay closed whatever else is wrong, so there is no need to check often until it
+            # sets
+            return maximum if 'Sun Elevation' in alert_reasons else minimum
+        interval = config_dict.weather_freq * 60
+        far = True
+        for (source, limit) in cls._limits(config_dict).items():
+            (value, slope) = store.trend(source, cls.trend_minutes, now=now)
+            if value is None:
+                far = False
+                continue
+            if value >= (1 - cls.far_margin) * limit:
+                far = False
+            if slope is not None and slope > 0:
+                # Check again by the time the source is halfway to its limit
+                crossing = (limit - value) / slope * 60
+                interval = min(interval, crossing / 2)
+                if crossing < 2 * maximum:
+                    far = False
+        if rain_arrival is not None:
+            interval = min(interval, (rain_arrival - config_dict.radar_lead_time) * 60)
+        if far:
+            interval = maximum
+        return float(min(max(interval, minimum), maximum))
+
+    def _sleep(self, seconds):
+        """
+        Description
+        -----------
+        Waits between condition checks.  Returns early if the checker is stopped or if another thread has asked for
+        an immediate check with request_check.
+
+        Parameters
+        ----------
+        seconds : INT or FLOAT
+            Maximum time to wait, in seconds.
+
+        Returns
+        -------
+        None.
+
+        """
+        deadline = time.time() + seconds
+        while not self.stop.isSet() and time.time() < deadline:
+            if self.check_requested.wait(timeout=min(1, max(deadline - time.time(), 0))):
+                break
+        self.check_requested.clear()
+
+    def request_check(self, timeout=5*60):
+        """
+        Description
+        -----------
+        Asks the condition checker to check all conditions right away, rather than waiting for the next scheduled
+        check, and waits for that check to finish.  A check that was already running when the request was made does
+        not count, since it may have read the conditions before the request.  Must NOT be called from the
+        Conditions thread itself.
+
+        Parameters
+        ----------
+        timeout : INT or FLOAT, optional
+            Maximum time in seconds to wait for the check to finish.  The default is 5 minutes.
+
+        Returns
+        -------
+        BOOL
+            True if the check finished, otherwise False.  Returns False right away if the condition checker is not
+            running, and as soon as it stops.
+
+        """
+        if not self.is_alive() or self.stop.isSet():
+            return False
+        with self.check_condition:
+            wanted = self.checks_started + 1
+            self.check_requested.set()
+            self.check_condition.wait_for(lambda: self.checks_finished >= wanted or self.stop.isSet(), timeout=timeout)
+            return self.checks_finished >= wanted
+
+    def next_reopen_check(self):
+        """
+        Description
+        -----------
+        Decides how long to wait before checking conditions again while closed for a weather alert.  If clouds are
+        the only reason for the alert, the cloud motion forecast is used to check again right when the sky is
+        predicted to clear.  Otherwise, uses the adaptive check interval.
+
+        Returns
+        -------
+        FLOAT
+            Time to wait in seconds.
+
+        """
+        default = self.next_check_interval()
+        if self.alert_reasons != ['Clouds']:
+            return default
+        intervals = self.clouds.clear_intervals(self.config_dict.cloud_cover_limit)
+        if not intervals:
+            return default
+        clearing = (intervals[0][0] - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        logging.info('Clouds are predicted to clear at {}.'.format(intervals[0][0].strftime('%H:%M:%S%z')))
+        return min(max(clearing, 60), default)
+
+    def check_internet(self):
         """
 
         Returns
@@ -120,7 +368,7 @@ class Conditions(threading.Thread):
 
         """
         try:
-            urllib.request.urlopen('http://google.com')
+            urllib.request.urlopen(self.config_dict.internet_check_url, timeout=30)
             return True
         except (urllib.error.URLError, urllib.error.HTTPError):
             return False
@@ -139,21 +387,21 @@ class Conditions(threading.Thread):
         Temperature : FLOAT
             Current temperature in degrees F at Research Hall, from GMU COS weather station.
 
-        For all values, uses weather.com as a backup if the weather station is down.
+        For all values, uses weather.com as a backup if the weather station is down.  Both pages are revalidated
+        with conditional GETs, and are only re-parsed and re-saved when their content has changed.
 
         """
-        s = requests.Session()
         backup = False
         try:
-            header = requests.head(self.weather_url).headers
+            self.weather, changed = self.http.get(self.weather_url)
         except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
                 urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
                 requests.exceptions.HTTPError):
-            logging.warning('Failed to read GMU website header')
+            logging.warning('Failed to read GMU website')
             backup = True
         else:
-            if 'Last-Modified' in header:
-                update_time = time_utils.convert_to_datetime_utc(header['Last-Modified'])
+            if self.weather.last_modified:
+                update_time = time_utils.convert_to_datetime_utc(self.weather.last_modified)
                 diff = datetime.datetime.now(datetime.timezone.utc) - update_time
                 if diff > datetime.timedelta(minutes=30):
                     # Checking when the web page was last modified (may be outdated)
@@ -165,96 +413,182 @@ class Conditions(threading.Thread):
                                 "it may be outdated!")
                 backup = True
 
-        target_path = os.path.abspath(os.path.join(self.weather_directory, r'weather.txt'))
         if not backup:
-            try:
-                self.weather = s.get(self.weather_url)
-            except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
-                    urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
-                    requests.exceptions.HTTPError):
-                self.connection_alert.set()
-                return None, None, None, None
-            conditions = re.findall(r'<font color="#3366FF">(.+?)</font>', self.weather.text)
-            humidity = float(conditions[1].replace('%', ''))
-            if temperature_0 := re.search(r'[+-]?\d+\.\d+', conditions[0]):
-                temperature = float(temperature_0.group())
-            else:
-                temperature = None
-            if test_wind := re.search(r'[+-]?\d+\.\d+', conditions[3]):
-                wind = float(test_wind.group())
-            else:
-                wind = None
-            if test_rain := re.search(r'[+-]?\d+\.\d+', conditions[5]):
-                rain = float(test_rain.group())
-            else:
-                rain = None
-
+            (humidity, wind, rain, temperature) = self._parse_page(self.weather, self._parse_gmu_page,
+                                                                   r'weather.txt')
         else:
             try:
-                self.weather = s.get(self.backup_weather_url, headers={'User-Agent': self.config_dict.user_agent})
+                self.weather, changed = self.http.get(self.backup_weather_url)
             except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
                     urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
                     requests.exceptions.HTTPError):
                 self.connection_alert.set()
                 return None, None, None, None
+            (humidity, wind, rain, temperature) = self._parse_page(self.weather, self._parse_backup_page,
+                                                                   r'weather.txt')
 
-            weather_ids = {'PercentageValue': None, 'Wind': None, 'TemperatureValue': None}
-            for key, value in weather_ids.items():
-                condition_data = re.search(r'<span data-testid="' + key + '" class="(.+?)' +
-                                           r'>(.+?)</span>', self.weather.text)
-                if condition_data:
-                    if test_condition := re.search(r'[+-]?\d+\.\d+', condition_data.group(2)):
-                        condition = float(test_condition.group())
-                    else:
-                        condition = int(re.search(r'[+-]?\d+', condition_data.group(2)).group())
-                else:
-                    logging.warning('Could not find wind from weather.com...their html may have changed.')
-                    continue
-                weather_ids[key] = condition
-            humidity = weather_ids['PercentageValue']
-            wind = weather_ids['Wind']
-            temperature = weather_ids['TemperatureValue']
+        return humidity, wind, rain, temperature
+
+    def _parse_page(self, entry, parser, filename):
+        """
+        Description
+        -----------
+        Parses a cached page, reusing the previous result if the page content has not changed since it was last
+        parsed.  New content is also written to self.weather_directory for debugging.
+
+        Parameters
+        ----------
+        entry : CacheEntry
+            Cached page from self.http.
+        parser : FUNCTION
+            Function that takes the page text and returns the parsed values.
+        filename : STR
+            Name of the file in self.weather_directory to save the raw page to.
+
+        Returns
+        -------
+        ANY
+            Whatever the parser returns.
+
+        """
+        if entry.url in self.parsed_pages and self.parsed_pages[entry.url][0] == entry.digest:
+            logging.debug('{} is unchanged, reusing the last parsed values'.format(entry.url))
+            return self.parsed_pages[entry.url][1]
+        values = parser(entry.text)
+        self.parsed_pages[entry.url] = (entry.digest, values)
+        target_path = os.path.abspath(os.path.join(self.weather_directory, filename))
+        try:
+            with open(target_path, 'w') as file:
+                # Writes the html code to a text file
+                file.write(str(entry.content))
+        except (UnicodeError, UnicodeEncodeError, UnicodeDecodeError):
+            logging.warning('Could not save {} due to a unicode error.'.format(filename))
+        return values
+
+    @staticmethod
+    def _parse_gmu_page(text):
+        """
+        Parameters
+        ----------
+        text : STR
+            Html of the GMU COS weather station page.
+
+        Returns
+        -------
+        TUPLE
+            Humidity, wind, rain, and temperature, in the same form as weather_check.
+
+        """
+        conditions = re.findall(r'<font color="#3366FF">(.+?)</font>', text)
+        humidity = float(conditions[1].replace('%', ''))
+        if temperature_0 := re.search(r'[+-]?\d+\.\d+', conditions[0]):
+            temperature = float(temperature_0.group())
+        else:
+            temperature = None
+        if test_wind := re.search(r'[+-]?\d+\.\d+', conditions[3]):
+            wind = float(test_wind.group())
+        else:
+            wind = None
+        if test_rain := re.search(r'[+-]?\d+\.\d+', conditions[5]):
+            rain = float(test_rain.group())
+        else:
             rain = None
+        return humidity, wind, rain, temperature
 
-        with open(target_path, 'w') as file:
-            # Writes the html code to a text file
-            file.write(str(self.weather.content))
+    @staticmethod
+    def _parse_backup_page(text):
+        """
+        Parameters
+        ----------
+        text : STR
+            Html of the weather.com hourly page.
 
+        Returns
+        -------
+        TUPLE
+            Humidity, wind, rain, and temperature, in the same form as weather_check.  Rain is always None.
+
+        """
+        weather_ids = {'PercentageValue': None, 'Wind': None, 'TemperatureValue': None}
+        for key, value in weather_ids.items():
+            condition_data = re.search(r'<span data-testid="' + key + '" class="(.+?)' +
+                                       r'>(.+?)</span>', text)
+            if condition_data:
+                if test_condition := re.search(r'[+-]?\d+\.\d+', condition_data.group(2)):
+                    condition = float(test_condition.group())
+                else:
+                    condition = int(re.search(r'[+-]?\d+', condition_data.group(2)).group())
+            else:
+                logging.warning('Could not find wind from weather.com...their html may have changed.')
+                continue
+            weather_ids[key] = condition
+        humidity = weather_ids['PercentageValue']
+        wind = weather_ids['Wind']
+        temperature = weather_ids['TemperatureValue']
+        rain = None
         return humidity, wind, rain, temperature
 
-    def rain_check(self):
+    def get_api_key(self):
         """
+        Description
+        -----------
+        Retrieves the weather.com API key needed to access radar images.  The key is scraped from the radar page
+        and then kept for api_key_ttl seconds, so the radar page is not downloaded every cycle.
 
         Returns
         -------
-        BOOL
-            True if there is rain nearby, False otherwise.
+        api_key : STR
+            The API key, or None if it could not be retrieved.
 
         """
-        s = requests.Session()
+        if api_key := self.http.ttl_get('radar_api_key'):
+            return api_key
         try:
-            self.radar = s.get(self.rain_url, headers={'User-Agent': self.config_dict.user_agent})
+            self.radar, changed = self.http.get(self.rain_url)
         except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
                 urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
                 requests.exceptions.HTTPError):
             self.connection_alert.set()
             return None
-        # api_key = re.search(r'"SUN_V3_API_KEY":"(.+?)",', self.radar.text).group(1)
         # API key needed to access radar images from the weather.com website
-        api_key = re.search(r'\\"SUN_V3_API_KEY(.+?)\\":\\"(.+?)\\",', self.radar.text)
+        api_key = self._parse_page(self.radar, self._parse_api_key, r'radar.txt')
         if api_key:
-            api_key = api_key.group(2)
+            self.http.ttl_set('radar_api_key', api_key, self.api_key_ttl)
         else:
             logging.warning('Could not retrieve weather.com API key.  Continuing without radar checks.')
-            return None
+        return api_key
 
-        target_path = os.path.abspath(os.path.join(self.weather_directory, r'radar.txt'))
-        try:
-            with open(target_path, 'w') as file:
-                # Writes weather.com html to a text file
-                file.write(str(self.radar.content))
-        except (UnicodeError, UnicodeEncodeError, UnicodeDecodeError):
-            logging.warning('Could not save weather.com html due to a unicode error.')
+    @staticmethod
+    def _parse_api_key(text):
+        """
+        Parameters
+        ----------
+        text : STR
+            Html of the weather.com radar page.
+
+        Returns
+        -------
+        STR
+            The SUN_V3 API key found in the page, or None if it could not be found.
+
+        """
+        api_key = re.search(r'\\"SUN_V3_API_KEY(.+?)\\":\\"(.+?)\\",', text)
+        return api_key.group(2) if api_key else None
+
+    def rain_check(self):
+        """
+
+        Returns
+        -------
+        BOOL
+            True if there is rain nearby, or if rain is predicted to reach the site within radar_lead_time minutes,
+            False otherwise.
+
+        """
+        (self.radar_percent, self.rain_arrival) = (None, None)
+        api_key = self.get_api_key()
+        if not api_key:
+            return None
 
         epoch_sec = time_utils.datetime_to_epoch_milli_converter(datetime.datetime.utcnow()) / 1000
         esec_round = time_utils.rounddown_300(epoch_sec)
@@ -262,49 +596,29 @@ class Conditions(threading.Thread):
         if abs(epoch_sec - esec_round) < 10:
             time.sleep(10 - abs(epoch_sec - esec_round))
 
-        coords = {0: '291:391:10', 1: '291:392:10', 2: '292:391:10', 3: '292:392:10'}
-        # Radar map coordinates found by looking through html
-        rain = []
-        for key in coords:
-            url = ('https://api.weather.com/v3/TileServer/tile?product=twcRadarMosaic'
-                   + '&ts={}'.format(str(esec_round))
-                   + '&xyz={}'.format(coords[key]) + '&apiKey={}'.format(api_key))
-            # Constructs url of 4 nearest radar images
-            path_to_images: str = os.path.abspath(os.path.join(
-                self.weather_directory, r'radar-img{0:04}.png'.format(key + 1)))
-            try:
-                req = s.get(url, headers={'User-Agent': self.config_dict.user_agent})
-            except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
-                    urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
-                    requests.exceptions.HTTPError):
-                self.connection_alert.set()
-                return None
-            with open(path_to_images, 'wb') as file:
-                file.write(req.content)
-                # Writes 4 images to local png files
-
-            img = Image.open(path_to_images)
-            px = img.size[0] * img.size[1]
-            colors = img.getcolors()
-            if len(colors) > 1:  # Checks for any colors (green to red for rain) in the images
-                percent_colored = (1 - colors[-1][0] / px) * 100
-                if percent_colored >= 10:
-                    return True
-                else:
-                    rain.append(1)
-            else:
-                continue
-            img.close()
-        if sum(rain) >= 2:
+        try:
+            (percent_coverage, arrival) = self.radar_nowcast.update(esec_round, api_key)
+        except requests.exceptions.HTTPError:
+            logging.warning('Radar tile request was refused...the weather.com API key may have expired.')
+            self.http.ttl_clear('radar_api_key')
+            return None
+        except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
+                urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.connection_alert.set()
+            return None
+        (self.radar_percent, self.rain_arrival) = (percent_coverage, arrival)
+        if percent_coverage >= self.radar_nowcast.rain_threshold:
             return True
-        else:
-            return False
+        if arrival is not None and arrival <= self.config_dict.radar_lead_time:
+            logging.warning('Rain is predicted to reach the site in {:.0f} minutes.'.format(arrival))
+            return True
+        return False
 
     def cloud_check(self):
         """
         Description
         -----------
-        Checks the current cloud cover around Fairfax.
+        Checks the current cloud cover around the site.
 
         Returns
         -------
@@ -313,49 +627,16 @@ class Conditions(threading.Thread):
             defined in the config file, otherwise False.
 
         """
-        satellite = self.config_dict.cloud_satellite
-        day = str(int(time_utils.days_of_year())).zfill(3)
-        conus_band = 13
-        _time = datetime.datetime.now(datetime.timezone.utc)
-        year = _time.year
-        time_round = time_utils.rounddown_300(_time.hour * 60 * 60 + _time.minute * 60 + _time.second)
-        req = None
-        s = requests.Session()
-        for i in range(6):
-            hour = int(time_round / (60 * 60))
-            minute = int((time_round - hour * 60 * 60) / 60) - i
-            _time = '{0:02d}{1:02d}'.format(hour, minute)
-            if (minute - 1) % 5 != 0:
-                continue
-            url = 'https://www.ssec.wisc.edu/data/geo/images/goes-16/animation_images/' + \
-                '{}_{}{}_{}_{}_conus.gif'.format(satellite, year, day, _time, conus_band)
-            try:
-                req = s.get(url, headers={'User-Agent': self.config_dict.user_agent})
-            except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
-                    urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
-                    requests.exceptions.HTTPError):
-                self.connection_alert.set()
-                return None
-        target_path = os.path.abspath(os.path.join(self.weather_directory, r'cloud-img.gif'))
-        with open(target_path, 'wb') as file:
-            file.write(req.content)
-
-        if os.stat(target_path).st_size <= 2000:
+        try:
+            percent_cover = self.clouds.update()
+        except (urllib3.exceptions.MaxRetryError, urllib3.exceptions.HTTPError, urllib3.exceptions.TimeoutError,
+                urllib3.exceptions.InvalidHeader, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.connection_alert.set()
+            return None
+        self.cloud_percent = percent_cover
+        if percent_cover is None:
             logging.error('Cloud coverage image cannot be retrieved')
             return False
-
-        img = Image.open(target_path)
-        img_array = np.array(img)
-        img_array = img_array.astype('float64')
-        # fairfax coordinates ~300, 1350
-        img_internal = img_array[295:335, 1340:1380]
-        img_small = Image.fromarray(img_internal)
-        px = img_small.size[0] * img_small.size[1]
-        colors = img_small.getcolors()
-        clouds = [color for color in colors if color[1] > 50]
-        percent_cover = sum([cloud[0] for cloud in clouds]) / px * 100
-        img.close()
-        img_small.close()
         if percent_cover >= self.config_dict.cloud_cover_limit:
             return True
         else:
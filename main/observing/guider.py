@@ -4,13 +4,18 @@ import os
 import numpy as np
 
 from ..controller.hardware import Hardware
+from ..controller.analysis_service import AnalysisService
 from ..common.IO import config_reader
 from ..common.util import filereader_utils
 
 
 class Guider(Hardware):
+
+    correlation_size = 1024         # Side in pixels of the central square that correlation guiding registers
+    correlation_binning = 2         # Pixels on a side summed together before registering, for speed and signal
+    minimum_correlation = 0.2       # Lowest correlation peak that is trusted; unrelated fields give about 0.06
     
-    def __init__(self, camera_obj, telescope_obj):
+    def __init__(self, camera_obj, telescope_obj, analysis_obj):
         """
         Description
         ------------
@@ -22,6 +27,8 @@ class Guider(Hardware):
             Described in controller/camera.py.  Used for finding stars in images.
         telescope_obj : CLASS INSTANCE OBJECT of Telescope
             Described in controller/telescope.py.  Used for adjusting the telescsope.
+        analysis_obj : CLASS INSTANCE OBJECT of AnalysisService
+            Described in controller/analysis_service.py.  Finds the stars in each image, ahead of any other analysis.
 
         Returns
         -------
@@ -30,6 +37,7 @@ class Guider(Hardware):
         """
         self.camera = camera_obj
         self.telescope = telescope_obj
+        self.analysis = analysis_obj
         self.config_dict = config_reader.get_config()
         self.guiding = threading.Event()
         self.loop_done = threading.Event()
@@ -70,7 +78,11 @@ class Guider(Hardware):
             Tuple with x-coordinate and y-coordinate of the star in the image.
 
         """
-        stars, peaks = filereader_utils.findstars(path, self.config_dict.saturation, subframe=subframe)
+        try:
+            stars, peaks = self.analysis.submit(AnalysisService.guiding, filereader_utils.findstars, path,
+                                                self.config_dict.saturation, subframe=subframe).result()
+        except AnalysisService.dropped:
+            return None
         if not subframe:
             i = 1
             j = 0
@@ -122,12 +134,75 @@ class Guider(Hardware):
         newest_image = max(paths, key=os.path.getctime)
         return newest_image
     
+    def _jog(self, xdistance, ydistance):
+        """
+        Description
+        -----------
+        Jogs the telescope to bring the field back to where it was, after it has drifted by xdistance and ydistance
+        pixels on the image.
+
+        Parameters
+        ----------
+        xdistance : FLOAT
+            Drift along the image x axis, in pixels.
+        ydistance : FLOAT
+            Drift along the image y axis, in pixels.
+
+        Returns
+        -------
+        BOOL
+            True if the telescope was adjusted, False if the drift would take a move of guider_max_move or more, in
+            which case nothing is done.
+
+        """
+        separation = np.sqrt(xdistance**2 + ydistance**2)
+        if xdistance == 0:
+            if ydistance > 0:
+                angle = (1/2)*np.pi
+            else:
+                angle = (-1/2)*np.pi
+        else:
+            angle = np.arctan(ydistance/xdistance)
+            if xdistance < 0:
+                angle += np.pi
+
+        deltangle = angle - self.config_dict.guider_angle
+        # Assumes guider angle (angle b/w RA/Dec axes and Image X/Y axes) is constant
+        if ((-1/2)*np.pi <= deltangle <= (1/2)*np.pi) or ((3/2)*np.pi <= deltangle <= 2*np.pi):
+            xdirection = 'right'
+        else:
+            xdirection = 'left'
+        if 0 <= deltangle <= np.pi:
+            ydirection = 'down'
+        else:
+            ydirection = 'up'
+        xjog_distance = abs(separation * np.cos(deltangle)) * self.config_dict.plate_scale * \
+            self.config_dict.guider_ra_dampening
+        yjog_distance = abs(separation * np.sin(deltangle)) * self.config_dict.plate_scale * \
+            self.config_dict.guider_dec_dampening
+        jog_separation = np.sqrt(xjog_distance**2 + yjog_distance**2)
+        if jog_separation >= self.config_dict.guider_max_move:
+            return False
+        logging.debug('Guider is making an adjustment')
+        logging.debug('xdistance: {}\"; ydistance: {}\"'.format(xjog_distance, yjog_distance))
+        logging.debug('Delta Angle: {} rad'.format(deltangle))
+        logging.debug('Separation: {} px'.format(separation))
+        logging.debug('Move Direction: {} {}'.format(xdirection, ydirection))
+        logging.debug('Plate Scale: {}\"/px'.format(self.config_dict.plate_scale))
+        logging.debug('RA Dampening: {}x'.format(self.config_dict.guider_ra_dampening))
+        logging.debug('Dec Dampening: {}x\n'.format(self.config_dict.guider_dec_dampening))
+        self.telescope.onThread(self.telescope.jog, xdirection, xjog_distance)
+        self.telescope.slew_done.wait()
+        self.telescope.onThread(self.telescope.jog, ydirection, yjog_distance)
+        self.telescope.slew_done.wait()
+        return True
+
     def guiding_procedure(self, image_path):
         """
         Description
         -----------
         The guiding procedure.  Finds the guide star after each new image and pulse guides the telescope
-        if the star has moved too far.
+        if the star has moved too far.  If guider_method is 'correlation', runs correlation_procedure instead.
 
         Parameters
         ----------
@@ -139,6 +214,9 @@ class Guider(Hardware):
         None.
 
         """
+        if self.config_dict.guider_method == 'correlation':
+            self.correlation_procedure(image_path)
+            return
         self.guiding.set()
         x_initial = 0
         y_initial = 0
@@ -176,55 +254,66 @@ class Guider(Hardware):
             logging.debug('Guide star relative coordinates: x={}, y={}'.format(x, y))
             logging.debug('Guide star absolute coordinates: x={}, y={}'.format(x_initial, y_initial))
             separation = np.sqrt((x - x_0)**2 + (y - y_0)**2)
-            if separation >= self.config_dict.guiding_threshold:
-                xdistance = x - x_0
-                ydistance = y - y_0
-                if xdistance == 0:
-                    if ydistance > 0:
-                        angle = (1/2)*np.pi
-                    else:
-                        angle = (-1/2)*np.pi
-                else:
-                    angle = np.arctan(ydistance/xdistance)
-                    if xdistance < 0:
-                        angle += np.pi
-
-                deltangle = angle - self.config_dict.guider_angle
-                # Assumes guider angle (angle b/w RA/Dec axes and Image X/Y axes) is constant
-                if ((-1/2)*np.pi <= deltangle <= (1/2)*np.pi) or ((3/2)*np.pi <= deltangle <= 2*np.pi):
-                    xdirection = 'right'
-                else:
-                    xdirection = 'left'
-                if 0 <= deltangle <= np.pi:
-                    ydirection = 'down'
-                else:
-                    ydirection = 'up'
-                xjog_distance = abs(separation * np.cos(deltangle)) * self.config_dict.plate_scale * \
-                    self.config_dict.guider_ra_dampening
-                yjog_distance = abs(separation * np.sin(deltangle)) * self.config_dict.plate_scale * \
-                    self.config_dict.guider_dec_dampening
-                jog_separation = np.sqrt(xjog_distance**2 + yjog_distance**2)
-                if jog_separation >= self.config_dict.guider_max_move:
-                    logging.warning('Guide star has moved substantially between images...If the telescope did not move '
-                                    'suddenly, the guide star most likely has become saturated and the guider has '
-                                    'picked a new star.')
-                    # Changes initial absolute coordinates to match the "new" guide star
-                    new_star = self.find_guide_star(newest_image)
-                    x_initial = new_star[0]
-                    y_initial = new_star[1]
-                elif jog_separation < self.config_dict.guider_max_move:
-                    logging.debug('Guider is making an adjustment')
-                    logging.debug('xdistance: {}\"; ydistance: {}\"'.format(xjog_distance, yjog_distance))
-                    logging.debug('Delta Angle: {} rad'.format(deltangle))
-                    logging.debug('Separation: {} px'.format(separation))
-                    logging.debug('Move Direction: {} {}'.format(xdirection, ydirection))
-                    logging.debug('Plate Scale: {}\"/px'.format(self.config_dict.plate_scale))
-                    logging.debug('RA Dampening: {}x'.format(self.config_dict.guider_ra_dampening))
-                    logging.debug('Dec Dampening: {}x\n'.format(self.config_dict.guider_dec_dampening))
-                    self.telescope.onThread(self.telescope.jog, xdirection, xjog_distance)
-                    self.telescope.slew_done.wait()
-                    self.telescope.onThread(self.telescope.jog, ydirection, yjog_distance)
-                    self.telescope.slew_done.wait()
+            if separation >= self.config_dict.guiding_threshold and not self._jog(x - x_0, y - y_0):
+                logging.warning('Guide star has moved substantially between images...If the telescope did not move '
+                                'suddenly, the guide star most likely has become saturated and the guider has '
+                                'picked a new star.')
+                # Changes initial absolute coordinates to match the "new" guide star
+                new_star = self.find_guide_star(newest_image)
+                x_initial = new_star[0]
+                y_initial = new_star[1]
+            self.loop_done.set()
+
+    def correlation_procedure(self, image_path):
+        """
+        Description
+        -----------
+        Guides without a guide star.  The first image after guiding starts is the reference, and every later image
+        is registered against it with FFT phase correlation (filereader_utils.frame_offset), which measures the
+        drift of the whole field to a fraction of a pixel.  Since every star in the field contributes, a star that
+        saturates or fades does not throw the guider off, and there is no star to lose.  Images that do not match
+        the reference, i.e. behind thick clouds, are skipped.
+
+        Parameters
+        ----------
+        image_path : STR
+            Path to the folder where images are saved.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.guiding.set()
+        reference = None
+        while self.guiding.isSet():
+            self.camera.image_done.wait(timeout=30*60)
+            self.loop_done.clear()
+            newest_image = self.find_newest_image(image_path)
+            if reference is None:
+                reference = newest_image
+                logging.info('Guider is using {} as its reference image'.format(reference))
+                self.loop_done.set()
+                continue
+            try:
+                (x, y, peak) = self.analysis.submit(AnalysisService.guiding, filereader_utils.frame_offset,
+                                                    newest_image, reference, size=self.correlation_size,
+                                                    binning=self.correlation_binning).result()
+            except AnalysisService.dropped:
+                self.loop_done.set()
+                continue
+            if peak < self.minimum_correlation:
+                logging.warning('Guider image does not match the reference image (correlation {:.2f})...waiting for '
+                                'next image to try again.'.format(peak))
+                self.loop_done.set()
+                continue
+            logging.debug('Field offset from the reference image: x={:.2f}, y={:.2f} px'.format(x, y))
+            separation = np.sqrt(x**2 + y**2)
+            if separation >= self.config_dict.guiding_threshold and not self._jog(x, y):
+                logging.warning('Field has moved substantially between images...If the telescope did not move '
+                                'suddenly, the reference image is out of date.  Using the newest image as the new '
+                                'reference.')
+                reference = newest_image
             self.loop_done.set()
 
     def stop_guiding(self):
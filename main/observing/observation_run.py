@@ -8,12 +8,15 @@ import subprocess
 
 from ..common.util import time_utils, conversion_utils
 from ..common.IO import config_reader
+from ..common.IO.frame_buffer import FrameBuffer
 from ..common.datatype import filter_wheel
 from ..controller.camera import Camera
 from ..controller.telescope import Telescope
 from ..controller.dome import Dome
 from ..controller.focuser_control import Focuser
 from ..controller.focuser_procedures import FocusProcedures
+from ..controller.focus_reporter import FocusReporter
+from ..controller.analysis_service import AnalysisService
 from ..controller.flatfield_lamp import FlatLamp
 from ..controller.focuser_gui import Gui
 from .calibration import Calibration
@@ -22,7 +25,8 @@ from .condition_checker import Conditions
 
 
 class ObservationRun:
-    def __init__(self, observation_request_list, image_directory, shutdown_toggle, calibration_toggle, focus_toggle):
+    def __init__(self, observation_request_list, image_directory, shutdown_toggle, calibration_toggle, focus_toggle,
+                 filter_path=None, backlash_path=None):
         """
         Initializes the observation run.
 
@@ -39,6 +43,12 @@ class ObservationRun:
             file.
         focus_toggle : BOOL
             Whether or not to focus on each target before beginning the observation.
+        filter_path : STR, optional
+            Path to the filter wheel config file, where measured filter focus offsets are saved.  The default is None,
+            which never measures them.
+        backlash_path : STR, optional
+            Path to the general config file.  If given, the focuser backlash is measured after the first successful
+            startup focus and saved there.  The default is None, which never measures it.
 
         Returns
         -------
@@ -53,10 +63,15 @@ class ObservationRun:
         self.calibration_toggle = calibration_toggle
         self.focus_toggle = focus_toggle
         self.continuous_focus_toggle = True
+        self.filter_path = filter_path
+        self.backlash_path = backlash_path
+        self.focus_filter = None
+        # Filter that the current focuser position is for, so that filter focus offsets can be applied
         self.tz = observation_request_list[0].start_time.tzinfo
 
         # Initializes all relevant hardware
-        self.camera = Camera()
+        self.frame_buffer = FrameBuffer()
+        self.camera = Camera(self.frame_buffer)
         self.telescope = Telescope()
         self.dome = Dome()
         self.focuser = Focuser()
@@ -64,22 +79,28 @@ class ObservationRun:
         self.flatlamp = FlatLamp()
 
         # Initializes higher level structures - focuser, guider, and calibration
-        self.focus_procedures = FocusProcedures(self.focuser, self.camera, self.conditions)
-        self.calibration = Calibration(self.camera, self.flatlamp, self.image_directories)
-        self.guider = Guider(self.camera, self.telescope)
+        self.focus_reporter = FocusReporter()
+        self.analysis = AnalysisService(frame_buffer=self.frame_buffer)
+        self.focus_procedures = FocusProcedures(self.focuser, self.camera, self.conditions, self.analysis,
+                                                self.focus_reporter)
+        self.calibration = Calibration(self.camera, self.flatlamp, self.analysis, self.image_directories)
+        self.guider = Guider(self.camera, self.telescope, self.analysis)
         self.gui = Gui(self.focuser, self.focus_procedures, focus_toggle)
 
         # Initializes config objects
-        self.filterwheel_dict = filter_wheel.get_filter().filter_position_dict()
+        self.filter_wheel = filter_wheel.get_filter()
+        self.filterwheel_dict = self.filter_wheel.filter_position_dict()
         self.config_dict = config_reader.get_config()
 
         # Starts the threads
-        self.focuser.start()        # Must be started first so that it may check all available COM ports for robofocus
+        self.focuser.start()
         self.conditions.start()
         self.camera.start()
         self.telescope.start()
         self.dome.start()
         self.focus_procedures.start()
+        self.focus_reporter.start()
+        self.analysis.start()
         self.flatlamp.start()
         self.calibration.start()
         self.guider.start()
@@ -141,6 +162,8 @@ class ObservationRun:
                         return False
                     time.sleep(self.config_dict.weather_freq * 60)
                 logging.info('The Sun should now be setting again...observing will resume shortly.')
+                self.conditions.request_check()
+                # The last check may be up to weather_freq_max old, from before sunset
 
             else:
                 while self.conditions.weather_alert.isSet():
@@ -148,7 +171,8 @@ class ObservationRun:
                     current_time = datetime.datetime.now(self.tz)
                     if current_time > self.observation_request_list[-1].end_time:
                         return False
-                    time.sleep(self.config_dict.weather_freq * 60)
+                    time.sleep(self.conditions.next_reopen_check())
+                    self.conditions.request_check()
 
             if not self.conditions.weather_alert.isSet():
                 check = True
@@ -354,6 +378,51 @@ class ObservationRun:
         self.focus_procedures.onThread(self.focus_procedures.startup_focus_procedure, focus_exposure,
                                        self.filterwheel_dict[focus_filter], self.image_directories[ticket])
         self.focus_procedures.focused.wait()
+        self.focus_filter = focus_filter
+        if self.backlash_path and self.focus_procedures.v_curve is not None:
+            self.focus_procedures.onThread(self.focus_procedures.backlash_procedure, focus_exposure,
+                                           self.filterwheel_dict[focus_filter], self.image_directories[ticket],
+                                           self.backlash_path)
+            self.focus_procedures.backlash_measured.wait()
+            self.backlash_path = None
+        filters = [str(f) for f in ticket.filter] if type(ticket.filter) is list else [focus_filter]
+        missing = [f for f in dict.fromkeys(filters) if self.filter_wheel.focus_offset(f) is None]
+        if len(set(filters)) > 1 and missing and self.filter_path:
+            logging.info('Measuring the focus offsets of filters {}'.format(', '.join(missing)))
+            offset_filters = {f: self.filterwheel_dict[f] for f in [focus_filter] + missing}
+            self.focus_procedures.onThread(self.focus_procedures.filter_offsets_procedure, focus_exposure,
+                                           offset_filters, self.image_directories[ticket], self.filter_path)
+            self.focus_procedures.offsets_measured.wait()
+
+    def change_filter(self, _filter):
+        """
+        Description
+        -----------
+        Applies the focus offset of the next filter, if both it and the filter that the focuser is currently focused
+        for have been measured.  The filter wheel and the focuser move at the same time, and the move is finished
+        before the next exposure.  Must be called right before each exposure.  Does nothing while continuous focusing
+        is off, i.e. after the focuser failed to connect.
+
+        Parameters
+        ----------
+        _filter : STR
+            Name of the filter of the next exposure.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not self.continuous_focus_toggle:
+            return
+        if self.focus_filter is not None and _filter != self.focus_filter:
+            offset = self.filter_wheel.focus_offset(_filter)
+            current_offset = self.filter_wheel.focus_offset(self.focus_filter)
+            if offset is not None and current_offset is not None:
+                self.camera.onThread(self.camera.set_filter, self.filterwheel_dict[_filter])
+                self.focus_procedures.request_move(offset - current_offset, correction=False)
+                self.focus_filter = _filter
+        self.focus_procedures.apply_correction()
 
     def run_ticket(self, ticket):
         """
@@ -372,7 +441,8 @@ class ObservationRun:
             observation ticket.
         """
         if self.continuous_focus_toggle:
-            self.focus_procedures.onThread(self.focus_procedures.constant_focus_procedure)
+            self.focus_procedures.onThread(self.focus_procedures.constant_focus_procedure,
+                                           self.image_directories[ticket])
         ticket.exp_time = [ticket.exp_time] if type(ticket.exp_time) in (int, float) else ticket.exp_time
         ticket.filter = [ticket.filter] if type(ticket.filter) is str else ticket.filter
         if ticket.self_guide:
@@ -463,6 +533,7 @@ class ObservationRun:
                 image_name = "{0:s}_{1:.3f}s_{2:s}-{3:04d}.fits".format(name, current_exp, str(current_filter).upper(),
                                                                         image_base[current_filter])
 
+            self.change_filter(current_filter)
             self.camera.onThread(self.camera.expose,
                                  current_exp, self.filterwheel_dict[current_filter],
                                  os.path.join(path, image_name), "light")
@@ -526,7 +597,7 @@ class ObservationRun:
                 self.guider.stop_guiding()
                 self.guider.onThread(self.guider.stop)
                 time.sleep(5)
-                self.guider = Guider(self.camera, self.telescope)
+                self.guider = Guider(self.camera, self.telescope, self.analysis)
                 self.guider.start()
                 time.sleep(5)
                 self.guider.onThread(self.guider.guiding_procedure,
@@ -609,9 +680,12 @@ class ObservationRun:
         self.dome.onThread(self.dome.stop)
         self.focuser.onThread(self.focuser.stop)
         self.focus_procedures.stop()
+        self.focus_reporter.onThread(self.focus_reporter.stop)
         self.guider.stop()
         self.flatlamp.onThread(self.flatlamp.stop)
         self.calibration.onThread(self.calibration.stop)
+        self.analysis.stop()
+        self.frame_buffer.close()
         time.sleep(5)
 
     def _shutdown_procedure(self, calibration, cooler=True):
@@ -0,0 +1,282 @@
+# Weather radar precipitation nowcasting
+import io
+import logging
+import collections
+import numpy as np
+
+from PIL import Image
+from scipy import ndimage
+
+from ..common.util import conversion_utils, registration_utils
+from ..common.IO import config_reader
+
+
+class Radar:
+
+    tile_size = 256
+    rain_threshold = 10         # Distance-weighted percentage of radar_radius covered by rain to count as nearby rain
+    core_fraction = 0.25        # Rain within this fraction of radar_radius counts as having reached the site
+    minimum_correlation = 0.05  # Weakest phase correlation peak that is trusted as rain motion
+    echo_threshold = 0.3        # Lowest intensity of a rain echo, so faint and antialiased edge pixels are ignored
+    minimum_echo_area = 10      # Area in km^2 of the smallest patch of echo pixels that counts as rain
+    max_frames = 4
+
+    def __init__(self, http_session):
+        """
+        Description
+        -----------
+        Checks the weather.com radar mosaic around the site.  The tiles covering radar_radius around the site are
+        worked out from the site latitude and longitude, cached by timestamp, and analyzed as NumPy arrays.  The
+        motion of the rain between consecutive radar frames is used to predict when rain will reach the site.
+
+        Parameters
+        ----------
+        http_session : CLASS INSTANCE OBJECT of CachedSession
+            From http_cache, shared with the condition checker.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.http = http_session
+        self.config_dict = config_reader.get_config()
+        self.tiles = collections.OrderedDict()
+        # Tile intensities by (timestamp, x, y), oldest first
+        self.history = collections.deque(maxlen=12)
+        # (timestamp, percent coverage, minutes until arrival) for the most recent frames
+        self.velocity = None
+        zoom = self.config_dict.radar_zoom
+        (tile_x, tile_y) = conversion_utils.get_tile_coordinates(self.config_dict.site_latitude,
+                                                                 self.config_dict.site_longitude, zoom)
+        (site_x, site_y) = (tile_x * self.tile_size, tile_y * self.tile_size)
+        meters_per_pixel = 40075016.686 * np.cos(np.radians(self.config_dict.site_latitude)) / \
+            (self.tile_size * 2**zoom)
+        self.radius = self.config_dict.radar_radius * 1000 / meters_per_pixel
+        self.km_per_pixel = meters_per_pixel / 1000
+        self.minimum_echo_pixels = max(3, int(round(self.minimum_echo_area / self.km_per_pixel**2)))
+        self.x_range = range(int((site_x - self.radius) // self.tile_size),
+                             int((site_x + self.radius) // self.tile_size) + 1)
+        self.y_range = range(int((site_y - self.radius) // self.tile_size),
+                             int((site_y + self.radius) // self.tile_size) + 1)
+        self.site = (site_y - self.y_range[0] * self.tile_size, site_x - self.x_range[0] * self.tile_size)
+        # Row and column of the site on the stitched mosaic
+        (rows, columns) = np.ogrid[0:len(self.y_range) * self.tile_size, 0:len(self.x_range) * self.tile_size]
+        distance = np.hypot(rows - self.site[0], columns - self.site[1])
+        self.weights = np.clip(1 - distance / self.radius, 0, 1).astype(np.float32)
+        logging.debug('Radar tiles x={}, y={} at zoom {} cover the site'.format(list(self.x_range),
+                                                                                list(self.y_range), zoom))
+
+    def tile_url(self, timestamp, x, y, api_key):
+        """
+        Parameters
+        ----------
+        timestamp : INT
+            Epoch seconds of the radar frame, a multiple of 300.
+        x : INT
+            Tile column.
+        y : INT
+            Tile row.
+        api_key : STR
+            weather.com API key.
+
+        Returns
+        -------
+        STR
+            Url of the radar tile, from the radar_tile_url template.
+
+        """
+        return self.config_dict.radar_tile_url.format(timestamp=timestamp, x=x, y=y, zoom=self.config_dict.radar_zoom,
+                                                      api_key=api_key)
+
+    def _decode_tile(self, content):
+        """
+        Parameters
+        ----------
+        content : BYTES
+            Raw PNG radar tile.
+
+        Returns
+        -------
+        NUMPY.NDARRAY
+            float32 rain intensity between 0 and 1 for each pixel of the tile.  Transparent tiles use their alpha
+            channel, otherwise any pixel that is not the background color counts as rain.
+
+        """
+        with Image.open(io.BytesIO(content)) as img:
+            if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+                alpha = np.asarray(img.convert('RGBA'))[:, :, 3]
+                return alpha.astype(np.float32) / 255
+            values = np.asarray(img.convert('L'))
+        background = np.argmax(np.bincount(values.ravel(), minlength=256))
+        return (values != background).astype(np.float32)
+
+    def frame(self, timestamp, api_key):
+        """
+        Parameters
+        ----------
+        timestamp : INT
+            Epoch seconds of the radar frame, a multiple of 300.
+        api_key : STR
+            weather.com API key.
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            Connection and HTTP errors are passed on to the condition checker.
+
+        Returns
+        -------
+        NUMPY.NDARRAY
+            Stitched float32 rain intensity mosaic around the site.  Only tiles that are not already cached are
+            downloaded.
+
+        """
+        rows = []
+        for y in self.y_range:
+            row = []
+            for x in self.x_range:
+                key = (timestamp, x, y)
+                if key not in self.tiles:
+                    (entry, changed) = self.http.get(self.tile_url(timestamp, x, y, api_key), cache=False)
+                    self.tiles[key] = self._decode_tile(entry.content)
+                row.append(self.tiles[key])
+            rows.append(np.hstack(row))
+        while len(self.tiles) > self.max_frames * len(self.x_range) * len(self.y_range):
+            self.tiles.popitem(last=False)
+        return np.vstack(rows)
+
+    def coverage(self, frame):
+        """
+        Parameters
+        ----------
+        frame : NUMPY.NDARRAY
+            Rain intensity mosaic from self.frame.
+
+        Returns
+        -------
+        FLOAT
+            Percentage of the area within radar_radius covered by rain, weighted by intensity and by distance from
+            the site.
+
+        """
+        return float(np.sum(frame * self.weights) / np.sum(self.weights) * 100)
+
+    def motion(self, previous, current, minutes):
+        """
+        Parameters
+        ----------
+        previous : NUMPY.NDARRAY
+            Earlier rain intensity mosaic.
+        current : NUMPY.NDARRAY
+            Later rain intensity mosaic.
+        minutes : FLOAT
+            Time between the two mosaics, in minutes.
+
+        Returns
+        -------
+        TUPLE
+            Rain velocity as (rows per minute, columns per minute) on the mosaic, or None if there is not enough rain
+            in both frames to measure it.
+
+        """
+        if not (np.any(previous) and np.any(current)):
+            return None
+        (dy, dx, peak) = registration_utils.phase_correlation(previous, current)
+        if peak < self.minimum_correlation:
+            return None
+        return dy / minutes, dx / minutes
+
+    def echoes(self, frame):
+        """
+        Parameters
+        ----------
+        frame : NUMPY.NDARRAY
+            Rain intensity mosaic from self.frame.
+
+        Returns
+        -------
+        NUMPY.NDARRAY
+            True for every pixel of a rain echo: at least echo_threshold intense, in a connected patch of at least
+            minimum_echo_area.  Stray pixels and thin antialiased edges do not count.
+
+        """
+        mask = frame >= self.echo_threshold
+        (labels, count) = ndimage.label(mask)
+        if not count:
+            return mask
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        return (sizes >= self.minimum_echo_pixels)[labels]
+
+    def time_to_arrival(self, frame, velocity):
+        """
+        Parameters
+        ----------
+        frame : NUMPY.NDARRAY
+            Current rain intensity mosaic.
+        velocity : TUPLE
+            Rain velocity from self.motion.
+
+        Returns
+        -------
+        FLOAT
+            Minutes until the nearest rain echo on its current course reaches the site, 0 if an echo is already at
+            the site, or None if no rain is headed for the site.
+
+        """
+        (rows, columns) = np.nonzero(self.echoes(frame))
+        if len(rows) == 0:
+            return None
+        dy = rows - self.site[0]
+        dx = columns - self.site[1]
+        core = (self.core_fraction * self.radius)**2
+        distance_2 = dy**2 + dx**2
+        if np.any(distance_2 <= core):
+            return 0.0
+        if velocity is None:
+            return None
+        (vy, vx) = velocity
+        speed_2 = vy**2 + vx**2
+        if speed_2 < 1e-6:
+            return None
+        # Time of closest approach of each rain pixel to the site, and how close it gets
+        closest = -(dy * vy + dx * vx) / speed_2
+        miss_2 = distance_2 - closest**2 * speed_2
+        hits = (closest > 0) & (miss_2 <= core)
+        if not np.any(hits):
+            return None
+        arrival = closest[hits] - np.sqrt(core - miss_2[hits]) / np.sqrt(speed_2)
+        return float(np.min(arrival))
+
+    def update(self, timestamp, api_key):
+        """
+        Parameters
+        ----------
+        timestamp : INT
+            Epoch seconds of the newest radar frame, a multiple of 300.
+        api_key : STR
+            weather.com API key.
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            Connection and HTTP errors are passed on to the condition checker.
+
+        Returns
+        -------
+        percent_coverage : FLOAT
+            Distance-weighted rain coverage around the site.
+        arrival : FLOAT
+            Minutes until rain is predicted to reach the site, or None if no rain is headed for the site.
+
+        """
+        current = self.frame(timestamp, api_key)
+        previous = self.frame(timestamp - 300, api_key)
+        self.velocity = self.motion(previous, current, 5)
+        percent_coverage = self.coverage(current)
+        arrival = self.time_to_arrival(current, self.velocity)
+        if self.velocity:
+            logging.debug('Rain is moving at {:.1f} km/h'.format(np.hypot(*self.velocity) * self.km_per_pixel * 60))
+        self.history.append((timestamp, percent_coverage, arrival))
+        return percent_coverage, arrival
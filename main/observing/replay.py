@@ -0,0 +1,272 @@
+# Weather trace replay
+import os
+import csv
+import copy
+import json
+import logging
+import datetime
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from ..common.util import time_utils, conversion_utils
+from ..common.IO import weather_store
+from .condition_checker import Conditions
+
+
+def load_trace(path, latitude=None, longitude=None):
+    """
+    Parameters
+    ----------
+    path : STR
+        Recorded conditions to replay.  Either a WeatherStore SQLite file (.sqlite or .db), a CSV file with a header
+        row, or a JSON file holding a list of objects (or an object with that list under 'readings').  CSV and JSON
+        traces need a 'time' column, in epoch seconds or any date string, and any of the WeatherStore columns.
+    latitude : FLOAT, optional
+        Site latitude, only needed if the trace has no sun_elevation column.
+    longitude : FLOAT, optional
+        Site longitude, only needed if the trace has no sun_elevation column.
+
+    Returns
+    -------
+    DICT
+        'time' and every WeatherStore column as float NumPy arrays, in time order.  Missing readings are NaN.
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.sqlite', '.db'):
+        store = weather_store.WeatherStore(path)
+        trace = store.query(0)
+        store.close()
+    else:
+        with open(path, 'r', newline='') as file:
+            if extension == '.json':
+                rows = json.load(file)
+                rows = rows['readings'] if isinstance(rows, dict) else rows
+            else:
+                rows = list(csv.DictReader(file))
+        trace = {'time': np.array([_epoch_seconds(row['time']) for row in rows], dtype=float)}
+        for column in weather_store.WeatherStore.columns:
+            trace[column] = np.array([_float_or_nan(row.get(column)) for row in rows], dtype=float)
+        order = np.argsort(trace['time'], kind='stable')
+        trace = {key: values[order] for (key, values) in trace.items()}
+    if len(trace['time']) and np.all(np.isnan(trace['sun_elevation'])):
+        if latitude is None or longitude is None:
+            raise ValueError('The site coordinates are needed to replay a trace without sun elevations')
+        trace['sun_elevation'] = _sun_elevations(trace['time'], latitude, longitude)
+    return trace
+
+
+def _epoch_seconds(value):
+    """
+    Parameters
+    ----------
+    value : STR, INT, or FLOAT
+        Epoch seconds, or a date string.  Date strings without a timezone are taken as UTC.
+
+    Returns
+    -------
+    FLOAT
+        Epoch seconds.
+
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return time_utils.convert_to_datetime_utc(value).timestamp()
+
+
+def _float_or_nan(value):
+    """
+    Parameters
+    ----------
+    value : STR, INT, FLOAT, or None
+        A single reading from a trace file.
+
+    Returns
+    -------
+    FLOAT
+        The reading, or NaN if it is missing.
+
+    """
+    if value is None or value == '':
+        return np.nan
+    return float(value)
+
+
+def _sun_elevations(times, latitude, longitude, step=600):
+    """
+    Parameters
+    ----------
+    times : NUMPY.NDARRAY
+        Epoch seconds of each reading.
+    latitude : FLOAT
+        Site latitude.
+    longitude : FLOAT
+        Site longitude.
+    step : INT, optional
+        Seconds between the times that the Sun position is actually computed at.  The default is 600.
+
+    Returns
+    -------
+    NUMPY.NDARRAY
+        Sun elevation at each time in degrees, interpolated from a coarse grid since astropy is slow.
+
+    """
+    grid = np.arange(np.floor(times[0] / step) * step, times[-1] + 2 * step, step)
+    elevations = [conversion_utils.get_sun_elevation(datetime.datetime.fromtimestamp(t, datetime.timezone.utc),
+                                                     latitude, longitude) for t in grid]
+    return np.interp(times, grid, elevations)
+
+
+def _readings(trace, index):
+    """
+    Parameters
+    ----------
+    trace : DICT
+        From load_trace.
+    index : INT
+        Row of the trace.
+
+    Returns
+    -------
+    DICT
+        The readings of that row by WeatherStore column, with None for missing readings.
+
+    """
+    return {column: (None if np.isnan(trace[column][index]) else float(trace[column][index]))
+            for column in weather_store.WeatherStore.columns}
+
+
+def replay(trace, config_dict):
+    """
+    Description
+    -----------
+    Runs a recorded trace through the Conditions decision logic (evaluate and check_interval) on a virtual clock,
+    along with the hold/reopen logic of ObservationRun.everything_ok: after an alert the observatory stays closed for
+    at least min_reopen_time minutes, then reopens at the first check that comes back clear.  Each check sees the
+    newest trace row at its virtual time.  The radar arrival forecast and cloud clearing forecast need the images
+    themselves, so they are not replayed.
+
+    Parameters
+    ----------
+    trace : DICT
+        From load_trace.
+    config_dict : CLASS INSTANCE OBJECT of Config
+        Settings to replay the trace with.
+
+    Returns
+    -------
+    DICT
+        open_hours : hours open while the Sun was down.
+        dark_hours : hours with the Sun down.
+        clear_dark_hours : hours with the Sun down and conditions within the limits.
+        lost_dark_hours : hours with the Sun down and conditions within the limits, but closed.
+        closures : number of closures for anything other than the Sun.
+        checks : number of condition checks.
+        mean_reopen_latency : mean minutes from conditions clearing to reopening, or None.
+        max_reopen_latency : longest minutes from conditions clearing to reopening, or None.
+
+    """
+    times = trace['time']
+    store = weather_store.WeatherStore(':memory:')
+    segments = []
+    # (start, end, open) spans of the virtual night
+    reopens = []
+    (is_open, segment_start, hold_until, last_rain) = (True, times[0], None, None)
+    (closures, checks) = (0, 0)
+    now = times[0]
+    while now <= times[-1]:
+        readings = _readings(trace, np.searchsorted(times, now, side='right') - 1)
+        store.append(now, **readings)
+        reasons = Conditions.evaluate(config_dict, store, readings, last_rain, now=now)
+        last_rain = readings['rain']
+        checks += 1
+        if is_open and reasons:
+            segments.append((segment_start, now, True))
+            (is_open, segment_start) = (False, now)
+            hold_until = now + config_dict.min_reopen_time * 60
+            closures += (reasons != ['Sun Elevation'])
+        interval = Conditions.check_interval(config_dict, store, bool(reasons), reasons, None, now=now)
+        if not is_open and not reasons and hold_until <= now + interval:
+            reopen = max(now, hold_until)
+            segments.append((segment_start, reopen, False))
+            reopens.append((segment_start, reopen))
+            (is_open, segment_start) = (True, reopen)
+        now += interval
+    segments.append((segment_start, max(times[-1], segment_start), is_open))
+    store.close()
+
+    durations = np.diff(np.append(times, times[-1]))
+    dark = trace['sun_elevation'] < 0
+    clear = np.array([not Conditions.evaluate(config_dict, None, _readings(trace, i), None)
+                      for i in range(len(times))], dtype=bool)
+    # Reopen latency runs from when the trace cleared (or the closure, if that was later), not the first clear check
+    clear_starts = times[np.flatnonzero(clear & ~np.concatenate(([False], clear[:-1])))]
+    latencies = [(reopen - max(closed, clear_starts[np.searchsorted(clear_starts, reopen, side='right') - 1])) / 60
+                 for (closed, reopen) in reopens if np.any(clear_starts <= reopen)]
+    ends = np.array([end for (start, end, state) in segments])
+    states = np.array([state for (start, end, state) in segments], dtype=bool)
+    open_rows = states[np.minimum(np.searchsorted(ends, times, side='right'), len(states) - 1)]
+    return {'open_hours': float(np.sum(durations[dark & open_rows]) / 3600),
+            'dark_hours': float(np.sum(durations[dark]) / 3600),
+            'clear_dark_hours': float(np.sum(durations[dark & clear]) / 3600),
+            'lost_dark_hours': float(np.sum(durations[dark & clear & ~open_rows]) / 3600),
+            'closures': int(closures), 'checks': checks,
+            'mean_reopen_latency': float(np.mean(latencies)) if latencies else None,
+            'max_reopen_latency': float(np.max(latencies)) if latencies else None}
+
+
+def _replay_settings(trace, config_dict, settings):
+    """
+    Parameters
+    ----------
+    trace : DICT
+        From load_trace.
+    config_dict : CLASS INSTANCE OBJECT of Config
+        Base settings.
+    settings : DICT
+        Config attributes to override for this replay.
+
+    Returns
+    -------
+    DICT
+        The settings followed by the results of replay.
+
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    # Trend warnings from every replayed check would drown out the results
+    config_dict = copy.copy(config_dict)
+    for (key, value) in settings.items():
+        setattr(config_dict, key, value)
+    return {**settings, **replay(trace, config_dict)}
+
+
+def replay_grid(trace, config_dict, grid, processes=None):
+    """
+    Parameters
+    ----------
+    trace : DICT
+        From load_trace.
+    config_dict : CLASS INSTANCE OBJECT of Config
+        Base settings, i.e. the global config.
+    grid : DICT
+        List of values to try for each config attribute.  Every combination is replayed.
+    processes : INT, optional
+        Number of worker processes.  The default is None, which uses one per core.
+
+    Returns
+    -------
+    LIST
+        Results of _replay_settings for every combination of settings, in the order of itertools.product.
+
+    """
+    for key in grid:
+        if not hasattr(config_dict, key):
+            raise ValueError('{} is not a config parameter'.format(key))
+    combinations = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    logging.info('Replaying {} seconds of conditions with {} settings'.format(int(np.ptp(trace['time'])),
+                                                                             len(combinations)))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_replay_settings, trace, config_dict, settings) for settings in combinations]
+        return [future.result() for future in futures]
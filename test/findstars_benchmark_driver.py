@@ -0,0 +1,172 @@
+# Time and peak memory of star detection on full frames and guider subframes
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+import photutils
+from astropy.io import fits
+from astropy.stats import sigma_clipped_stats
+
+from ..main.common.IO import config_reader
+from ..main.common.IO.json_reader import Reader
+from ..main.common.datatype.object_reader import ObjectReader
+from ..main.common.util import filereader_utils
+
+
+def synthetic_frame(path, shape, stars, seed):
+    """
+    Description
+    -----------
+    Writes a 16 bit frame with a sky background, read noise, Gaussian stars and a few hot pixels, like the ones our
+    camera saves.
+
+    Parameters
+    ----------
+    path : STR
+        Where to save the fits file.
+    shape : TUPLE
+        Rows and columns of the frame.
+    stars : INT
+        Number of stars.
+    seed : INT
+        Random seed.
+
+    Returns
+    -------
+    centers : LIST
+        (x position, y position) of every star.
+
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.normal(1000, 12, shape).astype(np.float32)
+    centers = [(int(x), int(y)) for (x, y) in zip(rng.integers(20, shape[1] - 20, stars),
+                                                  rng.integers(20, shape[0] - 20, stars))]
+    (y, x) = np.mgrid[-15:16, -15:16]
+    for (cx, cy) in centers:
+        image[cy - 15:cy + 16, cx - 15:cx + 16] += rng.uniform(500, 20000) * np.exp(-(x**2 + y**2) / (2 * 2.5**2))
+    hot = (rng.integers(0, shape[0], stars), rng.integers(0, shape[1], stars))
+    image[hot] = 60000
+    fits.writeto(path, np.clip(image, 0, 65535).astype(np.uint16), overwrite=True)
+    return centers
+
+
+def legacy_findstars(path, saturation, subframe=None):
+    """
+    Description
+    -----------
+    The detector that findstars replaced, for comparison: the whole frame is read, sigma clipped twice, squared in
+    float64 and looped over in Python.
+
+    Returns
+    -------
+    TUPLE
+        Stars and peaks, as findstars.
+
+    """
+    image = fits.getdata(path)
+    mean, median, stdev = sigma_clipped_stats(image, sigma=3)
+    data = (image - median) ** 2
+    threshold = photutils.detect_threshold(image, nsigma=5)
+    if not subframe:
+        starfound = photutils.find_peaks(data, threshold=threshold, box_size=50, border_width=500,
+                                         centroid_func=photutils.centroids.centroid_com)
+    else:
+        config_dict = config_reader.get_config()
+        r = config_dict.guider_max_move / config_dict.plate_scale * 1.5
+        (x_cent, y_cent) = subframe
+        section = (slice(int(y_cent - r), int(y_cent + r)), slice(int(x_cent - r), int(x_cent + r)))
+        image = image[section]
+        starfound = photutils.find_peaks(data[section], threshold=threshold[section], box_size=50, border_width=10,
+                                         centroid_func=photutils.centroids.centroid_com)
+    stars = []
+    peaks = []
+    for (x_cent, y_cent) in zip(starfound['x_peak'], starfound['y_peak']):
+        peak = image[y_cent, x_cent]
+        pixels = [(y_cent, x_cent + 1), (y_cent, x_cent - 1), (y_cent + 1, x_cent), (y_cent - 1, x_cent)]
+        if peak >= (saturation * 2) ** 2 or any(image[p] < 1.2 * median for p in pixels):
+            continue
+        stars.append((x_cent, y_cent))
+        peaks.append(peak)
+    return stars, peaks
+
+
+def measure(function, repeats, cold):
+    """
+    Parameters
+    ----------
+    function : FUNCTION
+        Takes no arguments and returns the stars and peaks.
+    repeats : INT
+        Number of runs.
+    cold : BOOL
+        If True, the background statistics cache is cleared before every run.
+
+    Returns
+    -------
+    seconds : FLOAT
+        Median time per run.
+    peak : FLOAT
+        Largest memory allocated during a run, in MB.
+    stars : INT
+        Number of stars found.
+
+    """
+    times = []
+    peak = 0
+    for _ in range(repeats):
+        if cold:
+            filereader_utils._stats_cache.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+        (stars, peaks) = function()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return float(np.median(times)), peak / 2**20, len(stars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and peak memory of findstars')
+    parser.add_argument('frames', nargs='*', help='Fits frames to measure.  Defaults to a synthetic frame.')
+    parser.add_argument('--config', help='General config json file.  Defaults to config/parameters_config.json.')
+    parser.add_argument('--shape', type=int, nargs=2, default=(2048, 3072), metavar=('ROWS', 'COLUMNS'),
+                        help='Size of the synthetic frame.')
+    parser.add_argument('--stars', type=int, default=200, help='Number of stars in the synthetic frame.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    config_path = options.config or os.path.abspath(os.path.join(os.path.dirname(__file__), r'..', r'config',
+                                                                 r'parameters_config.json'))
+    ObjectReader(Reader(config_path))
+    saturation = config_reader.get_config().saturation
+    directory = tempfile.TemporaryDirectory()
+    frames = options.frames
+    if not frames:
+        frames = [os.path.join(directory.name, 'synthetic.fits')]
+        synthetic_frame(frames[0], tuple(options.shape), options.stars, options.seed)
+
+    print('{:<28s}{:>12s}{:>16s}{:>8s}'.format('', 'ms / frame', 'peak memory MB', 'stars'))
+    for path in frames:
+        print(os.path.basename(path))
+        (stars, peaks) = filereader_utils.findstars(path, saturation)
+        subframe = stars[len(stars) // 2] if stars else None
+        runs = [('legacy full frame', lambda: legacy_findstars(path, saturation), False),
+                ('findstars full frame', lambda: filereader_utils.findstars(path, saturation), True),
+                ('findstars, cached stats', lambda: filereader_utils.findstars(path, saturation), False)]
+        if subframe:
+            runs += [('legacy subframe', lambda: legacy_findstars(path, saturation, subframe), False),
+                     ('findstars subframe', lambda: filereader_utils.findstars(path, saturation, subframe), True),
+                     ('findstars subframe, cached', lambda: filereader_utils.findstars(path, saturation, subframe),
+                      False)]
+        for (name, function, cold) in runs:
+            (seconds, peak, n) = measure(function, options.repeats, cold)
+            print('  {:<26s}{:>12.1f}{:>16.1f}{:>8d}'.format(name, seconds * 1000, peak, n))
+    directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+# Local stand-in for the weather, radar and satellite sources used by the condition checker
+import io
+import os
+import re
+import time
+import json
+import random
+import hashlib
+import argparse
+import datetime
+import tempfile
+import threading
+import urllib.parse
+import numpy as np
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from PIL import Image
+
+from ..main.common.IO import config_reader
+from ..main.common.IO.json_reader import Reader
+from ..main.common.datatype.object_reader import ObjectReader
+from ..main.common.util import conversion_utils
+
+API_KEY = 'standinkey'
+SOURCES = ('gmu', 'backup', 'radar', 'tile', 'goes', 'internet')
+
+
+class WeatherState:
+
+    def __init__(self, options, config):
+        """
+        Description
+        -----------
+        Synthetic weather served by the stand-in server.  Rain is a single storm cell that starts rain_distance km
+        west of the site and moves east at rain_speed km/h.  Clouds are a smooth random field that drifts east at
+        cloud_speed pixels per minute, thresholded to cover about clouds percent of the sky.
+
+        Parameters
+        ----------
+        options : ARGPARSE.NAMESPACE
+            Command line options of this driver.
+        config : CLASS INSTANCE OBJECT of Config
+            Global config, for the site position and the radar zoom.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.options = options
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.images = {}
+        # Generated tiles and frames by url path, since the same ones are requested every cycle
+        zoom = config.radar_zoom
+        (tile_x, tile_y) = conversion_utils.get_tile_coordinates(config.site_latitude, config.site_longitude, zoom)
+        self.site_pixel = (tile_y * 256, tile_x * 256)
+        self.km_per_pixel = 40075.016686 * np.cos(np.radians(config.site_latitude)) / (256 * 2**zoom)
+        rng = np.random.default_rng(options.seed)
+        noise = np.fft.rfft2(rng.standard_normal((1024, 2048)))
+        (ky, kx) = np.meshgrid(np.fft.fftfreq(1024), np.fft.rfftfreq(2048), indexing='ij')
+        field = np.fft.irfft2(noise * np.exp(-(ky**2 + kx**2) * 40**2 * 2), s=(1024, 2048))
+        self.cloud_field = field > np.percentile(field, 100 - options.clouds)
+
+    def page(self, source):
+        """
+        Parameters
+        ----------
+        source : STR
+            'gmu', 'backup' or 'radar'.
+
+        Returns
+        -------
+        STR
+            Html of the page, in just enough of the real layout for the condition checker to parse.  If a recorded
+            page named <source>.html exists in the recorded directory, it is served instead.
+
+        """
+        if self.options.recorded:
+            path = os.path.join(self.options.recorded, '{}.html'.format(source))
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8', errors='replace') as file:
+                    return file.read()
+        o = self.options
+        if source == 'gmu':
+            values = ['{:.1f} &deg;F'.format(o.temperature), '{:.0f}%'.format(o.humidity), '30.01 in',
+                      '{:.1f} mph'.format(o.wind), 'W', '{:.2f} in'.format(o.rain)]
+            return '<html><body>' + ''.join('<font color="#3366FF">{}</font>'.format(v) for v in values) + \
+                '</body></html>'
+        elif source == 'backup':
+            return '<html><body><span data-testid="TemperatureValue" class="temp">{:.0f}&deg;</span>' \
+                   '<span data-testid="PercentageValue" class="humidity">{:.0f}%</span>' \
+                   '<span data-testid="Wind" class="wind">W {:.0f} mph</span></body></html>'.format(
+                       o.temperature, o.humidity, o.wind)
+        return '<html><script>window.__data={{\\"SUN_V3_API_KEY_PROD\\":\\"{}\\",}}</script></html>'.format(API_KEY)
+
+    def tile(self, timestamp, x, y):
+        """
+        Parameters
+        ----------
+        timestamp : INT
+            Epoch seconds of the radar frame.
+        x : INT
+            Tile column.
+        y : INT
+            Tile row.
+
+        Returns
+        -------
+        BYTES
+            Transparent PNG radar tile, with the storm cell drawn in the alpha channel.
+
+        """
+        o = self.options
+        (rows, columns) = np.mgrid[0:256, 0:256]
+        rows = rows + y * 256 - self.site_pixel[0]
+        columns = columns + x * 256 - self.site_pixel[1]
+        distance = o.rain_distance - o.rain_speed * (timestamp - self.start) / 3600
+        # Storm center, in km west of the site
+        radius = o.rain_radius / self.km_per_pixel
+        cell = np.hypot(rows, columns + distance / self.km_per_pixel) <= radius
+        rgba = np.zeros((256, 256, 4), dtype=np.uint8)
+        rgba[cell] = (0, 160, 40, 200)
+        if o.rain_radius <= 0:
+            rgba[:] = 0
+        buffer = io.BytesIO()
+        Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def frame(self, timestamp, bounds):
+        """
+        Parameters
+        ----------
+        timestamp : DATETIME.DATETIME
+            UTC time of the satellite frame.
+        bounds : TUPLE
+            Crop box that CloudCover uses, so that the frame is made just big enough.
+
+        Returns
+        -------
+        BYTES
+            GIF frame with clouds in band 13 style brightness values.
+
+        """
+        (height, width) = (bounds[3] + 16, bounds[2] + 16)
+        shift = int(round(self.options.cloud_speed * (timestamp.timestamp() - self.start) / 60))
+        field = np.roll(self.cloud_field, shift, axis=1)
+        field = np.tile(field, (height // field.shape[0] + 1, width // field.shape[1] + 1))[:height, :width]
+        rng = np.random.default_rng(int(timestamp.timestamp()))
+        pixels = np.where(field, 200, 20) + rng.integers(0, 20, size=field.shape)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels.astype(np.uint8), 'L').save(buffer, format='GIF', optimize=False)
+        # Without optimize, the GIF keeps a plain grayscale palette so pixel values read back unchanged
+        return buffer.getvalue()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    state = None
+    bounds = None
+
+    def do_GET(self):
+        """
+        Description
+        -----------
+        Answers a request with the page, tile or frame for its path, after the configured latency.  Requests may
+        fail with a 503 at random, always fail for sources given with --fail, and revalidation with If-None-Match
+        gets a 304 when the content has not changed.
+
+        Returns
+        -------
+        None.
+
+        """
+        o = self.state.options
+        url = urllib.parse.urlparse(self.path)
+        source = url.path.strip('/').split('/')[0]
+        time.sleep(o.latency)
+        if source in o.fail or random.random() < o.failure_rate:
+            self.send_error(503, 'Stand-in failure')
+            return
+        last_modified = time.time()
+        if source in ('gmu', 'backup', 'radar'):
+            (content, content_type) = (self.state.page(source).encode('utf-8'), 'text/html; charset=utf-8')
+            if source == 'gmu':
+                last_modified -= o.stale * 60
+        elif source == 'tile':
+            query = urllib.parse.parse_qs(url.query)
+            if query.get('apiKey', [''])[0] != API_KEY:
+                self.send_error(401, 'Invalid apiKey')
+                return
+            (x, y, zoom) = (int(v) for v in query['xyz'][0].split(':'))
+            content = self._cached(url.path + '?' + url.query,
+                                   lambda: self.state.tile(int(query['ts'][0]), x, y))
+            content_type = 'image/png'
+        elif source == 'goes':
+            match = re.search(r'_(\d{7}_\d{4})_13', url.path)
+            timestamp = datetime.datetime.strptime(match.group(1), '%Y%j_%H%M').replace(
+                tzinfo=datetime.timezone.utc) if match else None
+            if timestamp is None or timestamp > datetime.datetime.now(datetime.timezone.utc):
+                self.send_error(404, 'No such frame')
+                return
+            content = self._cached(url.path, lambda: self.state.frame(timestamp, self.bounds))
+            content_type = 'image/gif'
+        elif source == 'internet':
+            (content, content_type) = (b'ok', 'text/plain')
+        else:
+            self.send_error(404, 'Unknown stand-in source')
+            return
+        etag = '"{}"'.format(hashlib.sha1(content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(last_modified, usegmt=True))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _cached(self, key, make):
+        """
+        Parameters
+        ----------
+        key : STR
+            Url path of the image.
+        make : FUNCTION
+            Makes the image if it has not been made yet.
+
+        Returns
+        -------
+        BYTES
+            The image.
+
+        """
+        with self.state.lock:
+            if key not in self.state.images:
+                self.state.images[key] = make()
+            return self.state.images[key]
+
+    def log_message(self, format, *args):
+        if self.state.options.verbose:
+            super().log_message(format, *args)
+
+
+def source_urls(port):
+    """
+    Parameters
+    ----------
+    port : INT
+        Port of the stand-in server on localhost.
+
+    Returns
+    -------
+    DICT
+        Config url parameters pointing every weather source at the stand-in server.
+
+    """
+    base = 'http://127.0.0.1:{}'.format(port)
+    return {'weather_url': base + '/gmu', 'backup_weather_url': base + '/backup', 'rain_url': base + '/radar',
+            'radar_tile_url': base + '/tile?ts={timestamp}&xyz={x}:{y}:{zoom}&apiKey={api_key}',
+            'cloud_image_url': base + '/goes/{satellite}_{timestamp:%Y%j_%H%M}_13_conus.gif',
+            'internet_check_url': base + '/internet'}
+
+
+def benchmark(config, cycles):
+    """
+    Description
+    -----------
+    Times each part of the condition checker cycle against the stand-in server.  The weather history and the saved
+    pages go to a temporary data directory, so the real weather history is left alone.
+
+    Parameters
+    ----------
+    config : CLASS INSTANCE OBJECT of Config
+        Global config, already pointing at the stand-in server.
+    cycles : INT
+        Number of check cycles to run.
+
+    Returns
+    -------
+    None.
+
+    """
+    from ..main.observing.condition_checker import Conditions
+    directory = tempfile.TemporaryDirectory()
+    config.data_directory = directory.name
+    conditions = Conditions()
+    timings = {'weather_check': [], 'rain_check': [], 'cloud_check': []}
+    for i in range(cycles):
+        for (name, check) in (('weather_check', conditions.weather_check), ('rain_check', conditions.rain_check),
+                              ('cloud_check', conditions.cloud_check)):
+            t0 = time.perf_counter()
+            result = check()
+            timings[name].append(time.perf_counter() - t0)
+            print('Cycle {} {}: {} ({:.3f} s)'.format(i + 1, name, result, timings[name][-1]))
+        print('Cycle {}: {} bytes, connection alert: {}'.format(i + 1, conditions.http.reset_byte_count(),
+                                                                 conditions.connection_alert.is_set()))
+        conditions.connection_alert.clear()
+    for (name, values) in timings.items():
+        print('{}: mean {:.3f} s, max {:.3f} s'.format(name, np.mean(values), np.max(values)))
+    conditions.store.close()
+    directory.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the condition checker weather sources')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--config', help='General config json file.  Defaults to config/parameters_config.json.')
+    parser.add_argument('--write-config', metavar='PATH', help='Write a copy of the config that uses this server.')
+    parser.add_argument('--recorded', metavar='DIR', help='Directory of recorded gmu/backup/radar .html pages.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every response.')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests that get a 503.')
+    parser.add_argument('--fail', action='append', default=[], choices=SOURCES, help='Source that always fails.')
+    parser.add_argument('--stale', type=float, default=0.0, help='Minutes that the GMU page is out of date.')
+    parser.add_argument('--humidity', type=float, default=60.0)
+    parser.add_argument('--wind', type=float, default=5.0)
+    parser.add_argument('--temperature', type=float, default=55.0)
+    parser.add_argument('--rain', type=float, default=0.0, help='Total rain in inches reported by the GMU page.')
+    parser.add_argument('--clouds', type=float, default=20.0, help='Percent of the sky covered by clouds.')
+    parser.add_argument('--cloud-speed', type=float, default=2.0, help='Cloud drift in pixels per minute.')
+    parser.add_argument('--rain-radius', type=float, default=10.0, help='Storm cell radius in km, 0 for no rain.')
+    parser.add_argument('--rain-distance', type=float, default=80.0, help='Starting km west of the site.')
+    parser.add_argument('--rain-speed', type=float, default=40.0, help='Storm cell speed in km/h.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--benchmark', type=int, default=0, metavar='CYCLES',
+                        help='Run this many condition checker cycles against the server, then exit.')
+    parser.add_argument('--verbose', action='store_true', help='Log every request.')
+    options = parser.parse_args()
+
+    config_path = options.config or os.path.abspath(os.path.join(os.path.dirname(__file__), r'..', r'config',
+                                                                 r'parameters_config.json'))
+    ObjectReader(Reader(config_path))
+    config = config_reader.get_config()
+    for (key, value) in source_urls(options.port).items():
+        setattr(config, key, value)
+    if options.write_config:
+        with open(config_path, 'r') as file:
+            text = json.load(file)
+        text['details'].update(source_urls(options.port))
+        with open(options.write_config, 'w') as file:
+            json.dump(text, file, indent=1)
+
+    from ..main.observing.cloud_cover import CloudCover
+    StandInHandler.state = WeatherState(options, config)
+    StandInHandler.bounds = CloudCover(None).bounds
+    server = ThreadingHTTPServer(('127.0.0.1', options.port), StandInHandler)
+    print('Serving stand-in weather sources on http://127.0.0.1:{}'.format(options.port))
+    if options.benchmark:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        benchmark(config, options.benchmark)
+        server.shutdown()
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()